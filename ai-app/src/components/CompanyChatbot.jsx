@@ -107,6 +107,28 @@ export default function CompanyChatbot() {
     }
   };
 
+  // options may still be generated in the background; long-poll for them
+  // (the server holds each poll for at most a few seconds, so poll up to a minute)
+  const showOptions = async (data) => {
+    if (data.options_status !== 'pending') {
+      setSuggestedOptions(data.options || []);
+      return;
+    }
+    try {
+      for (let attempt = 0; attempt < 12; attempt++) {
+        const response = await fetch(`${apiUrl}/session/${data.session_id}/options/?wait=20`);
+        if (!response.ok) return;
+        const result = await response.json();
+        if (result.options_status !== 'pending') {
+          setSuggestedOptions(result.options || []);
+          return;
+        }
+      }
+    } catch (err) {
+      console.error('Error loading options:', err);
+    }
+  };
+
   const handleInitialQuery = async (query) => {
     if (!query.trim()) return;
 
@@ -156,7 +178,7 @@ export default function CompanyChatbot() {
         data: data
       };
       setMessages(prev => [...prev, botMessage]);
-      setSuggestedOptions(data.options || []);
+      showOptions(data);
     } catch (err) {
       setError(err.message);
       const errorMessage = {
@@ -212,7 +234,7 @@ export default function CompanyChatbot() {
         data: data
       };
       setMessages(prev => [...prev, botMessage]);
-      setSuggestedOptions(data.options || []);
+      showOptions(data);
     } catch (err) {
       setError(err.message);
       const errorMessage = {
@@ -267,7 +289,7 @@ export default function CompanyChatbot() {
         data: data
       };
       setMessages(prev => [...prev, botMessage]);
-      setSuggestedOptions(data.options || []);
+      showOptions(data);
     } catch (err) {
       setError(err.message);
       const errorMessage = {
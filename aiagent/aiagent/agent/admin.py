@@ -1,5 +1,9 @@
 from django.contrib import admin
-from .models import Session
+from .models import CachedAnswer, CompanyProfile, OptionsJob, Session, Turn
 # Register your models here.
 
-admin.site.register(Session)
\ No newline at end of file
+admin.site.register(Session)
+admin.site.register(Turn)
+admin.site.register(OptionsJob)
+admin.site.register(CachedAnswer)
+admin.site.register(CompanyProfile)
@@ -0,0 +1,221 @@
+import hashlib
+import logging
+import random
+import struct
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from . import metrics
+from .classifier import TOKEN_RE
+from .metrics import timed
+from .models import CachedAnswer, CachedAnswerBand
+
+log = logging.getLogger("agent.answercache")
+
+
+# ---------------------------------------------------------
+# PERSISTENT ANSWER CACHE
+# ---------------------------------------------------------
+# An answer is stored under (topic, company, normalized question). Lookups
+# try that key first, then near-duplicate questions of the same topic and
+# company: MinHash signatures split into LSH bands, each band an indexed
+# row, so finding candidates is a handful of index probes however many
+# answers are stored. A candidate is only served if its words differ from
+# the question's by inflections or misspellings: never by a number or by a
+# word the other question lacks ("... in india" is not "... in usa").
+DEFAULTS = {
+    "enabled": True,
+    "threshold": 0.75,     # Jaccard similarity of the questions' shingles for a near-duplicate hit
+    "max_candidates": 50,
+    "ttl": {"default": 86400},
+}
+
+PERMUTATIONS = 128
+BANDS = 32                 # of PERMUTATIONS // BANDS rows each
+_PRIME = (1 << 61) - 1
+_rng = random.Random(7919)   # fixed: stored signatures must stay comparable
+_HASHES = [(_rng.randrange(1, _PRIME), _rng.randrange(0, _PRIME)) for _ in range(PERMUTATIONS)]
+
+STOPWORDS = frozenset(
+    "a an and are at about be can could do does for from give how i in is it me my of on or "
+    "please tell the there this to what whats when where which who why with you your".split()
+)
+
+# words asked interchangeably, folded to one before stemming
+SYNONYMS = {
+    **dict.fromkeys(("jobs", "hiring", "hire", "hires", "openings", "opening", "vacancy", "vacancies",
+                     "careers", "career", "recruiting", "recruitment"), "job"),
+    **dict.fromkeys(("salaries", "pay", "compensation", "ctc"), "salary"),
+}
+
+UPSERT_FIELDS = ["topic", "company", "question", "signature", "answer_raw", "created_at", "expires_at"]
+
+LOOKUPS = metrics.Counter(
+    "agent_answer_cache_total",
+    "Answer cache lookups by result (exact, near, miss) and answers stored.",
+    ("result",),
+)
+
+
+def _conf(key):
+    return getattr(settings, "AGENT_ANSWER_CACHE", {}).get(key, DEFAULTS[key])
+
+
+def enabled():
+    return _conf("enabled")
+
+
+def ttl_for(topic):
+    ttls = _conf("ttl")
+    return ttls.get(topic or "general", ttls.get("default", DEFAULTS["ttl"]["default"]))
+
+
+def _stem(token):
+    for suffix in ("ing", "es", "ed", "s"):
+        if len(token) > len(suffix) + 2 and token.endswith(suffix):
+            return token[:-len(suffix)]
+    return token
+
+
+def normalize_question(question, clarifiers=""):
+    """Content words of the question, stemmed, deduplicated and sorted."""
+    tokens = TOKEN_RE.findall(f"{question} {clarifiers or ''}".lower())
+    return " ".join(sorted({_stem(SYNONYMS.get(t, t)) for t in tokens if t not in STOPWORDS}))
+
+
+def _key(topic, company, normalized):
+    return hashlib.sha1(f"{topic}|{(company or '').lower()}|{normalized}".encode("utf-8")).hexdigest()
+
+
+def _trigrams(word):
+    padded = f"^{word}$"
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _shingles(normalized):
+    """Words plus character trigrams of each word, so near-spellings overlap."""
+    out = set()
+    for word in normalized.split():
+        out.add(word)
+        out.update(_trigrams(word))
+    return out
+
+
+def _variant(a, b):
+    """True when two words are spellings of one another; numbers never are."""
+    if any(c.isdigit() for c in a + b):
+        return False
+    x, y = _trigrams(a), _trigrams(b)
+    return len(x & y) >= len(x | y) / 2
+
+
+def same_terms(normalized, other):
+    """True when each word only one question has is a variant of one only the other has."""
+    x, y = set(normalized.split()), set(other.split())
+    only_x, only_y = x - y, y - x
+    return (all(any(_variant(a, b) for b in only_y) for a in only_x)
+            and all(any(_variant(b, a) for a in only_x) for b in only_y))
+
+
+def similarity(normalized, other):
+    """Jaccard similarity of two normalized questions' shingles."""
+    x, y = _shingles(normalized), _shingles(other)
+    return len(x & y) / len(x | y) if x | y else 1.0
+
+
+def signature(normalized):
+    """MinHash of the question's shingles: PERMUTATIONS 32-bit values."""
+    values = [int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=8).digest(), "big")
+              for s in _shingles(normalized)] or [0]
+    return [min((a * v + b) % _PRIME for v in values) & 0xFFFFFFFF for a, b in _HASHES]
+
+
+def _bands(topic, company, sig):
+    rows = PERMUTATIONS // BANDS
+    scope = f"{topic}|{(company or '').lower()}".encode("utf-8")
+    keys = []
+    for i in range(BANDS):
+        band = struct.pack(f">{rows}I", *sig[i * rows:(i + 1) * rows])
+        digest = hashlib.blake2b(scope + bytes([i]) + band, digest_size=8).digest()
+        keys.append(int.from_bytes(digest, "big", signed=True))
+    return keys
+
+
+def _pack(sig):
+    return struct.pack(f">{PERMUTATIONS}I", *sig)
+
+
+@timed("answer_cache")
+def lookup(topic, company, question, clarifiers=""):
+    """The cached raw answer for this question or a near-duplicate, or None."""
+    if not enabled():
+        return None
+    normalized = normalize_question(question, clarifiers)
+    now = timezone.now()
+    live = CachedAnswer.objects.filter(expires_at__gt=now)
+
+    entry = live.filter(key=_key(topic, company, normalized)).only("answer_raw").first()
+    if entry is not None:
+        LOOKUPS.inc(result="exact")
+        return entry.answer_raw
+
+    sig = signature(normalized)
+    candidates = (
+        live.filter(bands__band__in=_bands(topic, company, sig), topic=topic or "", company=company or "")
+        .values_list("pk", "question").distinct()[:_conf("max_candidates")]
+    )
+    best_pk, best = None, _conf("threshold")
+    for pk, other in candidates:
+        if not same_terms(normalized, other):
+            continue
+        score = similarity(normalized, other)
+        if score >= best:
+            best_pk, best = pk, score
+    if best_pk is not None:
+        LOOKUPS.inc(result="near")
+        return CachedAnswer.objects.only("answer_raw").get(pk=best_pk).answer_raw
+
+    LOOKUPS.inc(result="miss")
+    return None
+
+
+def store(topic, company, question, clarifiers, raw):
+    """Cache a freshly generated answer; also drops a few expired ones."""
+    if not enabled() or not raw:
+        return
+    normalized = normalize_question(question, clarifiers)
+    sig = signature(normalized)
+    now = timezone.now()
+    entry = CachedAnswer(
+        key=_key(topic, company, normalized),
+        topic=topic or "",
+        company=company or "",
+        question=normalized,
+        signature=_pack(sig),
+        answer_raw=raw,
+        created_at=now,
+        expires_at=now + timedelta(seconds=ttl_for(topic)),
+    )
+    try:
+        with transaction.atomic():
+            # an upsert first: the transaction takes SQLite's write lock at its
+            # first statement (waiting out other writers) instead of upgrading
+            # a read lock, which fails at once with "database is locked"
+            CachedAnswer.objects.bulk_create(
+                [entry], update_conflicts=True, unique_fields=["key"], update_fields=UPSERT_FIELDS,
+            )
+            if entry.pk is None:
+                entry.pk = CachedAnswer.objects.values_list("pk", flat=True).get(key=entry.key)
+            CachedAnswerBand.objects.filter(answer=entry).delete()
+            CachedAnswerBand.objects.bulk_create(
+                CachedAnswerBand(answer=entry, band=band) for band in _bands(topic, company, sig)
+            )
+            expired = CachedAnswer.objects.filter(expires_at__lt=now).values_list("pk", flat=True)[:100]
+            CachedAnswer.objects.filter(pk__in=list(expired)).delete()
+    except Exception:
+        log.warning("could not cache answer", exc_info=True)   # the cache never fails a request
+        return
+    LOOKUPS.inc(result="store")
@@ -0,0 +1,174 @@
+import hashlib
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+
+# ---------------------------------------------------------
+# IN-PROCESS TTL + LRU CACHE
+# ---------------------------------------------------------
+class TTLCache:
+    """Thread-safe bounded cache; least recently used entries are evicted first."""
+
+    def __init__(self, max_entries=512, ttl=900):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data = OrderedDict()   # key -> (expires_at, value)
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return default
+            expires_at, value = item
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+# ---------------------------------------------------------
+# TWO-TIER CACHE (PROCESS + OPTIONAL DJANGO CACHE)
+# ---------------------------------------------------------
+class TieredCache:
+    """
+    In-process TTLCache backed by an optional Django cache alias, so
+    separate workers can share entries (e.g. a DatabaseCache on SQLite).
+    """
+
+    def __init__(self, name, max_entries=512, ttl=900, shared_alias=None):
+        self.name = name
+        self.ttl = ttl
+        self.local = TTLCache(max_entries=max_entries, ttl=ttl)
+        self.shared_alias = shared_alias
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self._stats_lock = threading.Lock()
+
+    def _shared(self):
+        if not self.shared_alias:
+            return None
+        from django.core.cache import caches
+        return caches[self.shared_alias]
+
+    def _shared_key(self, key):
+        # hashed so free-text keys stay valid for every cache backend
+        digest = hashlib.sha1(key.encode("utf-8")).hexdigest()
+        return f"agent:{self.name}:{digest}"
+
+    def _count(self, field):
+        with self._stats_lock:
+            setattr(self, field, getattr(self, field) + 1)
+
+    def get(self, key):
+        value = self.local.get(key)
+        if value is not None:
+            self._count("hits")
+            return value
+
+        shared = self._shared()
+        if shared is not None:
+            try:
+                value = shared.get(self._shared_key(key))
+            except Exception:
+                value = None
+            if value is not None:
+                self.local.set(key, value)
+                self._count("shared_hits")
+                return value
+
+        self._count("misses")
+        return None
+
+    def set(self, key, value):
+        self.local.set(key, value)
+        shared = self._shared()
+        if shared is not None:
+            try:
+                shared.set(self._shared_key(key), value, timeout=self.ttl)
+            except Exception:
+                pass  # shared tier is best-effort
+
+    async def aget(self, key):
+        """Like get(), without blocking the event loop on the shared tier."""
+        value = self.local.get(key)
+        if value is not None:
+            self._count("hits")
+            return value
+
+        shared = self._shared()
+        if shared is not None:
+            try:
+                value = await shared.aget(self._shared_key(key))
+            except Exception:
+                value = None
+            if value is not None:
+                self.local.set(key, value)
+                self._count("shared_hits")
+                return value
+
+        self._count("misses")
+        return None
+
+    async def aset(self, key, value):
+        self.local.set(key, value)
+        shared = self._shared()
+        if shared is not None:
+            try:
+                await shared.aset(self._shared_key(key), value, timeout=self.ttl)
+            except Exception:
+                pass
+
+    def stats(self):
+        with self._stats_lock:
+            lookups = self.hits + self.shared_hits + self.misses
+            return {
+                "hits": self.hits,
+                "shared_hits": self.shared_hits,
+                "misses": self.misses,
+                "hit_ratio": round((self.hits + self.shared_hits) / lookups, 4) if lookups else 0.0,
+                "size": len(self.local),
+            }
+
+
+def normalize_query(text):
+    """Lowercase, drop surrounding punctuation and collapse whitespace."""
+    text = re.sub(r"\s+", " ", (text or "").lower()).strip()
+    return text.strip(" ?!.,;:")
+
+
+def build_cache(name, defaults):
+    """Create a TieredCache from settings.AGENT_CACHES[name] merged over `defaults`."""
+    conf = dict(defaults)
+    conf.update(getattr(settings, "AGENT_CACHES", {}).get(name, {}))
+    return TieredCache(
+        name,
+        max_entries=conf.get("max_entries", 512),
+        ttl=conf.get("ttl", 900),
+        shared_alias=conf.get("shared_alias"),
+    )
@@ -0,0 +1,121 @@
+import json
+import re
+from collections import Counter
+
+
+# ---------------------------------------------------------
+# WEIGHTED TOPIC CLASSIFIER
+# ---------------------------------------------------------
+# topic -> {keyword: weight}. Table order breaks ties between topics.
+DEFAULT_TOPIC_KEYWORDS = {
+    "job": {
+        "job": 1.0, "hiring": 1.0, "resume": 1.0, "interview": 1.0,
+        "salary": 1.0, "careers": 1.0, "career": 0.8, "recruiter": 0.8,
+    },
+    "finance": {
+        "stock": 1.0, "invest": 1.0, "investment": 1.0, "portfolio": 1.0,
+        "sip": 1.0, "nifty": 1.0, "crypto": 1.0, "mutual fund": 1.5,
+    },
+    "gaming": {
+        "game": 1.0, "gaming": 1.0, "unity": 1.0, "unreal": 1.0,
+        "developer": 0.3, "gamedev": 1.5,
+    },
+    "coding": {
+        "python": 1.0, "java": 1.0, "c++": 1.0, "leetcode": 1.0,
+        "algorithm": 1.0, "debug": 1.0,
+    },
+}
+
+# keyword variants matched as the same word (job -> jobs, invest -> investing)
+SUFFIXES = ("", "s", "es", "ing", "ed", "er", "ers", "or", "ors", "ment", "ments")
+
+TOKEN_RE = re.compile(r"[a-z0-9][a-z0-9+#]*")
+# bytes.translate table blanking every byte a token cannot contain
+_SEPARATORS = bytes(c if c in b"abcdefghijklmnopqrstuvwxyz0123456789+#" else 0x20 for c in range(256))
+
+
+def tokenize(text):
+    """
+    TOKEN_RE.findall(text) for lowercased text, split in C instead of one
+    regex match per token (several times faster on long snippets).
+    """
+    tokens = text.encode("ascii", "replace").translate(_SEPARATORS).decode("ascii").split()
+    if "+" in text or "#" in text:   # a token starts at a letter or digit
+        tokens = [t for t in (t.lstrip("+#") for t in tokens) if t]
+    return tokens
+
+
+class TopicClassifier:
+    """
+    Scores every topic in one pass over the tokens of the question and the
+    web snippets, multi-word keywords included. Question tokens count
+    `question_weight` times as much.
+    """
+
+    def __init__(self, keywords=None, question_weight=3.0):
+        self.keywords = keywords or DEFAULT_TOPIC_KEYWORDS
+        self.topics = list(self.keywords)
+        self.question_weight = question_weight
+
+        # token -> ((topic, weight), ...) including suffix variants; a
+        # multi-word keyword is indexed by its first token, with the rest of
+        # its tokens to match after it
+        table = {}
+        phrases = {}
+        for topic, words in self.keywords.items():
+            for word, weight in words.items():
+                tokens = TOKEN_RE.findall(word.lower())
+                if len(tokens) > 1:
+                    phrases.setdefault(tokens[0], {}).setdefault(tuple(tokens[1:]), []).append((topic, weight))
+                    continue
+                word = word.lower().strip()
+                for suffix in SUFFIXES:
+                    variant = table.setdefault(word + suffix, {})
+                    # the base word wins over a suffix variant of another keyword
+                    if topic not in variant or not suffix:
+                        variant[topic] = weight
+        self._table = {tok: tuple(hits.items()) for tok, hits in table.items()}
+        self._phrases = {first: [(list(rest), hits) for rest, hits in tails.items()] for first, tails in phrases.items()}
+
+    def _score(self, text, factor, scores):
+        if not text:
+            return
+        text = text.lower()
+        tokens = tokenize(text)
+        table = self._table
+        for token, count in Counter(filter(table.__contains__, tokens)).items():
+            for topic, weight in table[token]:
+                scores[topic] += weight * count * factor
+        # phrases only cost a look at the positions of their first token
+        for first, tails in self._phrases.items():
+            if first not in text:
+                continue
+            i = -1
+            while True:
+                try:
+                    i = tokens.index(first, i + 1)
+                except ValueError:
+                    break
+                for rest, hits in tails:
+                    if tokens[i + 1:i + 1 + len(rest)] == rest:
+                        for topic, weight in hits:
+                            scores[topic] += weight * factor
+
+    def rank(self, user_text, snippets=""):
+        """Return [(topic, confidence), ...] best first; empty if nothing matched."""
+        scores = dict.fromkeys(self.topics, 0.0)
+        self._score(user_text, self.question_weight, scores)
+        self._score(snippets, 1.0, scores)
+
+        total = sum(scores.values())
+        if not total:
+            return []
+        order = {t: i for i, t in enumerate(self.topics)}
+        ranked = sorted((t for t in scores if scores[t] > 0), key=lambda t: (-scores[t], order[t]))
+        return [(t, round(scores[t] / total, 4)) for t in ranked]
+
+    @classmethod
+    def from_file(cls, path, **kwargs):
+        """Load the keyword table from a JSON file: {"topic": {"keyword": weight}}."""
+        with open(path, encoding="utf-8") as fh:
+            return cls(json.load(fh), **kwargs)
@@ -0,0 +1,92 @@
+import zlib
+
+from django.conf import settings
+from django.db import models
+from django.db.models.query_utils import DeferredAttribute
+
+try:
+    import zstandard
+except ImportError:  # zlib is always available
+    zstandard = None
+
+
+# ---------------------------------------------------------
+# COMPRESSED TEXT STORAGE
+# ---------------------------------------------------------
+# Stored values are one codec byte followed by the payload (migration 0013
+# gave text stored before compression the RAW byte).
+RAW, ZLIB, ZSTD = b"r", b"z", b"s"
+
+
+def compress_text(text):
+    data = text.encode("utf-8")
+    codec = getattr(settings, "AGENT_COMPRESSION", "zstd")
+    if not codec or len(data) < getattr(settings, "AGENT_COMPRESS_MIN_BYTES", 256):
+        return RAW + data
+    if codec == "zstd" and zstandard is not None:
+        return ZSTD + zstandard.ZstdCompressor(level=6).compress(data)
+    return ZLIB + zlib.compress(data, 6)
+
+
+def decompress_text(value):
+    value = bytes(value)
+    codec, payload = value[:1], value[1:]
+    if codec == ZSTD:
+        if zstandard is None:
+            raise RuntimeError("zstandard is required to read zstd-compressed text")
+        return zstandard.ZstdDecompressor().decompress(payload).decode("utf-8")
+    if codec == ZLIB:
+        return zlib.decompress(payload).decode("utf-8")
+    if codec == RAW:
+        return payload.decode("utf-8")
+    raise ValueError(f"unknown compressed text codec {codec!r}")
+
+
+class CompressedTextAttribute(DeferredAttribute):
+    """Keeps the stored bytes until the attribute is first read."""
+
+    def __get__(self, instance, cls=None):
+        value = super().__get__(instance, cls)
+        if instance is not None and isinstance(value, (bytes, memoryview)):
+            value = decompress_text(value)
+            instance.__dict__[self.field.attname] = value
+        return value
+
+    def __set__(self, instance, value):
+        # a data descriptor, so reads go through __get__ even once loaded
+        instance.__dict__[self.field.attname] = value
+
+
+class CompressedTextField(models.BinaryField):
+    """
+    Text column stored compressed (zstd, or zlib if zstandard is missing).
+    Reads are decompressed lazily.
+    """
+    descriptor_class = CompressedTextAttribute
+
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault("editable", True)
+        super().__init__(*args, **kwargs)
+
+    def _check_str_default_value(self):
+        return []  # str defaults are the point of this field
+
+    def from_db_value(self, value, expression, connection):
+        return value  # decoded on first attribute access
+
+    def pre_save(self, model_instance, add):
+        # skip a decompress/compress round trip for values never read
+        return model_instance.__dict__.get(self.attname)
+
+    def get_db_prep_value(self, value, connection, prepared=False):
+        if isinstance(value, str):
+            value = compress_text(value)
+        return super().get_db_prep_value(value, connection, prepared)
+
+    def to_python(self, value):
+        if isinstance(value, (bytes, memoryview)):
+            return decompress_text(value)
+        return value
+
+    def value_to_string(self, obj):
+        return self.value_from_object(obj)
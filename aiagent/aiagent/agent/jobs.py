@@ -0,0 +1,128 @@
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import F, Q
+from django.utils import timezone
+
+from . import utils
+from .models import OptionsJob, Session, Turn
+
+log = logging.getLogger("agent.jobs")
+
+
+# ---------------------------------------------------------
+# BACKGROUND OPTION GENERATION (DB-BACKED QUEUE)
+# ---------------------------------------------------------
+def options_in_background():
+    """True when answers return before their follow-up options exist."""
+    return getattr(settings, "AGENT_OPTIONS_MODE", "background") == "background"
+
+
+def _lease():
+    # a running job older than this belongs to a worker that died
+    return timedelta(seconds=getattr(settings, "AGENT_OPTIONS_JOB_LEASE", 120))
+
+
+def _claimable():
+    now = timezone.now()
+    return Q(status=OptionsJob.PENDING) | Q(status=OptionsJob.RUNNING, started_at__lt=now - _lease())
+
+
+def claim(job_id):
+    """Mark one job running if nobody else has; returns the job or None."""
+    claimed = OptionsJob.objects.filter(_claimable(), pk=job_id).update(
+        status=OptionsJob.RUNNING, started_at=timezone.now(), attempts=F("attempts") + 1
+    )
+    if not claimed:
+        return None
+    return OptionsJob.objects.select_related("turn").get(pk=job_id)
+
+
+def claim_batch(limit):
+    """Claim up to `limit` of the oldest claimable jobs."""
+    ids = OptionsJob.objects.filter(_claimable()).order_by("created_at").values_list("pk", flat=True)[:limit]
+    return [job for job in (claim(pk) for pk in list(ids)) if job is not None]
+
+
+def run_job(job):
+    """Generate and store the options of a claimed job's turn."""
+    turn = job.turn
+    max_attempts = getattr(settings, "AGENT_OPTIONS_JOB_ATTEMPTS", 3)
+    try:
+        tavily_context = utils.tavily_search_text(turn.company or turn.topic or "general")
+        options = utils.dynamic_options_ai(turn.topic, turn.company, turn.answer_json, tavily_context)
+        store_options(turn, options)
+    except Exception as e:
+        log.exception("options job %s failed", job.pk)
+        if job.attempts < max_attempts:
+            OptionsJob.objects.filter(pk=job.pk).update(status=OptionsJob.PENDING, error=str(e))
+            return
+        store_options(turn, list(utils.DEFAULT_OPTIONS))
+        OptionsJob.objects.filter(pk=job.pk).update(
+            status=OptionsJob.FAILED, finished_at=timezone.now(), error=str(e)
+        )
+        return
+    OptionsJob.objects.filter(pk=job.pk).update(status=OptionsJob.DONE, finished_at=timezone.now(), error="")
+
+
+def store_options(turn, options):
+    Turn.objects.filter(pk=turn.pk).update(options=options)
+    # the session head only follows if no later turn has been appended, but
+    # the session changed either way (see views._session_etag)
+    Session.objects.filter(pk=turn.session_id).update(options_version=F("options_version") + 1)
+    Session.objects.filter(pk=turn.session_id, turn_count=turn.ordinal).update(head_options=options)
+
+
+def options_state(turn):
+    """("pending" | "ready" | "failed", options) for one turn."""
+    status = OptionsJob.objects.filter(turn=turn).values_list("status", flat=True).first()
+    if status in (OptionsJob.PENDING, OptionsJob.RUNNING):
+        return "pending", []
+    options = Turn.objects.filter(pk=turn.pk).values_list("options", flat=True).first() or []
+    return ("failed" if status == OptionsJob.FAILED else "ready"), options
+
+
+def run_if_stalled(turn):
+    """
+    Run a turn's job in the calling request if no worker has claimed it
+    within AGENT_OPTIONS_INLINE_AFTER seconds, so clients still get options
+    when the worker is not running.
+    """
+    after = timedelta(seconds=getattr(settings, "AGENT_OPTIONS_INLINE_AFTER", 5))
+    job_id = (
+        OptionsJob.objects.filter(turn=turn, status=OptionsJob.PENDING, created_at__lt=timezone.now() - after)
+        .values_list("pk", flat=True).first()
+    )
+    job = claim(job_id) if job_id else None
+    if job is not None:
+        run_job(job)
+
+
+def latest_options(session):
+    """
+    options_state() of the session's latest turn, after running its job
+    here if it stalled. ("missing", []) for a turn stored before options
+    were kept, which has neither options nor a job.
+    """
+    turn = _latest_turn(session)
+    if turn is None or not OptionsJob.objects.filter(turn=turn).exists():
+        return "missing", []
+    run_if_stalled(turn)
+    return options_state(turn)
+
+
+def replace_options(session, options):
+    """Store options regenerated on request for the latest turn, superseding a queued job."""
+    turn = _latest_turn(session)
+    if turn is None:
+        return
+    OptionsJob.objects.filter(turn=turn, status=OptionsJob.PENDING).update(
+        status=OptionsJob.DONE, finished_at=timezone.now(), error="superseded"
+    )
+    store_options(turn, options)
+    session.head_options = options
+
+
+def _latest_turn(session):
+    return Turn.objects.only("id", "session_id", "ordinal").filter(session=session, ordinal=session.turn_count).first()
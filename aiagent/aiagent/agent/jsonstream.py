@@ -0,0 +1,136 @@
+import json
+
+
+# ---------------------------------------------------------
+# INCREMENTAL JSON OBJECT PARSER
+# ---------------------------------------------------------
+class IncrementalJSONParser:
+    """
+    Parses one JSON object out of model output delivered in chunks.
+
+    Text before the first "{" (code fences, chatter) and after the matching
+    "}" is ignored. Each top-level member is decoded once, as soon as its
+    value is complete, and returned from feed():
+
+        parser = IncrementalJSONParser()
+        for chunk in stream:
+            for key, value in parser.feed(chunk):
+                ...                      # e.g. render "summary" early
+        answer = parser.close()          # dict, or None if not valid JSON
+
+    As with json.loads, stray text between members, empty members and
+    trailing commas make the object invalid.
+    """
+
+    def __init__(self):
+        self.text = ""           # the object from "{" up to what has been seen
+        self.result = {}
+        self.valid = True
+        self.done = False
+        self._scan = 0           # next offset of self.text to look at
+        self._depth = 0
+        self._in_string = False
+        self._key = None
+        self._key_start = None
+        self._value_start = None
+        self._after_comma = False   # a member must follow
+
+    def feed(self, chunk):
+        if self.done or not chunk:
+            return []
+        if not self.text:
+            start = chunk.find("{")
+            if start < 0:
+                return []
+            chunk = chunk[start:]
+
+        self.text += chunk
+        text, n, pos = self.text, len(self.text), self._scan
+        completed = []
+
+        while pos < n:
+            if self._in_string:
+                # jump to the next quote that is not backslash-escaped
+                q = text.find('"', pos)
+                if q < 0:
+                    pos = n
+                    break
+                slashes = 0
+                while text[q - 1 - slashes] == "\\":
+                    slashes += 1
+                pos = q + 1
+                if slashes % 2 == 0:
+                    self._in_string = False
+                continue
+
+            ch = text[pos]
+            if ch.isspace():
+                pos += 1
+                continue
+            if self._depth == 1 and self._value_start is None and ch not in "}":
+                # between members only a key string and its ":" may appear
+                if ch == '"' and self._key_start is None:
+                    self._key_start = pos
+                elif ch == ":" and self._key_start is not None:
+                    self._key = self._decode(text[self._key_start:pos])
+                    self._value_start = pos + 1
+                else:
+                    self.valid = False
+                if ch == '"':
+                    self._in_string = True
+            elif ch == '"':
+                self._in_string = True
+            elif ch in "{[":
+                self._depth += 1
+            elif ch in "}]":
+                self._depth -= 1
+                if self._depth == 0:
+                    if ch == "]" or (self._after_comma and self._key_start is None):
+                        self.valid = False   # mismatched bracket or trailing comma
+                    self._end_member(pos, completed)
+                    self.text = text[:pos + 1]
+                    self.done = True
+                    break
+            elif self._depth == 1 and ch == ",":
+                self._end_member(pos, completed)
+                self._after_comma = True
+            pos += 1
+
+        self._scan = pos
+        return completed
+
+    def _decode(self, fragment):
+        try:
+            return json.loads(fragment)
+        except ValueError:
+            self.valid = False
+            return None
+
+    def _end_member(self, end, completed):
+        """Decode the member whose value ends just before offset `end`."""
+        if self._value_start is not None and self._key is not None:
+            fragment = self.text[self._value_start:end]
+            try:
+                value = json.loads(fragment)
+            except ValueError:
+                self.valid = False
+            else:
+                self.result[self._key] = value
+                completed.append((self._key, value))
+        elif self._key_start is not None:
+            self.valid = False   # key without a value
+        self._key = self._key_start = self._value_start = None
+        self._after_comma = False
+
+    def close(self):
+        """The parsed object, or None if no complete valid object was seen."""
+        if self.done and self.valid:
+            return self.result
+        return None
+
+
+def parse_json_object(raw):
+    """One-shot helper: (parsed dict or None, object text)."""
+    parser = IncrementalJSONParser()
+    parser.feed(raw or "")
+    return parser.close(), parser.text
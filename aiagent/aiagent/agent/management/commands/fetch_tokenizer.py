@@ -0,0 +1,35 @@
+import hashlib
+import os
+
+import requests
+from django.core.management.base import BaseCommand, CommandError
+
+from agent import prompting
+
+
+class Command(BaseCommand):
+    help = "Download tiktoken's cl100k_base into AGENT_TOKENIZER_DIR, where count_tokens() loads it from."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--force", action="store_true", help="download even if the file is there")
+        parser.add_argument("--timeout", type=float, default=60)
+
+    def handle(self, *args, **opts):
+        path = prompting.tokenizer_file()
+        if os.path.exists(path) and not opts["force"]:
+            self.stdout.write(f"{path} already there")
+            return
+        try:
+            resp = requests.get(prompting.CL100K_URL, timeout=opts["timeout"])
+            resp.raise_for_status()
+        except requests.RequestException as e:
+            raise CommandError(f"could not download cl100k_base: {e}")
+        if hashlib.sha256(resp.content).hexdigest() != prompting.CL100K_SHA256:
+            raise CommandError("cl100k_base download does not match its sha256")
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(resp.content)
+        os.replace(tmp, path)
+        self.stdout.write(f"wrote {path} ({len(resp.content)} bytes); commit it so deploys never download it")
@@ -0,0 +1,55 @@
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from agent.fields import compress_text, decompress_text
+from agent.models import Session, Turn
+
+
+def _text(value):
+    return None if value is None else decompress_text(value)
+
+
+class Command(BaseCommand):
+    help = (
+        "Rewrite stored answers with the configured compression and drop "
+        "answer_raw copies that are identical to answer_json."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500)
+        parser.add_argument("--vacuum", action="store_true",
+                            help="VACUUM the SQLite database afterwards to release freed pages")
+
+    def handle(self, *args, **opts):
+        batch_size = opts["batch_size"]
+        before = after = 0
+        last_id = 0
+
+        while True:
+            # raw column values, so nothing is decoded through the model
+            rows = list(
+                Turn.objects.filter(id__gt=last_id).order_by("id")
+                .values_list("id", "answer_json", "answer_raw")[:batch_size]
+            )
+            if not rows:
+                break
+            with transaction.atomic():
+                for turn_id, answer_json, answer_raw in rows:
+                    before += len(answer_json or b"") + len(answer_raw or b"")
+                    text = _text(answer_json) or ""
+                    raw = _text(answer_raw)
+                    new_json = compress_text(text)
+                    new_raw = None if raw is None or raw == text else compress_text(raw)
+                    after += len(new_json) + len(new_raw or b"")
+                    Turn.objects.filter(id=turn_id).update(answer_json=new_json, answer_raw=new_raw)
+            last_id = rows[-1][0]
+
+        for sid, head in Session.objects.values_list("id", "head_answer_json").iterator():
+            Session.objects.filter(id=sid).update(head_answer_json=compress_text(_text(head) or ""))
+
+        self.stdout.write(f"turn answers: {before} -> {after} bytes")
+
+        if opts["vacuum"] and connection.vendor == "sqlite":
+            with connection.cursor() as cursor:
+                cursor.execute("VACUUM")
+            self.stdout.write("database vacuumed")
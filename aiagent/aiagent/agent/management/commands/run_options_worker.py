@@ -0,0 +1,47 @@
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from agent import jobs
+
+
+def _run(job):
+    try:
+        jobs.run_job(job)
+    finally:
+        connections.close_all()  # pool threads keep no idle DB connections
+
+
+class Command(BaseCommand):
+    help = "Generate follow-up options for queued OptionsJob rows (the background options queue)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--concurrency", type=int, default=4, help="jobs processed at once")
+        parser.add_argument("--poll-interval", type=float, default=0.5,
+                            help="seconds to sleep when the queue is empty")
+        parser.add_argument("--once", action="store_true", help="drain the queue and exit")
+
+    def handle(self, *args, **opts):
+        concurrency = opts["concurrency"]
+        done = 0
+        running = set()
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="options-worker") as pool:
+            try:
+                while True:
+                    # refill free slots as jobs finish, instead of waiting for a whole batch
+                    if len(running) < concurrency:
+                        running |= {pool.submit(_run, job) for job in jobs.claim_batch(concurrency - len(running))}
+                    if not running:
+                        if opts["once"]:
+                            break
+                        time.sleep(opts["poll_interval"])
+                        continue
+                    finished, running = wait(running, timeout=opts["poll_interval"], return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        future.result()
+                    done += len(finished)
+            except KeyboardInterrupt:
+                pass
+        self.stdout.write(f"processed {done} options jobs")
@@ -0,0 +1,51 @@
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from django.core.management.base import BaseCommand
+
+from agent import profiles, utils
+
+log = logging.getLogger("agent.profiles")
+
+
+class Command(BaseCommand):
+    help = "Generate missing or stale CompanyProfile rows (KNOWN_COMPANIES by default)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("companies", nargs="*", help="companies to warm instead of KNOWN_COMPANIES")
+        parser.add_argument("--concurrency", type=int, default=4, help="profiles generated at once")
+        parser.add_argument("--force", action="store_true", help="regenerate fresh profiles too")
+        parser.add_argument("--loop", action="store_true",
+                            help="keep running, refreshing stale profiles every --interval seconds")
+        parser.add_argument("--interval", type=float, default=3600)
+
+    def handle(self, *args, **opts):
+        companies = opts["companies"] or profiles.known_companies()
+        force = opts["force"]
+        with ThreadPoolExecutor(max_workers=opts["concurrency"], thread_name_prefix="profile-warmer") as pool:
+            try:
+                while True:
+                    todo = companies if force else profiles.stale(companies)
+                    self.stdout.write(f"refreshed {self.warm(pool, todo)} of {len(todo)} stale profiles "
+                                      f"({len(companies) - len(todo)} fresh)")
+                    if not opts["loop"]:
+                        break
+                    force = False
+                    time.sleep(opts["interval"])
+            except KeyboardInterrupt:
+                pass
+
+    def warm(self, pool, companies):
+        # generation runs on the pool; rows are written from this thread only,
+        # so SQLite never sees concurrent writers
+        futures = {pool.submit(utils.generate_company_profile, c): c for c in companies}
+        done = 0
+        for future in as_completed(futures):
+            company = futures[future]
+            try:
+                profiles.save(company, future.result())
+                done += 1
+            except Exception:
+                log.exception("could not refresh the profile of %s", company)
+        return done
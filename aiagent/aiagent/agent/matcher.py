@@ -0,0 +1,113 @@
+from collections import deque
+
+
+# ---------------------------------------------------------
+# AHO-CORASICK COMPANY MATCHER
+# ---------------------------------------------------------
+class CompanyMatcher:
+    """
+    Finds company names/aliases in free text in a single pass.
+
+    Built from (alias, canonical) pairs; earlier pairs have higher priority.
+    Matches only count on word boundaries, so "ea" does not fire inside
+    "ideas" and "arm" does not fire inside "pharmacy".
+    """
+
+    def __init__(self, entries):
+        self._goto = [{}]        # state -> {char: next_state}
+        self._fail = [0]
+        self._out = [()]         # state -> ((length, priority, canonical), ...)
+        self.size = 0
+
+        for priority, (alias, canonical) in enumerate(entries):
+            alias = " ".join(alias.lower().split())
+            if alias:
+                self._add(alias, priority, canonical)
+                self.size += 1
+        self._build_links()
+
+    def _add(self, alias, priority, canonical):
+        state = 0
+        for ch in alias:
+            nxt = self._goto[state].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[state][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append(())
+            state = nxt
+        self._out[state] += ((len(alias), priority, canonical),)
+
+    def _build_links(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self._goto[state].items():
+                queue.append(nxt)
+                f = self._fail[state]
+                while f and ch not in self._goto[f]:
+                    f = self._fail[f]
+                link = self._goto[f].get(ch, 0)
+                self._fail[nxt] = link if link != nxt else 0
+                # inherit matches that end here via a shorter suffix
+                self._out[nxt] += self._out[self._fail[nxt]]
+
+    def iter_matches(self, text):
+        """Yield (start, end, priority, canonical) for every word-bounded match."""
+        t = " ".join((text or "").lower().split())
+        goto, fail, out = self._goto, self._fail, self._out
+        n = len(t)
+        state = 0
+        for i, ch in enumerate(t):
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            if not out[state]:
+                continue
+            end = i + 1
+            if end < n and t[end].isalnum():
+                continue
+            for length, priority, canonical in out[state]:
+                start = end - length
+                if start == 0 or not t[start - 1].isalnum():
+                    yield start, end, priority, canonical
+
+    def find(self, text):
+        """
+        Company that is the whole of `text`, else the highest-priority
+        company mentioned in it, or None.
+        """
+        n = len(" ".join((text or "").split()))
+        best = None
+        for start, end, priority, canonical in self.iter_matches(text):
+            if start == 0 and end == n:
+                return canonical
+            if best is None or priority < best[0]:
+                best = (priority, canonical)
+        return best[1] if best else None
+
+    @classmethod
+    def from_names(cls, names):
+        """Matcher where every name is its own alias, displayed title-cased."""
+        return cls((n, n.title()) for n in names)
+
+    @classmethod
+    def from_file(cls, path):
+        """
+        Load a gazetteer file, one company per line, most important first:
+
+            Canonical Name | alias one | alias two
+
+        Blank lines and lines starting with '#' are ignored.
+        """
+        entries = []
+        with open(path, encoding="utf-8") as fh:
+            for line in fh:
+                line = line.strip()
+                if not line or line.startswith("#"):
+                    continue
+                names = [p.strip() for p in line.split("|") if p.strip()]
+                canonical = names[0]
+                entries.extend((alias, canonical) for alias in names)
+        return cls(entries)
@@ -0,0 +1,154 @@
+import bisect
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+
+# ---------------------------------------------------------
+# PROMETHEUS METRICS (text exposition format, per process)
+# ---------------------------------------------------------
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40)
+TOKEN_BUCKETS = (64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384)
+
+_registry = []
+_collectors = []
+
+
+def _label_text(labelnames, values):
+    if not labelnames:
+        return ""
+    pairs = ",".join(
+        '%s="%s"' % (k, str(v).replace("\\", r"\\").replace('"', r"\"").replace("\n", r"\n"))
+        for k, v in zip(labelnames, values)
+    )
+    return "{" + pairs + "}"
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, help, labelnames=()):
+        self.name, self.help, self.labelnames = name, help, tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(k, "") for k in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def expose(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_label_text(self.labelnames, key)} {_number(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name, self.help, self.labelnames = name, help, tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}   # labels -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(k, "") for k in self.labelnames)
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 2)
+            if i < len(self.buckets):
+                series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def expose(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        names = self.labelnames + ("le",)
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                cumulative = 0
+                for bound, n in zip(self.buckets, series):
+                    cumulative += n
+                    lines.append(f"{self.name}_bucket{_label_text(names, key + (_number(bound),))} {cumulative}")
+                lines.append(f'{self.name}_bucket{_label_text(names, key + ("+Inf",))} {series[-1]}')
+                lines.append(f"{self.name}_sum{_label_text(self.labelnames, key)} {_number(float(series[-2]))}")
+                lines.append(f"{self.name}_count{_label_text(self.labelnames, key)} {series[-1]}")
+        return lines
+
+
+def register_collector(fn):
+    """
+    Add a callable evaluated at scrape time. It returns a list of
+    (name, type, help, labelnames, [(label_values, value), ...]).
+    """
+    _collectors.append(fn)
+    return fn
+
+
+def render():
+    """All metrics of this process in Prometheus text format."""
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.expose())
+    for collect in _collectors:
+        for name, kind, help, labelnames, samples in collect():
+            lines += [f"# HELP {name} {help}", f"# TYPE {name} {kind}"]
+            lines += [f"{name}{_label_text(labelnames, labels)} {_number(value)}" for labels, value in samples]
+    return "\n".join(lines) + "\n"
+
+
+REQUEST_SECONDS = Histogram("agent_request_duration_seconds", "API request latency.", ("view", "status"))
+STAGE_SECONDS = Histogram("agent_stage_duration_seconds", "Latency of one pipeline stage.", ("stage",))
+UPSTREAM_ERRORS = Counter("agent_upstream_errors_total", "Failed upstream calls.", ("upstream", "reason"))
+PROMPT_TOKENS = Histogram("agent_prompt_tokens", "Prompt size per Gemini call.", ("kind",), TOKEN_BUCKETS)
+RESPONSE_TOKENS = Histogram("agent_response_tokens", "Response size per Gemini call.", ("kind",), TOKEN_BUCKETS)
+
+
+# ---------------------------------------------------------
+# PER-REQUEST STAGE TIMINGS
+# ---------------------------------------------------------
+class RequestTimings:
+    """Stage durations of one request (shared with its worker threads)."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages = {}
+        self._lock = threading.Lock()
+
+    def add(self, stage, seconds):
+        with self._lock:
+            self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.stages)
+
+
+current_timings = contextvars.ContextVar("agent_request_timings", default=None)
+
+
+@contextmanager
+def timed(stage):
+    """
+    Time a block (or, as a decorator, a function) as `stage`: recorded in
+    the stage histogram and in the current request's timings, if any.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.observe(elapsed, stage=stage)
+        timings = current_timings.get()
+        if timings is not None:
+            timings.add(stage, elapsed)
@@ -0,0 +1,72 @@
+import json
+import logging
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+from .metrics import REQUEST_SECONDS, RequestTimings, current_timings
+
+request_log = logging.getLogger("agent.request")
+
+
+class StageTimingMiddleware:
+    """
+    Collects the stage timings of each /api/ request and reports them as a
+    Server-Timing header, one structured log line, and the request
+    latency histogram. Works for both sync and async views.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not request.path.startswith("/api/"):
+            return self.get_response(request)
+        timings = RequestTimings()
+        token = current_timings.set(timings)
+        try:
+            response = self.get_response(request)
+        finally:
+            current_timings.reset(token)
+        self.report(request, response, timings)
+        return response
+
+    async def __acall__(self, request):
+        if not request.path.startswith("/api/"):
+            return await self.get_response(request)
+        timings = RequestTimings()
+        token = current_timings.set(timings)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_timings.reset(token)
+        self.report(request, response, timings)
+        return response
+
+    def report(self, request, response, timings):
+        total = time.perf_counter() - timings.started
+        stages = timings.snapshot()
+        # streamed responses: only the stages finished before the headers
+        response["Server-Timing"] = ", ".join(
+            [f"{name};dur={seconds * 1000:.1f}" for name, seconds in stages.items()]
+            + [f"total;dur={total * 1000:.1f}"]
+        )
+
+        match = getattr(request, "resolver_match", None)
+        view = match.url_name if match and match.url_name else "unmatched"
+        REQUEST_SECONDS.observe(total, view=view, status=response.status_code)
+        request_log.info(json.dumps({
+            "method": request.method,
+            "path": request.path,
+            "view": view,
+            "status": response.status_code,
+            "streaming": response.streaming,
+            "duration_ms": round(total * 1000, 1),
+            "stages_ms": {name: round(seconds * 1000, 1) for name, seconds in stages.items()},
+        }))
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.8 on 2026-10-17 19:47
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('agent', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Turn',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ordinal', models.PositiveIntegerField()),
+                ('question', models.TextField(blank=True, default='')),
+                ('clarifiers', models.TextField(blank=True, default='')),
+                ('topic', models.CharField(blank=True, max_length=100, null=True)),
+                ('company', models.CharField(blank=True, max_length=200, null=True)),
+                ('answer_json', models.TextField(blank=True, default='')),
+                ('answer_raw', models.TextField(blank=True, default='')),
+                ('options', models.JSONField(blank=True, default=list)),
+                ('created_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+                ('session', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='turns', to='agent.session')),
+            ],
+            options={
+                'ordering': ['session', 'ordinal'],
+                'constraints': [models.UniqueConstraint(fields=('session', 'ordinal'), name='unique_turn_ordinal')],
+            },
+        ),
+    ]
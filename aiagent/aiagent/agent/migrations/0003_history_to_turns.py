@@ -0,0 +1,59 @@
+from django.db import migrations
+
+
+def history_to_turns(apps, schema_editor):
+    Session = apps.get_model('agent', 'Session')
+    Turn = apps.get_model('agent', 'Turn')
+    batch = []
+    for session in Session.objects.iterator():
+        for ordinal, entry in enumerate(session.history or [], start=1):
+            batch.append(Turn(
+                session_id=session.id,
+                ordinal=ordinal,
+                question=entry.get('question') or '',
+                clarifiers=entry.get('clarifiers') or '',
+                topic=entry.get('topic'),
+                company=entry.get('company'),
+                answer_json=entry.get('answer_json') or '',
+                answer_raw=entry.get('answer_raw') or '',
+                options=entry.get('options') or [],
+                # old entries only carried the session timestamp
+                created_at=session.created_at,
+            ))
+        if len(batch) >= 500:
+            Turn.objects.bulk_create(batch)
+            batch = []
+    Turn.objects.bulk_create(batch)
+
+
+def turns_to_history(apps, schema_editor):
+    Session = apps.get_model('agent', 'Session')
+    Turn = apps.get_model('agent', 'Turn')
+    for session in Session.objects.iterator():
+        session.history = [
+            {
+                'question': t.question,
+                'clarifiers': t.clarifiers,
+                'topic': t.topic,
+                'company': t.company,
+                'answer_json': t.answer_json,
+                'answer_raw': t.answer_raw,
+                'options': t.options,
+                'ts': str(t.created_at),
+            }
+            for t in Turn.objects.filter(session_id=session.id).order_by('ordinal')
+        ]
+        session.save(update_fields=['history'])
+    # the history is the copy again; re-running the forward step recreates the turns
+    Turn.objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('agent', '0002_turn'),
+    ]
+
+    operations = [
+        migrations.RunPython(history_to_turns, turns_to_history),
+    ]
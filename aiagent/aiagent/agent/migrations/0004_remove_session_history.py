@@ -0,0 +1,17 @@
+# Generated by Django 5.2.8 on 2026-10-17 19:47
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('agent', '0003_history_to_turns'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='session',
+            name='history',
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.2.8 on 2026-10-17 19:48
+
+from django.db import migrations, models
+
+
+def fill_heads(apps, schema_editor):
+    Session = apps.get_model('agent', 'Session')
+    Turn = apps.get_model('agent', 'Turn')
+    for session in Session.objects.iterator():
+        last = Turn.objects.filter(session_id=session.id).order_by('-ordinal').first()
+        if last is None:
+            continue
+        session.turn_count = last.ordinal
+        session.head_answer_json = last.answer_json
+        session.head_options = last.options
+        session.save(update_fields=['turn_count', 'head_answer_json', 'head_options'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('agent', '0004_remove_session_history'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='session',
+            name='head_answer_json',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.AddField(
+            model_name='session',
+            name='head_options',
+            field=models.JSONField(blank=True, default=list),
+        ),
+        migrations.AddField(
+            model_name='session',
+            name='turn_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(fill_heads, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.8 on 2026-10-17 19:50
+
+import agent.fields
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('agent', '0005_session_head'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='session',
+            name='head_answer_json',
+            field=agent.fields.CompressedTextField(blank=True, default='', editable=True),
+        ),
+        migrations.AlterField(
+            model_name='turn',
+            name='answer_json',
+            field=agent.fields.CompressedTextField(blank=True, default='', editable=True),
+        ),
+        migrations.AlterField(
+            model_name='turn',
+            name='answer_raw',
+            field=agent.fields.CompressedTextField(blank=True, editable=True, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-17 20:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('agent', '0006_compressed_text'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='session',
+            name='context_summary',
+            field=models.TextField(blank=True, default=''),
+        ),
+    ]
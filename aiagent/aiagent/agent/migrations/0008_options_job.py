@@ -0,0 +1,31 @@
+# Generated by Django 5.2.8 on 2026-10-17 20:11
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('agent', '0007_session_context_summary'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OptionsJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('pending', 'pending'), ('running', 'running'), ('done', 'done'), ('failed', 'failed')], default='pending', max_length=10)),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('error', models.TextField(blank=True, default='')),
+                ('turn', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='options_job', to='agent.turn')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'created_at'], name='options_job_queue')],
+            },
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.8 on 2026-10-17 20:17
+
+import agent.fields
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('agent', '0008_options_job'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CachedAnswer',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=40, unique=True)),
+                ('topic', models.CharField(blank=True, default='', max_length=100)),
+                ('company', models.CharField(blank=True, default='', max_length=200)),
+                ('question', models.TextField(blank=True, default='')),
+                ('signature', models.BinaryField()),
+                ('answer_raw', agent.fields.CompressedTextField(blank=True, default='', editable=True)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('expires_at', models.DateTimeField(db_index=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='CachedAnswerBand',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('band', models.BigIntegerField(db_index=True)),
+                ('answer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='bands', to='agent.cachedanswer')),
+            ],
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.8 on 2026-10-17 20:21
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('agent', '0009_answer_cache'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CompanyProfile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('company', models.CharField(max_length=200, unique=True)),
+                ('profile', models.JSONField(default=dict)),
+                ('refreshed_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+            ],
+        ),
+    ]
@@ -0,0 +1,18 @@
+from django.db import migrations
+
+
+def clear_cached_answers(apps, schema_editor):
+    # signatures grew to 128 permutations and normalization folds synonyms;
+    # entries written before cannot be matched, so they are dropped
+    apps.get_model('agent', 'CachedAnswer').objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('agent', '0010_company_profile'),
+    ]
+
+    operations = [
+        migrations.RunPython(clear_cached_answers, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-17 20:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('agent', '0011_answer_cache_resignature'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='session',
+            name='options_version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
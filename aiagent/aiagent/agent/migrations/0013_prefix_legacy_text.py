@@ -0,0 +1,36 @@
+from django.db import migrations
+
+RAW = b'r'   # agent.fields.RAW
+
+# text columns that held plain TEXT before 0006 made them CompressedTextFields
+LEGACY_COLUMNS = [
+    ('Turn', 'answer_json'),
+    ('Turn', 'answer_raw'),
+    ('Session', 'head_answer_json'),
+]
+
+
+def prefix_legacy_text(apps, schema_editor):
+    # rows written before compression still hold TEXT values (read back as
+    # str, not bytes); give them the RAW codec byte so every stored value
+    # starts with one and decompress_text never has to guess
+    for model_name, column in LEGACY_COLUMNS:
+        model = apps.get_model('agent', model_name)
+        rows = model.objects.order_by('pk').values_list('pk', column)
+        batch = list(rows[:500])
+        while batch:
+            for pk, value in batch:
+                if isinstance(value, str):
+                    model.objects.filter(pk=pk).update(**{column: RAW + value.encode('utf-8')})
+            batch = list(rows.filter(pk__gt=batch[-1][0])[:500])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('agent', '0012_session_options_version'),
+    ]
+
+    operations = [
+        migrations.RunPython(prefix_legacy_text, migrations.RunPython.noop),
+    ]
@@ -1,15 +1,193 @@
-from django.db import models
+from django.db import models, transaction, IntegrityError
 import uuid
 from django.utils import timezone
+from .fields import CompressedTextField
+from .prompting import compact_history
+from django.conf import settings
 # If not using Postgres, use models.JSONField (Django 3.1+)
 
 class Session(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     company = models.CharField(max_length=200, blank=True, null=True)
     last_topic = models.CharField(max_length=100, blank=True, null=True)
-    history = models.JSONField(default=list)   # list of {question,topic,company,answer_json,raw,ts}
     created_at = models.DateTimeField(default=timezone.now)
 
-    def append_history(self, entry):
-        self.history.append(entry)
-        self.save(update_fields=["history"])
+    # denormalized copy of the latest turn, so follow-ups read one row
+    turn_count = models.PositiveIntegerField(default=0)
+    head_answer_json = CompressedTextField(blank=True, default="")
+    head_options = models.JSONField(default=list, blank=True)
+    # bumped whenever any turn's options are written; with turn_count it versions the session
+    options_version = models.PositiveIntegerField(default=0)
+    # one line per turn, oldest dropped first to stay within AGENT_SUMMARY_BUDGET
+    context_summary = models.TextField(blank=True, default="")
+
+    @property
+    def history(self):
+        """All turns as {question,topic,company,answer_json,raw,ts} dicts, oldest first."""
+        return [t.as_entry() for t in self.turns.order_by("ordinal")]
+
+    def head(self):
+        """What a follow-up needs from the latest turn, without touching the Turn table."""
+        if not self.turn_count:
+            return {}
+        return {
+            "topic": self.last_topic,
+            "company": self.company,
+            "answer_json": self.head_answer_json,
+            "options": self.head_options,
+        }
+
+    def prompt_context(self):
+        """Session context handed to follow-up prompts."""
+        context = {"company": self.company, "topic": self.last_topic}
+        if self.context_summary:
+            context["conversation_so_far"] = self.context_summary
+        return context
+
+    def append_history(self, entry, defer_options=False):
+        """
+        Store one turn with a single INSERT and move the session head to it.
+        Both writes are constant-size, whatever the length of the session.
+        With defer_options, an OptionsJob for the turn is queued in the same
+        transaction (see agent/jobs.py).
+        """
+        for _ in range(3):
+            ordinal = self.turn_count + 1
+            try:
+                with transaction.atomic():
+                    turn = Turn.from_entry(self, ordinal, entry)
+                    self.turn_count = ordinal
+                    self.last_topic = entry.get("topic") or self.last_topic
+                    self.head_answer_json = turn.answer_json
+                    self.head_options = turn.options
+                    self.context_summary = compact_history(
+                        self.context_summary, entry, getattr(settings, "AGENT_SUMMARY_BUDGET", 300)
+                    )
+                    self.save(update_fields=[
+                        "turn_count", "last_topic", "head_answer_json", "head_options", "context_summary"
+                    ])
+                    if defer_options:
+                        OptionsJob.objects.create(turn=turn)
+                    return turn
+            except IntegrityError:
+                # another request appended first; pick up its ordinal and retry
+                self.refresh_from_db(fields=["turn_count"])
+        raise IntegrityError("could not allocate a turn ordinal")
+
+
+class Turn(models.Model):
+    """One question/answer exchange of a Session."""
+    session = models.ForeignKey(Session, on_delete=models.CASCADE, related_name="turns")
+    ordinal = models.PositiveIntegerField()   # 1-based position within the session
+    question = models.TextField(blank=True, default="")
+    clarifiers = models.TextField(blank=True, default="")
+    topic = models.CharField(max_length=100, blank=True, null=True)
+    company = models.CharField(max_length=200, blank=True, null=True)
+    answer_json = CompressedTextField(blank=True, default="")
+    answer_raw = CompressedTextField(blank=True, null=True)   # None: identical to answer_json
+    options = models.JSONField(default=list, blank=True)
+    created_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    class Meta:
+        ordering = ["session", "ordinal"]
+        constraints = [
+            models.UniqueConstraint(fields=["session", "ordinal"], name="unique_turn_ordinal"),
+        ]
+
+    @classmethod
+    def from_entry(cls, session, ordinal, entry):
+        answer_json = entry.get("answer_json") or ""
+        raw = entry.get("answer_raw") or ""
+        return cls.objects.create(
+            session=session,
+            ordinal=ordinal,
+            question=entry.get("question") or "",
+            clarifiers=entry.get("clarifiers") or "",
+            topic=entry.get("topic"),
+            company=entry.get("company"),
+            answer_json=answer_json,
+            answer_raw=None if raw == answer_json else raw,
+            options=entry.get("options") or [],
+        )
+
+    # history-entry key -> model field
+    ENTRY_FIELDS = {
+        "turn": "ordinal",
+        "question": "question",
+        "clarifiers": "clarifiers",
+        "topic": "topic",
+        "company": "company",
+        "answer_json": "answer_json",
+        "answer_raw": "answer_raw",
+        "options": "options",
+        "ts": "created_at",
+    }
+
+    def as_entry(self, keys=None):
+        """
+        The history-entry dict shape used before turns had their own table,
+        optionally limited to `keys`.
+        """
+        entry = {}
+        for key in keys or self.ENTRY_FIELDS:
+            value = getattr(self, self.ENTRY_FIELDS[key])
+            if key == "ts":
+                value = str(value)
+            elif key == "answer_raw" and value is None:
+                value = self.answer_json
+            entry[key] = value
+        return entry
+
+
+class OptionsJob(models.Model):
+    """
+    Follow-up options of one turn, generated after the answer was returned.
+    The table is the queue: `manage.py run_options_worker` claims pending
+    rows with a conditional UPDATE, so no broker is needed.
+    """
+    PENDING, RUNNING, DONE, FAILED = "pending", "running", "done", "failed"
+    STATUS_CHOICES = [(s, s) for s in (PENDING, RUNNING, DONE, FAILED)]
+
+    turn = models.OneToOneField(Turn, on_delete=models.CASCADE, related_name="options_job")
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    created_at = models.DateTimeField(default=timezone.now)
+    started_at = models.DateTimeField(null=True, blank=True)   # lease start while running
+    finished_at = models.DateTimeField(null=True, blank=True)
+    error = models.TextField(blank=True, default="")
+
+    class Meta:
+        indexes = [models.Index(fields=["status", "created_at"], name="options_job_queue")]
+
+
+class CachedAnswer(models.Model):
+    """
+    A generated answer reusable for the same question about the same topic
+    and company (see agent/answercache.py). `key` identifies the normalized
+    question exactly; near-duplicates are found through CachedAnswerBand.
+    """
+    key = models.CharField(max_length=40, unique=True)   # sha1 of topic, company, normalized question
+    topic = models.CharField(max_length=100, blank=True, default="")
+    company = models.CharField(max_length=200, blank=True, default="")
+    question = models.TextField(blank=True, default="")   # normalized
+    signature = models.BinaryField()                     # MinHash, 4 bytes per permutation
+    answer_raw = CompressedTextField(blank=True, default="")
+    created_at = models.DateTimeField(default=timezone.now)
+    expires_at = models.DateTimeField(db_index=True)
+
+
+class CachedAnswerBand(models.Model):
+    """One LSH band of a CachedAnswer's signature; equal bands make candidates."""
+    answer = models.ForeignKey(CachedAnswer, on_delete=models.CASCADE, related_name="bands")
+    band = models.BigIntegerField(db_index=True)
+
+
+class CompanyProfile(models.Model):
+    """
+    Slow-changing facts about a company (utils.PROFILE_FIELDS), generated
+    ahead of time by `manage.py warm_company_profiles` and merged into
+    company answers instead of being regenerated for every question.
+    """
+    company = models.CharField(max_length=200, unique=True)   # lowercased
+    profile = models.JSONField(default=dict)
+    refreshed_at = models.DateTimeField(default=timezone.now, db_index=True)
@@ -0,0 +1,69 @@
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from . import utils
+from .models import CompanyProfile
+
+log = logging.getLogger("agent.profiles")
+
+
+# ---------------------------------------------------------
+# MATERIALIZED COMPANY PROFILES
+# ---------------------------------------------------------
+DEFAULTS = {
+    "enabled": True,
+    "refresh_after": 86400,     # warm_company_profiles regenerates older profiles
+    "max_age": 7 * 86400,       # requests ignore profiles older than this
+}
+
+
+def _conf(key):
+    return getattr(settings, "AGENT_COMPANY_PROFILES", {}).get(key, DEFAULTS[key])
+
+
+def known_companies():
+    """KNOWN_COMPANIES as detect_topic reports them, without duplicates."""
+    return list(dict.fromkeys(name.title() for name in utils.KNOWN_COMPANIES))
+
+
+def get_profile(company):
+    """The stored profile of `company` if it is recent enough, else None."""
+    if not company or not _conf("enabled"):
+        return None
+    key = company.lower()
+    profile = utils.profile_cache.get(key)
+    if profile is None:
+        since = timezone.now() - timedelta(seconds=_conf("max_age"))
+        profile = (
+            CompanyProfile.objects.filter(company=key, refreshed_at__gt=since)
+            .values_list("profile", flat=True).first()
+        ) or {}
+        utils.profile_cache.set(key, profile)
+    return profile or None
+
+
+def save(company, profile):
+    CompanyProfile.objects.update_or_create(
+        company=company.lower(), defaults={"profile": profile, "refreshed_at": timezone.now()}
+    )
+    utils.profile_cache.set(company.lower(), profile)
+
+
+def refresh(company):
+    """Generate and store the profile of one company."""
+    profile = utils.generate_company_profile(company)
+    save(company, profile)
+    return profile
+
+
+def stale(companies):
+    """The companies whose profile is missing or older than refresh_after."""
+    since = timezone.now() - timedelta(seconds=_conf("refresh_after"))
+    fresh = set(
+        CompanyProfile.objects.filter(company__in=[c.lower() for c in companies], refreshed_at__gte=since)
+        .values_list("company", flat=True)
+    )
+    return [c for c in companies if c.lower() not in fresh]
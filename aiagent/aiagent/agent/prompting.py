@@ -0,0 +1,188 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+
+from django.conf import settings
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+log = logging.getLogger("agent.prompting")
+
+
+# ---------------------------------------------------------
+# LOCAL TOKEN COUNTING
+# ---------------------------------------------------------
+# cl100k_base is read from AGENT_TOKENIZER_DIR (agent/tokenizer/, filled by
+# `manage.py fetch_tokenizer`), under the name tiktoken caches it by. It is
+# never downloaded while serving: without the file, tokens are estimated.
+CL100K_URL = "https://openaipublic.blob.core.windows.net/encodings/cl100k_base.tiktoken"
+CL100K_SHA256 = "223921b76ee99bde995b7ff738513eef100fb51d18c93597a113bcffe865b2a7"
+
+_encoding = None
+_encoding_lock = threading.Lock()
+_WORD_RE = re.compile(r"[a-z0-9]+")
+
+
+def tokenizer_dir():
+    return str(getattr(settings, "AGENT_TOKENIZER_DIR", os.path.join(os.path.dirname(__file__), "tokenizer")))
+
+
+def tokenizer_file():
+    """Path of the cl100k_base BPE file in tokenizer_dir()."""
+    return os.path.join(tokenizer_dir(), hashlib.sha1(CL100K_URL.encode()).hexdigest())
+
+
+def _load_encoding():
+    if tiktoken is None:
+        return False
+    path = tokenizer_file()
+    try:
+        with open(path, "rb") as f:
+            intact = hashlib.sha256(f.read()).hexdigest() == CL100K_SHA256
+    except OSError:
+        intact = False
+    if not intact:   # tiktoken would fetch it over the network
+        log.warning("%s missing or corrupt (run manage.py fetch_tokenizer); estimating tokens", path)
+        return False
+    os.environ["TIKTOKEN_CACHE_DIR"] = tokenizer_dir()
+    try:
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception:
+        log.warning("could not load cl100k_base; estimating tokens", exc_info=True)
+        return False
+
+
+def _get_encoding():
+    global _encoding
+    if _encoding is None:
+        with _encoding_lock:
+            if _encoding is None:
+                _encoding = _load_encoding()
+    return _encoding
+
+
+def count_tokens(text):
+    """
+    Approximate token count of `text`. Uses tiktoken's cl100k_base when
+    available (close to Gemini's counts for English), otherwise ~4 chars/token.
+    """
+    if not text:
+        return 0
+    enc = _get_encoding()
+    if enc:
+        return len(enc.encode(text, disallowed_special=()))
+    return (len(text) + 3) // 4
+
+
+def truncate_to_tokens(text, budget):
+    """Cut `text` to roughly `budget` tokens, on a word boundary."""
+    if budget <= 0:
+        return ""
+    if count_tokens(text) <= budget:
+        return text
+    enc = _get_encoding()
+    if enc:
+        cut = enc.decode(enc.encode(text, disallowed_special=())[:budget])
+    else:
+        cut = text[:budget * 4]
+    return cut.rsplit(" ", 1)[0].rstrip() + " …"
+
+
+# ---------------------------------------------------------
+# WEB SNIPPETS
+# ---------------------------------------------------------
+def fit_snippets(tavily_text, query, budget):
+    """
+    Keep the snippet blocks (as formatted by tavily_search_text) that share
+    the most words with `query`, in their original order, within `budget`.
+    """
+    if not tavily_text or count_tokens(tavily_text) <= budget:
+        return tavily_text or ""
+
+    blocks = [b for b in re.split(r"\n(?=- )", tavily_text) if b.strip()]
+    terms = set(_WORD_RE.findall((query or "").lower()))
+    ranked = sorted(
+        range(len(blocks)),
+        key=lambda i: (-len(terms & set(_WORD_RE.findall(blocks[i].lower()))), i),
+    )
+
+    keep, used = {}, 0
+    for i in ranked:
+        cost = count_tokens(blocks[i])
+        if used + cost <= budget:
+            keep[i] = blocks[i]
+            used += cost
+        elif budget - used > 20:
+            keep[i] = truncate_to_tokens(blocks[i], budget - used)
+            break
+    return "\n".join(keep[i] for i in sorted(keep))
+
+
+# ---------------------------------------------------------
+# PREVIOUS ANSWER
+# ---------------------------------------------------------
+# kept first when the previous answer has to shrink
+PRIORITY_FIELDS = ("summary", "company_name", "next_steps", "actionable_steps", "steps", "details")
+
+
+def fit_previous_answer(previous_json, budget):
+    """
+    Shrink a previous answer (JSON text) to `budget` tokens: the summary and
+    step lists go first, long values are truncated, and fields that still
+    do not fit are dropped.
+    """
+    if not previous_json or count_tokens(previous_json) <= budget:
+        return previous_json or ""
+    try:
+        data = json.loads(previous_json)
+    except ValueError:
+        return truncate_to_tokens(previous_json, budget)
+    if not isinstance(data, dict):
+        return truncate_to_tokens(previous_json, budget)
+
+    order = [k for k in PRIORITY_FIELDS if k in data] + [k for k in data if k not in PRIORITY_FIELDS]
+    per_field = max(budget // max(len(order), 1), 40)
+    fitted = {}
+    for key in order:
+        value = data[key]
+        if isinstance(value, str):
+            value = truncate_to_tokens(value, per_field)
+        elif isinstance(value, list):
+            value = value[:6]
+        fitted[key] = value
+        if count_tokens(json.dumps(fitted, ensure_ascii=False)) > budget:
+            del fitted[key]  # a later, smaller field may still fit
+    return json.dumps(fitted, ensure_ascii=False)
+
+
+# ---------------------------------------------------------
+# RUNNING CONVERSATION SUMMARY
+# ---------------------------------------------------------
+def _first_sentence(text, limit=200):
+    text = " ".join(str(text).split())
+    m = re.match(r"(.+?[.!?])(\s|$)", text)
+    return (m.group(1) if m else text)[:limit]
+
+
+def compact_history(summary, entry, budget):
+    """
+    Fold one finished turn into the running summary of the conversation
+    (one line per turn) and drop the oldest lines beyond `budget` tokens.
+    """
+    answer = entry.get("answer_json") or ""
+    try:
+        gist = json.loads(answer).get("summary") or ""
+    except (ValueError, AttributeError):
+        gist = answer
+    line = f"- Q: {_first_sentence(entry.get('question') or '', 120)} -> {_first_sentence(gist)}"
+
+    lines = (summary.splitlines() if summary else []) + [line]
+    while len(lines) > 1 and count_tokens("\n".join(lines)) > budget:
+        lines.pop(0)
+    return "\n".join(lines)
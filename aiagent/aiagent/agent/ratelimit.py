@@ -0,0 +1,271 @@
+import asyncio
+import math
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+
+from django.conf import settings
+
+
+class Overloaded(Exception):
+    """Raised when an upstream call cannot be admitted in time."""
+
+    def __init__(self, name, retry_after):
+        super().__init__(f"{name} is at capacity")
+        self.retry_after = retry_after
+
+
+# ---------------------------------------------------------
+# TOKEN BUCKETS
+# ---------------------------------------------------------
+# Both buckets hand out reservations: reserve() takes a token now, even one
+# that only becomes available later, and returns how long the caller must
+# wait before using it -- unless that wait is longer than `max_wait`, in
+# which case nothing is taken and None is returned.
+def _wait_for(tokens, rate):
+    return 0.0 if tokens >= 1 else (1 - tokens) / rate
+
+
+class TokenBucket:
+    """In-process bucket: `rate` tokens per second, up to `burst`."""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, max_wait):
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            wait = _wait_for(self._tokens, self.rate)
+            if wait > max_wait:
+                return None
+            self._tokens -= 1
+            return wait
+
+
+class SQLiteTokenBucket:
+    """
+    Bucket kept in a small SQLite file so every worker process on the host
+    draws from the same budget. BEGIN IMMEDIATE serialises the
+    read-modify-write across processes.
+    """
+
+    def __init__(self, path, name, rate, burst):
+        self.path = path
+        self.name = name
+        self.rate = rate
+        self.burst = burst
+        self._local = threading.local()
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS buckets (name TEXT PRIMARY KEY, tokens REAL, updated REAL)"
+            )
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def reserve(self, max_wait):
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            now = time.time()  # wall clock: shared between processes
+            row = conn.execute("SELECT tokens, updated FROM buckets WHERE name = ?", (self.name,)).fetchone()
+            tokens = self.burst if row is None else min(self.burst, row[0] + (now - row[1]) * self.rate)
+            wait = _wait_for(tokens, self.rate)
+            if wait > max_wait:
+                conn.execute("ROLLBACK")
+                return None
+            conn.execute(
+                "INSERT OR REPLACE INTO buckets (name, tokens, updated) VALUES (?, ?, ?)",
+                (self.name, tokens - 1, now),
+            )
+            conn.execute("COMMIT")
+            return wait
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+
+# ---------------------------------------------------------
+# ADMISSION CONTROL
+# ---------------------------------------------------------
+class UpstreamLimiter:
+    """
+    Admission for one upstream API: a request rate (token bucket, optionally
+    shared across workers) and a cap on concurrent requests per process.
+
+    At most `max_queue` callers wait for admission; beyond that, or when
+    admission would take longer than `max_wait` (or the caller's own
+    deadline), Overloaded is raised straight away.
+
+        with limiter.slot(timeout=30):
+            resp = client.post(...)
+    """
+
+    COUNTERS = ("admitted", "queued", "rejected")
+
+    def __init__(self, name, rate=None, burst=None, concurrency=None, max_queue=64, max_wait=5.0, db_path=None):
+        self.name = name
+        self.rate = rate
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.bucket = None
+        if rate:
+            burst = burst or max(int(rate), 1)
+            self.bucket = SQLiteTokenBucket(db_path, name, rate, burst) if db_path else TokenBucket(rate, burst)
+        self._slots = threading.BoundedSemaphore(concurrency) if concurrency else None
+        self._async_waiters = deque()   # (loop, future) of coroutines waiting for a slot
+        self._waiting = 0
+        self._lock = threading.Lock()
+        self.counters = dict.fromkeys(self.COUNTERS, 0)
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters, waiting=self._waiting)
+
+    def _reject(self):
+        with self._lock:
+            self.counters["rejected"] += 1
+            backlog = self._waiting
+        per_second = self.rate or 1
+        raise Overloaded(self.name, max(1, math.ceil(backlog / per_second)))
+
+    def _enqueue(self, timeout):
+        with self._lock:
+            if self._waiting >= self.max_queue:
+                full = True
+            else:
+                full = False
+                self._waiting += 1
+        if full:
+            self._reject()
+        budget = self.max_wait if timeout is None else min(self.max_wait, timeout)
+        return time.monotonic() + budget
+
+    def _dequeue(self, admitted):
+        with self._lock:
+            self._waiting -= 1
+            if admitted:
+                self.counters["admitted"] += 1
+
+    def _token_wait(self, deadline):
+        if self.bucket is None:
+            return 0.0
+        return self._reserved(self.bucket.reserve(max(deadline - time.monotonic(), 0)))
+
+    async def _atoken_wait(self, deadline):
+        if not isinstance(self.bucket, SQLiteTokenBucket):
+            return self._token_wait(deadline)   # in-process: never blocks
+        # the shared bucket may wait on another process's write lock
+        return self._reserved(await asyncio.to_thread(self.bucket.reserve, max(deadline - time.monotonic(), 0)))
+
+    def _reserved(self, wait):
+        if wait is None:
+            self._reject()
+        if wait:
+            with self._lock:
+                self.counters["queued"] += 1
+        return wait
+
+    def _release(self):
+        self._slots.release()
+        self._wake_one()
+
+    def _wake_one(self):
+        """Hand a freed slot's wake-up to the longest-waiting coroutine."""
+        while True:
+            with self._lock:
+                if not self._async_waiters:
+                    return
+                loop, waiter = self._async_waiters.popleft()
+            try:
+                loop.call_soon_threadsafe(_wake, waiter)
+                return
+            except RuntimeError:
+                continue   # its event loop is closed
+
+    async def _aacquire(self, deadline):
+        """Take a concurrency slot, waiting on a future (not polling) while none is free."""
+        loop = asyncio.get_running_loop()
+        while True:
+            waiter = loop.create_future()
+            with self._lock:
+                self._async_waiters.append((loop, waiter))
+            if self._slots.acquire(blocking=False):
+                self._forget(loop, waiter)
+                return True
+            try:
+                await asyncio.wait_for(waiter, max(deadline - time.monotonic(), 0))
+            except asyncio.TimeoutError:
+                self._forget(loop, waiter)
+                return False
+            except BaseException:
+                self._forget(loop, waiter)
+                raise
+
+    def _forget(self, loop, waiter):
+        with self._lock:
+            try:
+                self._async_waiters.remove((loop, waiter))
+                return
+            except ValueError:
+                pass
+        self._wake_one()   # it was already woken: pass the wake-up on
+
+    @contextmanager
+    def slot(self, timeout=None):
+        deadline = self._enqueue(timeout)
+        admitted = False
+        try:
+            time.sleep(self._token_wait(deadline))
+            if self._slots and not self._slots.acquire(timeout=max(deadline - time.monotonic(), 0)):
+                self._reject()
+            admitted = True
+        finally:
+            self._dequeue(admitted)
+        try:
+            yield
+        finally:
+            if self._slots:
+                self._release()
+
+    @asynccontextmanager
+    async def aslot(self, timeout=None):
+        """slot() for coroutines; waits without blocking the event loop."""
+        deadline = self._enqueue(timeout)
+        admitted = False
+        try:
+            await asyncio.sleep(await self._atoken_wait(deadline))
+            if self._slots and not await self._aacquire(deadline):
+                self._reject()
+            admitted = True
+        finally:
+            self._dequeue(admitted)
+        try:
+            yield
+        finally:
+            if self._slots:
+                self._release()
+
+
+def _wake(waiter):
+    if not waiter.done():
+        waiter.set_result(None)
+
+
+def build_limiter(name):
+    """UpstreamLimiter configured from settings.AGENT_RATE_LIMITS[name]."""
+    conf = getattr(settings, "AGENT_RATE_LIMITS", {}).get(name, {})
+    return UpstreamLimiter(name, db_path=getattr(settings, "AGENT_RATE_LIMIT_DB", None), **conf)
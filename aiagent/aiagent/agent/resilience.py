@@ -0,0 +1,354 @@
+import asyncio
+import logging
+import random
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import requests
+from django.conf import settings
+
+log = logging.getLogger("agent.resilience")
+
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+
+class CircuitOpen(Exception):
+    """Raised without calling upstream while the breaker is open."""
+
+    def __init__(self, name, retry_after):
+        super().__init__(f"{name} circuit open")
+        self.retry_after = retry_after
+
+
+def _status_code(exc):
+    return getattr(getattr(exc, "response", None), "status_code", None)
+
+
+def is_retryable(exc):
+    """Transient upstream failures: throttling, 5xx, timeouts, dropped connections."""
+    status = _status_code(exc)
+    if status is not None:
+        return status in RETRYABLE_STATUS
+    if isinstance(exc, (requests.ConnectionError, requests.Timeout, asyncio.TimeoutError, TimeoutError)):
+        return True
+    try:
+        import httpx
+    except ImportError:
+        return False
+    return isinstance(exc, httpx.TransportError)
+
+
+def _retry_after(exc):
+    """Seconds from a Retry-After header, if the upstream sent one."""
+    headers = getattr(getattr(exc, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        return None
+
+
+# ---------------------------------------------------------
+# CIRCUIT BREAKER
+# ---------------------------------------------------------
+class CircuitBreaker:
+    """
+    Opens after `failures` consecutive transient failures and rejects calls
+    for `reset_after` seconds; then lets a single trial call through
+    (half-open) and closes again if it succeeds.
+
+    before_call() returns True for the call that holds the trial; it must
+    end in record_success(), record_failure() or, when it never reached
+    upstream, release_trial().
+    """
+
+    def __init__(self, name, failures=5, reset_after=30):
+        self.name = name
+        self.threshold = failures
+        self.reset_after = reset_after
+        self.state = "closed"
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial = False
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        with self._lock:
+            if self.state == "closed":
+                return False
+            waited = time.monotonic() - self._opened_at
+            if self.state == "open" and waited >= self.reset_after:
+                self.state = "half_open"
+            if self.state == "half_open" and not self._trial:
+                self._trial = True
+                return True
+            raise CircuitOpen(self.name, max(self.reset_after - waited, 1))
+
+    def record_success(self):
+        with self._lock:
+            if self.state != "closed":
+                log.info("%s circuit closed", self.name)
+            self.state = "closed"
+            self._failures = 0
+            self._trial = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial = False
+            if self.state == "half_open" or self._failures >= self.threshold:
+                if self.state != "open":
+                    log.warning("%s circuit opened after %d failures", self.name, self._failures)
+                self.state = "open"
+                self._opened_at = time.monotonic()
+
+    def release_trial(self):
+        """Give up a trial that got no upstream verdict; the next call tries again."""
+        with self._lock:
+            self._trial = False
+
+
+# ---------------------------------------------------------
+# RETRIES + HEDGING
+# ---------------------------------------------------------
+class LatencyWindow:
+    """Recent successful attempt latencies, for the hedging delay."""
+
+    def __init__(self, size=200):
+        self._samples = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def add(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def quantile(self, pct, min_samples=20):
+        with self._lock:
+            if len(self._samples) < min_samples:
+                return None
+            values = sorted(self._samples)
+        return values[min(len(values) - 1, int(pct / 100 * len(values)))]
+
+
+_hedge_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix="agent-hedge")
+
+
+class ResilientUpstream:
+    """
+    Wraps single upstream attempts with jittered exponential backoff on
+    transient errors, an optional hedged second attempt once the first has
+    run longer than the recent p95, and a circuit breaker.
+
+    `attempt(timeout)` performs one request and returns its result; the
+    overall `timeout` passed to call() bounds all attempts and backoffs.
+    """
+
+    COUNTERS = ("success", "retry", "hedge", "hedge_won", "failure", "short_circuit")
+
+    def __init__(self, name, retries=2, backoff_base=0.25, backoff_max=4.0,
+                 hedge=False, hedge_quantile=95, hedge_min_ms=500,
+                 breaker_failures=5, breaker_reset=30):
+        self.name = name
+        self.retries = retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.hedge = hedge
+        self.hedge_quantile = hedge_quantile
+        self.hedge_min = hedge_min_ms / 1000
+        self.breaker = CircuitBreaker(name, breaker_failures, breaker_reset)
+        self.latency = LatencyWindow()
+        self.counters = dict.fromkeys(self.COUNTERS, 0)
+        self._lock = threading.Lock()
+
+    def _count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters, state=self.breaker.state)
+
+    def hedge_delay(self):
+        p = self.latency.quantile(self.hedge_quantile)
+        return max(p or 0, self.hedge_min)
+
+    def backoff(self, attempt, exc):
+        """Full-jitter exponential backoff; a Retry-After header wins if larger."""
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+        return max(delay, _retry_after(exc) or 0)
+
+    def _outcome(self, exc, attempt, deadline):
+        """Seconds to back off before retrying `exc`, or None to give up."""
+        if not is_retryable(exc):
+            self._settle(exc)
+            return None
+        if attempt >= self.retries:
+            self.breaker.record_failure()
+            return None
+        delay = self.backoff(attempt, exc)
+        if time.monotonic() + delay >= deadline:
+            self.breaker.record_failure()
+            return None
+        self._count("retry")
+        return delay
+
+    def _settle(self, exc):
+        """
+        Breaker verdict for a non-retryable error: an upstream response (a
+        4xx) shows upstream is up; anything else, e.g. a local Overloaded,
+        says nothing about it and leaves the breaker as it is.
+        """
+        if _status_code(exc) is not None:
+            self.breaker.record_success()
+
+    def _before(self):
+        """True when this call is the breaker's half-open trial."""
+        try:
+            return self.breaker.before_call()
+        except CircuitOpen:
+            self._count("short_circuit")
+            raise
+
+    @contextmanager
+    def guard(self):
+        """
+        Breaker bookkeeping (no retries, no hedging) for a call made outside
+        call()/acall(), such as a stream that cannot be replayed.
+        """
+        trial = self._before()
+        try:
+            yield
+        except Exception as e:
+            if is_retryable(e):
+                self.breaker.record_failure()
+            else:
+                self._settle(e)
+            self._count("failure")
+            raise
+        else:
+            self.breaker.record_success()
+            self._count("success")
+        finally:
+            if trial:
+                self.breaker.release_trial()
+
+    # -- threads ----------------------------------------------------------
+    def call(self, attempt, timeout):
+        trial = self._before()
+        try:
+            deadline = time.monotonic() + timeout
+            for n in range(self.retries + 1):
+                try:
+                    result = self._attempt(attempt, deadline)
+                except Exception as e:
+                    delay = self._outcome(e, n, deadline)
+                    if delay is None:
+                        self._count("failure")
+                        raise
+                    time.sleep(delay)
+                    continue
+                self.breaker.record_success()
+                self._count("success")
+                return result
+        finally:
+            if trial:   # a trial that ended without a verdict must not hold the breaker
+                self.breaker.release_trial()
+
+    def _timed(self, attempt, deadline):
+        start = time.monotonic()
+        result = attempt(max(deadline - start, 0.1))
+        self.latency.add(time.monotonic() - start)
+        return result
+
+    def _attempt(self, attempt, deadline):
+        if not self.hedge:
+            return self._timed(attempt, deadline)
+
+        first = _hedge_executor.submit(self._timed, attempt, deadline)
+        done, _ = wait([first], timeout=self.hedge_delay())
+        if done:
+            return first.result()
+
+        self._count("hedge")
+        second = _hedge_executor.submit(self._timed, attempt, deadline)
+        pending = {first, second}
+        error = None
+        while pending:
+            done, pending = wait(pending, timeout=max(deadline - time.monotonic(), 0), return_when=FIRST_COMPLETED)
+            if not done:
+                raise TimeoutError(f"{self.name} timed out")
+            for future in done:
+                if future.exception() is None:
+                    if future is second:
+                        self._count("hedge_won")
+                    return future.result()  # the loser finishes in the background
+                error = future.exception()
+        raise error
+
+    # -- asyncio ----------------------------------------------------------
+    async def acall(self, attempt, timeout):
+        """call() for coroutine attempts, `attempt(timeout)` being async."""
+        trial = self._before()
+        try:
+            deadline = time.monotonic() + timeout
+            for n in range(self.retries + 1):
+                try:
+                    result = await self._aattempt(attempt, deadline)
+                except Exception as e:
+                    delay = self._outcome(e, n, deadline)
+                    if delay is None:
+                        self._count("failure")
+                        raise
+                    await asyncio.sleep(delay)
+                    continue
+                self.breaker.record_success()
+                self._count("success")
+                return result
+        finally:
+            if trial:   # a trial that ended without a verdict must not hold the breaker
+                self.breaker.release_trial()
+
+    async def _atimed(self, attempt, deadline):
+        start = time.monotonic()
+        result = await attempt(max(deadline - start, 0.1))
+        self.latency.add(time.monotonic() - start)
+        return result
+
+    async def _aattempt(self, attempt, deadline):
+        if not self.hedge:
+            return await self._atimed(attempt, deadline)
+
+        first = asyncio.ensure_future(self._atimed(attempt, deadline))
+        done, _ = await asyncio.wait({first}, timeout=self.hedge_delay())
+        if done:
+            return first.result()
+
+        self._count("hedge")
+        second = asyncio.ensure_future(self._atimed(attempt, deadline))
+        pending = {first, second}
+        error = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, timeout=max(deadline - time.monotonic(), 0), return_when=asyncio.FIRST_COMPLETED
+                )
+                if not done:
+                    raise asyncio.TimeoutError(f"{self.name} timed out")
+                for task in done:
+                    if task.exception() is None:
+                        if task is second:
+                            self._count("hedge_won")
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+
+def build_upstream(name):
+    """ResilientUpstream configured from settings.AGENT_RESILIENCE[name]."""
+    conf = getattr(settings, "AGENT_RESILIENCE", {}).get(name, {})
+    return ResilientUpstream(name, **conf)
@@ -2,6 +2,20 @@ from rest_framework import serializers
 from .models import Session
 
 class SessionSerializer(serializers.ModelSerializer):
+    """
+    Context (all optional):
+      turns       – queryset/list of Turn rows to render instead of all of them
+      turn_fields – history-entry keys to include per turn
+    """
+    history = serializers.SerializerMethodField()
+
     class Meta:
         model = Session
-        fields = "__all__"
+        fields = ["id", "company", "last_topic", "history", "created_at"]
+
+    def get_history(self, obj):
+        turns = self.context.get("turns")
+        if turns is None:
+            turns = obj.turns.all()
+        keys = self.context.get("turn_fields")
+        return [t.as_entry(keys) for t in turns]
@@ -0,0 +1,222 @@
+import asyncio
+import hashlib
+import os
+import threading
+import time
+import weakref
+
+from django.conf import settings
+
+
+# ---------------------------------------------------------
+# SINGLE-FLIGHT REQUEST COALESCING
+# ---------------------------------------------------------
+class _Call:
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Concurrent callers with the same key share one execution of `fn`.
+
+    Within a process, followers block until the leader finishes and get
+    its result (or its exception). With `shared_alias` set, the leader also
+    takes a lock in that Django cache and publishes the result there, so
+    callers in other workers wait for it instead of calling upstream too.
+    ado() does the same for coroutine functions, coalescing callers on the
+    same event loop.
+
+    `timeout` (keyword-only, not passed to `fn`) is how long the caller
+    can wait: a caller waiting for another worker's result gives up after
+    min(timeout, lock_ttl) seconds, with TimeoutError if its own timeout
+    ran out first.
+    """
+
+    def __init__(self, name, shared_alias=None, lock_ttl=60, result_ttl=30, poll_interval=0.05):
+        self.name = name
+        self.shared_alias = shared_alias
+        self.lock_ttl = lock_ttl
+        self.result_ttl = result_ttl
+        self.poll_interval = poll_interval
+        self.leaders = 0
+        self.coalesced = 0
+        self._calls = {}
+        self._acalls = weakref.WeakKeyDictionary()   # event loop -> {key: asyncio.Future}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn, *args, timeout=None, **kwargs):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.leaders += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = self._run(key, fn, args, kwargs, timeout)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+
+    async def ado(self, key, fn, *args, timeout=None, **kwargs):
+        """do() for a coroutine function `fn`."""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            calls = self._acalls.setdefault(loop, {})
+            future = calls.get(key)
+            leader = future is None
+            if leader:
+                future = calls[key] = loop.create_future()
+                self.leaders += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            try:
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                if not future.cancelled():
+                    raise
+            # the leader was cancelled (its client went away); try again ourselves
+            return await self.ado(key, fn, *args, timeout=timeout, **kwargs)
+
+        try:
+            result = await self._arun(key, fn, args, kwargs, timeout)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            future.exception()   # retrieved: followers may not exist
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del calls[key]
+
+    def _keys(self, key):
+        digest = hashlib.sha1(key.encode("utf-8")).hexdigest()
+        return f"agent:flight:{self.name}:{digest}:lock", f"agent:flight:{self.name}:{digest}:result"
+
+    def _wait_budget(self, timeout):
+        """(seconds to wait for another worker's result, True if that is the caller's own timeout)."""
+        if timeout is None or timeout >= self.lock_ttl:
+            return self.lock_ttl, False
+        return max(timeout, 0), True
+
+    def _run(self, key, fn, args, kwargs, timeout=None):
+        if not self.shared_alias:
+            return fn(*args, **kwargs)
+
+        from django.core.cache import caches
+        cache = caches[self.shared_alias]
+        lock_key, result_key = self._keys(key)
+
+        try:
+            got_lock = cache.add(lock_key, os.getpid(), timeout=self.lock_ttl)
+        except Exception:
+            return fn(*args, **kwargs)  # shared tier unavailable: run locally
+
+        if not got_lock:
+            # another worker is calling upstream; wait for its published result
+            budget, own_timeout = self._wait_budget(timeout)
+            deadline = time.monotonic() + budget
+            while True:
+                result = cache.get(result_key)
+                if result is not None:
+                    with self._lock:
+                        self.coalesced += 1
+                    return result
+                if cache.get(lock_key) is None:
+                    break  # leader gave up without a result
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    if own_timeout:
+                        raise TimeoutError(f"{self.name}: no shared result within {timeout}s")
+                    break  # the lock outlived its ttl
+                time.sleep(min(self.poll_interval, remaining))
+            return fn(*args, **kwargs)
+
+        try:
+            result = fn(*args, **kwargs)
+            if result:
+                cache.set(result_key, result, timeout=self.result_ttl)
+            return result
+        finally:
+            cache.delete(lock_key)
+
+    async def _arun(self, key, fn, args, kwargs, timeout=None):
+        """_run() with the shared cache reached through its async methods."""
+        if not self.shared_alias:
+            return await fn(*args, **kwargs)
+
+        from django.core.cache import caches
+        cache = caches[self.shared_alias]
+        lock_key, result_key = self._keys(key)
+
+        try:
+            got_lock = await cache.aadd(lock_key, os.getpid(), timeout=self.lock_ttl)
+        except Exception:
+            return await fn(*args, **kwargs)
+
+        if not got_lock:
+            budget, own_timeout = self._wait_budget(timeout)
+            deadline = time.monotonic() + budget
+            while True:
+                result = await cache.aget(result_key)
+                if result is not None:
+                    with self._lock:
+                        self.coalesced += 1
+                    return result
+                if await cache.aget(lock_key) is None:
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    if own_timeout:
+                        raise TimeoutError(f"{self.name}: no shared result within {timeout}s")
+                    break
+                await asyncio.sleep(min(self.poll_interval, remaining))
+            return await fn(*args, **kwargs)
+
+        try:
+            result = await fn(*args, **kwargs)
+            if result:
+                await cache.aset(result_key, result, timeout=self.result_ttl)
+            return result
+        finally:
+            await cache.adelete(lock_key)
+
+    def stats(self):
+        with self._lock:
+            in_flight = len(self._calls) + sum(len(calls) for calls in self._acalls.values())
+            return {"leaders": self.leaders, "coalesced": self.coalesced, "in_flight": in_flight}
+
+
+def build_flight(name):
+    """SingleFlight configured from settings.AGENT_SINGLEFLIGHT."""
+    conf = getattr(settings, "AGENT_SINGLEFLIGHT", {})
+    return SingleFlight(
+        name,
+        shared_alias=conf.get("shared_alias"),
+        lock_ttl=conf.get("lock_ttl", 60),
+        result_ttl=conf.get("result_ttl", 30),
+        poll_interval=conf.get("poll_interval", 0.05),
+    )
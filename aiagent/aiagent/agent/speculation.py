@@ -0,0 +1,137 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+from . import metrics, utils
+from .ratelimit import TokenBucket
+
+
+# ---------------------------------------------------------
+# SPECULATIVE FOLLOW-UP ANSWERS
+# ---------------------------------------------------------
+DEFAULTS = {
+    "enabled": False,
+    "top_n": 2,             # options speculated per turn, in the order shown
+    "ttl": 300,             # seconds an unused answer is kept
+    "max_in_flight": 4,     # speculative Gemini calls running at once (per process)
+    "max_per_hour": 600,    # speculative Gemini calls started per hour (per process)
+}
+
+OUTCOMES = metrics.Counter(
+    "agent_speculation_total",
+    "Speculative follow-up answers: started, skipped (cost cap), hit, hit_inflight, "
+    "miss, cancelled (never started) and wasted (generated, never used).",
+    ("outcome",),
+)
+
+
+def _conf(key):
+    return getattr(settings, "AGENT_SPECULATION", {}).get(key, DEFAULTS[key])
+
+
+class _Entry:
+    def __init__(self, future, prompt, expires):
+        self.future = future
+        self.prompt = prompt
+        self.expires = expires
+
+
+class Speculator:
+    """
+    Answers the first `top_n` options of a turn before the user picks one.
+
+    Entries are kept per (session, turn, option text) until they expire
+    (checked on every start() and claim()) or the session moves on; a
+    follow-up that matches one is served from it
+    (waiting for it if it is still running), and the session's other
+    entries are cancelled or written off as wasted.
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._executor = None
+        self._budget = None
+
+    def _setup(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=_conf("max_in_flight"), thread_name_prefix="agent-speculate"
+            )
+            per_hour = _conf("max_per_hour")
+            # up to a minute's worth of the hourly budget may be spent at once
+            self._budget = TokenBucket(per_hour / 3600, max(per_hour // 60, 1))
+
+    def start(self, session, options):
+        """Speculate on the top options of the session's latest turn."""
+        if not _conf("enabled") or not options:
+            return
+        with self._lock:
+            self._setup()
+            self._expire()
+            context = session.prompt_context()
+            for option in options[:_conf("top_n")]:
+                key = (str(session.id), session.turn_count, option)
+                if key in self._entries:
+                    continue
+                in_flight = sum(not e.future.done() for e in self._entries.values())
+                if in_flight >= _conf("max_in_flight") or self._budget.reserve(0) is None:
+                    OUTCOMES.inc(outcome="skipped")
+                    continue
+                prompt = utils.assemble_followup_prompt(option, session.head_answer_json, context)
+                future = self._executor.submit(
+                    utils.call_gemini_rest, prompt, timeout=utils.stage_timeout("answer")
+                )
+                self._entries[key] = _Entry(future, prompt, time.monotonic() + _conf("ttl"))
+                OUTCOMES.inc(outcome="started")
+
+    def claim(self, session_id, turn, option, prompt):
+        """
+        The speculative future for this follow-up, or None. Either way the
+        session's remaining speculation for that turn is dropped.
+        """
+        if not _conf("enabled"):
+            return None
+        session_id = str(session_id)
+        with self._lock:
+            self._expire()   # also frees entries of sessions that went quiet
+            entry = self._entries.pop((session_id, turn, option), None)
+            for key in [k for k in self._entries if k[0] == session_id]:
+                self._drop(self._entries.pop(key))
+
+        failed = entry is not None and entry.future.done() and entry.future.exception() is not None
+        if entry is None or entry.prompt != prompt or failed:
+            if entry is not None:
+                self._drop(entry)
+            OUTCOMES.inc(outcome="miss")
+            return None
+        OUTCOMES.inc(outcome="hit" if entry.future.done() else "hit_inflight")
+        return entry.future
+
+    def _drop(self, entry):
+        if entry.future.cancel():
+            OUTCOMES.inc(outcome="cancelled")
+        else:
+            OUTCOMES.inc(outcome="wasted")
+
+    def _expire(self):
+        now = time.monotonic()
+        for key in [k for k, e in self._entries.items() if e.expires < now]:
+            self._drop(self._entries.pop(key))
+
+    def in_flight(self):
+        with self._lock:
+            return sum(not e.future.done() for e in self._entries.values())
+
+
+speculator = Speculator()
+
+
+@metrics.register_collector
+def _collect_speculation():
+    return [
+        ("agent_speculation_in_flight", "gauge", "Speculative follow-up calls running.", (),
+         [((), speculator.in_flight())]),
+    ]
@@ -1,3 +1,1416 @@
-from django.test import TestCase
+import asyncio
+import importlib
+import io
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+import unittest
+import uuid
+from unittest import mock
 
-# Create your tests here.
+import requests
+from asgiref.sync import sync_to_async
+from django.apps import apps as django_apps
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from . import answercache, jobs, metrics, profiles, prompting, utils
+from .classifier import TOKEN_RE, TopicClassifier, tokenize
+from .fields import compress_text, decompress_text
+from .models import CachedAnswer, OptionsJob, Session, Turn
+from .jsonstream import IncrementalJSONParser, parse_json_object
+from .matcher import CompanyMatcher
+from .ratelimit import Overloaded, UpstreamLimiter
+from .resilience import CircuitBreaker, CircuitOpen, ResilientUpstream
+from .singleflight import SingleFlight
+from .speculation import Speculator
+from .utils import parse_answer
+from .views import QueryBatchView
+
+
+def http_error(status):
+    response = requests.Response()
+    response.status_code = status
+    return requests.HTTPError(f"{status}", response=response)
+
+
+def failing(exc):
+    def attempt(timeout):
+        raise exc
+    return attempt
+
+
+def ok(timeout):
+    return "ok"
+
+
+# ---------------------------------------------------------
+# CIRCUIT BREAKER
+# ---------------------------------------------------------
+class CircuitBreakerTests(SimpleTestCase):
+    def test_opens_after_consecutive_failures(self):
+        breaker = CircuitBreaker("t", failures=2, reset_after=60)
+        breaker.record_failure()
+        self.assertEqual(breaker.state, "closed")
+        breaker.record_failure()
+        self.assertEqual(breaker.state, "open")
+        with self.assertRaises(CircuitOpen):
+            breaker.before_call()
+
+    def test_success_resets_the_failure_count(self):
+        breaker = CircuitBreaker("t", failures=2, reset_after=60)
+        breaker.record_failure()
+        breaker.record_success()
+        breaker.record_failure()
+        self.assertEqual(breaker.state, "closed")
+
+    def test_half_open_admits_a_single_trial(self):
+        breaker = CircuitBreaker("t", failures=1, reset_after=0)
+        breaker.record_failure()
+        self.assertTrue(breaker.before_call())
+        self.assertEqual(breaker.state, "half_open")
+        with self.assertRaises(CircuitOpen):
+            breaker.before_call()
+
+    def test_trial_success_closes(self):
+        breaker = CircuitBreaker("t", failures=1, reset_after=0)
+        breaker.record_failure()
+        breaker.before_call()
+        breaker.record_success()
+        self.assertEqual(breaker.state, "closed")
+        self.assertFalse(breaker.before_call())
+
+    def test_trial_failure_reopens(self):
+        breaker = CircuitBreaker("t", failures=3, reset_after=0)
+        for _ in range(3):
+            breaker.record_failure()
+        breaker.before_call()
+        breaker.record_failure()
+        self.assertEqual(breaker.state, "open")
+
+    def test_released_trial_lets_the_next_call_try(self):
+        breaker = CircuitBreaker("t", failures=1, reset_after=0)
+        breaker.record_failure()
+        breaker.before_call()
+        breaker.release_trial()
+        self.assertEqual(breaker.state, "half_open")
+        self.assertTrue(breaker.before_call())
+
+
+class ResilientUpstreamBreakerTests(SimpleTestCase):
+    def half_open(self):
+        upstream = ResilientUpstream("t", retries=0, breaker_failures=1, breaker_reset=0)
+        with self.assertRaises(requests.ConnectionError):
+            upstream.call(failing(requests.ConnectionError()), 1)
+        self.assertEqual(upstream.breaker.state, "open")
+        return upstream
+
+    def test_trial_retryable_failure_reopens(self):
+        upstream = self.half_open()
+        with self.assertRaises(requests.ConnectionError):
+            upstream.call(failing(requests.ConnectionError()), 1)
+        self.assertEqual(upstream.breaker.state, "open")
+
+    def test_trial_client_error_closes(self):
+        upstream = self.half_open()
+        with self.assertRaises(requests.HTTPError):
+            upstream.call(failing(http_error(400)), 1)
+        self.assertEqual(upstream.breaker.state, "closed")
+
+    def test_trial_overloaded_is_not_an_upstream_outcome(self):
+        upstream = self.half_open()
+        with self.assertRaises(Overloaded):
+            upstream.call(failing(Overloaded("t", 1)), 1)
+        self.assertEqual(upstream.breaker.state, "half_open")
+        self.assertEqual(upstream.call(ok, 1), "ok")
+        self.assertEqual(upstream.breaker.state, "closed")
+
+    def test_async_trial_overloaded_releases_the_trial(self):
+        upstream = self.half_open()
+
+        async def overloaded(timeout):
+            raise Overloaded("t", 1)
+
+        async def succeed(timeout):
+            return "ok"
+
+        with self.assertRaises(Overloaded):
+            asyncio.run(upstream.acall(overloaded, 1))
+        self.assertEqual(asyncio.run(upstream.acall(succeed, 1)), "ok")
+        self.assertEqual(upstream.breaker.state, "closed")
+
+    def test_short_circuit_while_open(self):
+        upstream = ResilientUpstream("t", retries=0, breaker_failures=1, breaker_reset=60)
+        with self.assertRaises(requests.ConnectionError):
+            upstream.call(failing(requests.ConnectionError()), 1)
+        with self.assertRaises(CircuitOpen):
+            upstream.call(ok, 1)
+        self.assertEqual(upstream.stats()["short_circuit"], 1)
+
+    def test_guard_feeds_the_breaker(self):
+        upstream = self.half_open()
+        with self.assertRaises(requests.ConnectionError):
+            with upstream.guard():
+                raise requests.ConnectionError()
+        self.assertEqual(upstream.breaker.state, "open")
+
+        with upstream.guard():
+            pass
+        self.assertEqual(upstream.breaker.state, "closed")
+
+    def test_abandoned_guarded_stream_releases_the_trial(self):
+        upstream = self.half_open()
+
+        def stream():
+            with upstream.guard():
+                yield "chunk"
+                yield "chunk"
+
+        chunks = stream()
+        next(chunks)
+        chunks.close()
+        self.assertEqual(upstream.breaker.state, "half_open")
+        self.assertTrue(upstream.breaker.before_call())
+
+
+# ---------------------------------------------------------
+# POOLED HTTP CLIENT
+# ---------------------------------------------------------
+class HTTPClientTests(SimpleTestCase):
+
+    def setUp(self):
+        utils._reset_http_client()
+        self.addCleanup(utils._reset_http_client)
+
+    def test_shared_between_threads(self):
+        clients = []
+        threads = [threading.Thread(target=lambda: clients.append(utils.http_client())) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len({id(client) for client in clients}), 1)
+        self.assertIs(clients[0], utils.http_client())
+
+    @override_settings(AGENT_HTTP2=False, AGENT_HTTP_POOL_SIZE=7)
+    def test_pool_size(self):
+        adapter = utils.http_client().get_adapter("https://api.tavily.com")
+        self.assertEqual(adapter._pool_maxsize, 7)
+
+    @unittest.skipUnless(hasattr(os, "fork"), "needs os.fork")
+    def test_forked_child_builds_its_own(self):
+        parent = utils.http_client()
+        read, write = os.pipe()
+        pid = os.fork()
+        if pid == 0:  # child: report and leave without running any test machinery
+            try:
+                fresh = utils._http_client is None and utils.http_client() is not parent
+                os.write(write, b"1" if fresh else b"0")
+            finally:
+                os._exit(0)
+        os.close(write)
+        with os.fdopen(read, "rb") as pipe:
+            reported = pipe.read()
+        os.waitpid(pid, 0)
+        self.assertEqual(reported, b"1")
+        self.assertIs(utils.http_client(), parent)
+
+
+# ---------------------------------------------------------
+# ANSWER CACHE
+# ---------------------------------------------------------
+class AnswerCacheTests(TestCase):
+    def cached(self, stored, asked, topic="job", company="microsoft"):
+        answercache.store(topic, company, stored, "", '{"answer": "cached"}')
+        return answercache.lookup(topic, company, asked)
+
+    def test_exact_and_reworded_questions_hit(self):
+        self.assertIsNotNone(self.cached("What is the salary of a software engineer at Microsoft?",
+                                         "microsoft software engineer salaries"))
+
+    def test_synonyms_hit(self):
+        self.assertIsNotNone(self.cached("microsoft jobs", "Microsoft hiring?"))
+
+    def test_misspelling_hits(self):
+        self.assertIsNotNone(self.cached("microsoft software engineer salary",
+                                         "microsoft sofware engineer salary"))
+
+    def test_different_place_misses(self):
+        self.assertIsNone(self.cached("microsoft salary for software engineer in india",
+                                      "microsoft salary for software engineer in usa"))
+
+    def test_different_year_misses(self):
+        self.assertIsNone(self.cached("google internship for students 2024",
+                                      "google internship for students 2025", company="google"))
+        self.assertIsNone(self.cached("infosys layoffs 2024", "infosys layoffs 2023", company="infosys"))
+
+    def test_extra_word_misses(self):
+        self.assertIsNone(self.cached("microsoft salary", "microsoft salary india"))
+
+    def test_scoped_by_company(self):
+        answercache.store("job", "google", "software engineer salary", "", '{"answer": "cached"}')
+        self.assertIsNone(answercache.lookup("job", "microsoft", "software engineer salary"))
+
+
+class ConcurrentAnswerCacheTests(TransactionTestCase):
+    def test_parallel_stores_all_land(self):
+        questions = [f"microsoft {role} salary" for role in (
+            "software engineer", "designer", "analyst", "manager", "intern", "tester",
+            "architect", "recruiter", "accountant", "consultant", "developer", "researcher",
+        )]
+        start = threading.Barrier(len(questions))
+
+        def store(question):
+            start.wait()
+            try:
+                answercache.store("job", "microsoft", question, "", '{"answer": "cached"}')
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=store, args=(q,)) for q in questions]
+        with self.assertNoLogs("agent.answercache", "WARNING"):
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+        self.assertEqual(CachedAnswer.objects.count(), len(questions))
+
+
+# ---------------------------------------------------------
+# INCREMENTAL JSON PARSER
+# ---------------------------------------------------------
+class IncrementalJSONParserTests(SimpleTestCase):
+    def parse_in_chunks(self, raw, size=3):
+        parser = IncrementalJSONParser()
+        members = []
+        for i in range(0, len(raw), size):
+            members += parser.feed(raw[i:i + size])
+        return parser.close(), members
+
+    def test_members_complete_as_they_arrive(self):
+        parsed, members = self.parse_in_chunks('{"a": 1, "b": [1, 2], "c": {"d": "e"}}')
+        self.assertEqual(parsed, {"a": 1, "b": [1, 2], "c": {"d": "e"}})
+        self.assertEqual([key for key, _ in members], ["a", "b", "c"])
+
+    def test_code_fences_and_chatter_are_ignored(self):
+        raw = 'Here you go:\n```json\n{"summary": "ok"}\n```\nAnything else?'
+        parsed, text = parse_json_object(raw)
+        self.assertEqual(parsed, {"summary": "ok"})
+        self.assertEqual(text, '{"summary": "ok"}')
+
+    def test_escapes(self):
+        raw = r'{"q": "say \"hi\"", "path": "c:\\", "u": "\u00e9"}'
+        self.assertEqual(self.parse_in_chunks(raw, size=1)[0], json.loads(raw))
+
+    def test_braces_and_commas_inside_strings(self):
+        raw = '{"code": "if (x) { return [a, b]; }", "n": "}:,{"}'
+        self.assertEqual(self.parse_in_chunks(raw, size=2)[0], json.loads(raw))
+
+    def test_empty_object(self):
+        self.assertEqual(parse_json_object("{}")[0], {})
+
+    def test_malformed_objects_are_rejected(self):
+        for raw in (
+            '{"a":1,}',
+            '{"a":1, junk "b":2}',
+            '{"a":1,,"b":2}',
+            '{,"a":1}',
+            '{"a" "b":1}',
+            '{"a":}',
+            '{"a"}',
+            '{"a":1 2}',
+            '{"a":1]',
+            '{"a": 1',
+        ):
+            with self.subTest(raw=raw):
+                self.assertIsNone(parse_json_object(raw)[0])
+                self.assertIsNone(self.parse_in_chunks(raw, size=1)[0])
+
+    def test_parse_answer_never_stores_invalid_json_as_parsed(self):
+        answer, answer_json = parse_answer('{"a":1, junk "b":2}')
+        self.assertIsInstance(answer, str)
+
+
+# ---------------------------------------------------------
+# BATCH QUERIES
+# ---------------------------------------------------------
+class QueryBatchTests(TestCase):
+    def prepare(self, body):
+        if body["question"] == "prepare fails":
+            raise RuntimeError("search index gone")
+        return {"cached_raw": '{"summary": "cached"}'}, None
+
+    def finish(self, ctx, raw, parser=None):
+        raise RuntimeError("database is locked")
+
+    def test_failing_items_do_not_end_the_stream(self):
+        with mock.patch.object(QueryBatchView, "prepare", self.prepare), \
+                mock.patch.object(QueryBatchView, "finish", self.finish):
+            response = self.client.post(
+                reverse("api-query-batch"),
+                {"items": ["prepare fails", "finish fails"], "parallelism": 1},
+                content_type="application/json",
+            )
+            lines = [json.loads(line) for line in b"".join(response.streaming_content).splitlines()]
+        self.assertEqual(sorted(line["index"] for line in lines), [0, 1])
+        for line in lines:
+            self.assertEqual(line["status"], 500)
+            self.assertIn("error", line)
+
+
+# ---------------------------------------------------------
+# SINGLE-FLIGHT
+# ---------------------------------------------------------
+class AsyncSingleFlightTests(SimpleTestCase):
+    def test_concurrent_callers_share_one_call(self):
+        flight = SingleFlight("t")
+        calls = []
+
+        async def fetch(value):
+            calls.append(value)
+            await asyncio.sleep(0.01)
+            return value
+
+        async def main():
+            return await asyncio.gather(*(flight.ado("k", fetch, "v") for _ in range(5)))
+
+        self.assertEqual(asyncio.run(main()), ["v"] * 5)
+        self.assertEqual(calls, ["v"])
+        self.assertEqual(flight.stats(), {"leaders": 1, "coalesced": 4, "in_flight": 0})
+
+    def test_followers_get_the_leaders_error(self):
+        flight = SingleFlight("t")
+
+        async def fail():
+            await asyncio.sleep(0.01)
+            raise ValueError("upstream")
+
+        async def main():
+            return await asyncio.gather(flight.ado("k", fail), flight.ado("k", fail), return_exceptions=True)
+
+        results = asyncio.run(main())
+        self.assertTrue(all(isinstance(r, ValueError) for r in results))
+
+    def test_follower_takes_over_from_a_cancelled_leader(self):
+        flight = SingleFlight("t")
+
+        async def fetch():
+            await asyncio.sleep(0.05)
+            return "v"
+
+        async def main():
+            leader = asyncio.ensure_future(flight.ado("k", fetch))
+            await asyncio.sleep(0)
+            follower = asyncio.ensure_future(flight.ado("k", fetch))
+            await asyncio.sleep(0.01)
+            leader.cancel()
+            return await follower
+
+        self.assertEqual(asyncio.run(main()), "v")
+
+
+@override_settings(CACHES={
+    "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+    "flight": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "flight-tests"},
+})
+class SharedSingleFlightTests(SimpleTestCase):
+    """A caller waiting on another worker's lock stops at its own timeout."""
+
+    def setUp(self):
+        self.flight = SingleFlight("t", shared_alias="flight", lock_ttl=60, poll_interval=0.01)
+        lock_key, _ = self.flight._keys("k")
+        caches["flight"].add(lock_key, 12345, timeout=60)   # held by another worker
+        self.addCleanup(caches["flight"].clear)
+
+    def test_follower_gives_up_at_the_callers_timeout(self):
+        fetch = mock.Mock(return_value="v")
+        started = time.monotonic()
+        with self.assertRaises(TimeoutError):
+            self.flight.do("k", fetch, timeout=0.1)
+        self.assertLess(time.monotonic() - started, 1)
+        fetch.assert_not_called()
+
+    def test_async_follower_gives_up_at_the_callers_timeout(self):
+        fetch = mock.AsyncMock(return_value="v")
+        started = time.monotonic()
+        with self.assertRaises(TimeoutError):
+            asyncio.run(self.flight.ado("k", fetch, timeout=0.1))
+        self.assertLess(time.monotonic() - started, 1)
+        fetch.assert_not_awaited()
+
+    def test_stale_lock_runs_the_call_after_lock_ttl(self):
+        self.flight.lock_ttl = 0.1
+        fetch = mock.Mock(return_value="v")
+        self.assertEqual(self.flight.do("k", fetch, timeout=5), "v")
+        fetch.assert_called_once_with()
+
+
+# ---------------------------------------------------------
+# UPSTREAM LIMITER
+# ---------------------------------------------------------
+class AsyncLimiterTests(SimpleTestCase):
+    def test_waiters_are_admitted_as_slots_free_up(self):
+        limiter = UpstreamLimiter("t", concurrency=1, max_wait=5)
+        order = []
+
+        async def call(n):
+            async with limiter.aslot():
+                order.append(n)
+                await asyncio.sleep(0.01)
+
+        async def main():
+            await asyncio.gather(*(call(n) for n in range(3)))
+
+        asyncio.run(main())
+        self.assertEqual(order, [0, 1, 2])
+        self.assertEqual(limiter.stats()["admitted"], 3)
+
+    def test_waiter_times_out(self):
+        limiter = UpstreamLimiter("t", concurrency=1, max_wait=5)
+
+        async def main():
+            async with limiter.aslot():
+                with self.assertRaises(Overloaded):
+                    async with limiter.aslot(timeout=0.05):
+                        pass
+
+        asyncio.run(main())
+        self.assertEqual(limiter.stats()["rejected"], 1)
+
+    def test_slot_freed_by_a_thread_wakes_a_coroutine(self):
+        limiter = UpstreamLimiter("t", concurrency=1, max_wait=5)
+
+        def hold():
+            with limiter.slot():
+                time.sleep(0.05)
+
+        async def main():
+            thread = threading.Thread(target=hold)
+            thread.start()
+            await asyncio.sleep(0.01)
+            start = time.monotonic()
+            async with limiter.aslot():
+                waited = time.monotonic() - start
+            thread.join()
+            return waited
+
+        self.assertLess(asyncio.run(main()), 1)
+
+    def test_shared_bucket_is_reserved_off_the_event_loop(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            limiter = UpstreamLimiter("t", rate=100, burst=1, db_path=os.path.join(tmp, "buckets.sqlite3"))
+            threads = set()
+            reserve = limiter.bucket.reserve
+
+            def spy(max_wait):
+                threads.add(threading.get_ident())
+                return reserve(max_wait)
+
+            async def main():
+                async with limiter.aslot():
+                    pass
+                return threading.get_ident()
+
+            with mock.patch.object(limiter.bucket, "reserve", spy):
+                loop_thread = asyncio.run(main())
+            self.assertTrue(threads)
+            self.assertNotIn(loop_thread, threads)
+
+
+# ---------------------------------------------------------
+# COMPANY MATCHER
+# ---------------------------------------------------------
+def legacy_detect_company(text, companies):
+    """detect_company_from_text before CompanyMatcher (three scans of the list)."""
+    t = text.lower()
+    for c in companies:
+        if c == t.strip():
+            return c.title()
+    for c in companies:
+        if c in t:
+            return c.title()
+    for w in t.split():
+        for c in companies:
+            if w == c:
+                return c.title()
+    return None
+
+
+class CompanyMatcherTests(SimpleTestCase):
+
+    def test_agrees_with_the_legacy_scans(self):
+        # wherever the old substring scan found a whole-word mention
+        matcher = CompanyMatcher.from_names(utils.KNOWN_COMPANIES)
+        compared = 0
+        for name in utils.KNOWN_COMPANIES:
+            for text in (name, f"tips for {name} interviews", f"{name.upper()}  vs google",
+                         f"is {name}'s culture good?", f"google cloud or {name}"):
+                legacy = legacy_detect_company(text, utils.KNOWN_COMPANIES)
+                if re.search(rf"\b{re.escape(legacy.lower())}\b", text.lower()):
+                    self.assertEqual(matcher.find(text), legacy, text)
+                    compared += 1
+        self.assertGreater(compared, 5 * len(utils.KNOWN_COMPANIES) - 10)
+
+    def test_only_whole_words_match(self):
+        matcher = CompanyMatcher.from_names(utils.KNOWN_COMPANIES)
+        for text, legacy, company in (("good ideas for a pharmacy", "Ea", None),
+                                      ("tips for mckinsey interviews", "Ey", "Mckinsey"),
+                                      ("toyota hiring", "Oyo", "Toyota")):
+            self.assertEqual(legacy_detect_company(text, utils.KNOWN_COMPANIES), legacy)
+            self.assertEqual(matcher.find(text), company, text)
+
+    def test_whole_text_wins_over_priority(self):
+        matcher = CompanyMatcher.from_names(["google", "google cloud"])
+        self.assertEqual(matcher.find("  Google   Cloud "), "Google Cloud")
+        self.assertEqual(matcher.find("google cloud jobs"), "Google")
+
+    def test_gazetteer_aliases(self):
+        with tempfile.NamedTemporaryFile("w", suffix=".txt", delete=False) as fh:
+            fh.write("# most important first\nAlphabet | google | alphabet inc\n\nMeta | facebook\n")
+        self.addCleanup(os.unlink, fh.name)
+        matcher = CompanyMatcher.from_file(fh.name)
+        self.assertEqual(matcher.size, 5)
+        self.assertEqual(matcher.find("facebook or google?"), "Alphabet")
+        self.assertEqual(matcher.find("Alphabet Inc"), "Alphabet")
+        self.assertIsNone(matcher.find("googleplex"))
+
+
+# ---------------------------------------------------------
+# TOPIC CLASSIFIER
+# ---------------------------------------------------------
+class TopicClassifierTests(SimpleTestCase):
+    def test_tokenize_matches_the_token_regex(self):
+        for text in ("c++ and c# devs", "+job #hiring ++ #", "https://example.com/jobs?q=python#top",
+                     "café résumé naïve", "a+b-c_d\te\nf 2025", ""):
+            self.assertEqual(tokenize(text), TOKEN_RE.findall(text), text)
+
+    def test_phrases_score_in_the_token_pass(self):
+        clf = TopicClassifier()
+        self.assertEqual(clf.rank("best mutual fund for 2025")[0][0], "finance")
+        self.assertEqual(clf.rank("Mutual-Fund returns"), [("finance", 1.0)])
+        self.assertEqual(clf.rank("mutual respect, fund raising"), [])
+        # each occurrence counts, in the question and in the snippets
+        scores = dict.fromkeys(clf.topics, 0.0)
+        clf._score("mutual fund or mutual fund", 2.0, scores)
+        self.assertEqual(scores["finance"], 6.0)
+
+
+# ---------------------------------------------------------
+# TURN MIGRATION
+# ---------------------------------------------------------
+class HistoryToTurnsMigrationTests(TransactionTestCase):
+    """Sessions stored as a history list come out of the migrations as turns."""
+    before = [("agent", "0002_turn")]
+
+    def migrate(self, targets):
+        executor = MigrationExecutor(connection)
+        executor.migrate(targets)
+        return executor.loader.project_state(targets).apps
+
+    def setUp(self):
+        self.latest = MigrationExecutor(connection).loader.graph.leaf_nodes("agent")
+        self.addCleanup(self.migrate, self.latest)
+        old_apps = self.migrate(self.before)
+        OldSession = old_apps.get_model("agent", "Session")
+        self.entries = [
+            {"question": f"question {i}", "clarifiers": "beginner" if i == 1 else "", "topic": "tech",
+             "company": None, "answer_json": json.dumps({"summary": f"answer {i}"}),
+             "answer_raw": f"raw {i}", "options": [f"option {i}"], "ts": "2025-01-01"}
+            for i in range(1, 4)
+        ]
+        self.session = OldSession.objects.create(history=self.entries, last_topic="tech")
+        self.empty = OldSession.objects.create(history=[])
+        self.sparse = OldSession.objects.create(history=[{"question": "only a question"}])
+
+    def test_forward_run(self):
+        self.migrate(self.latest)
+
+        turns = list(Turn.objects.filter(session_id=self.session.id).order_by("ordinal"))
+        self.assertEqual([t.ordinal for t in turns], [1, 2, 3])
+        for turn, entry in zip(turns, self.entries):
+            self.assertEqual(
+                (turn.question, turn.clarifiers, turn.topic, turn.answer_json, turn.answer_raw, turn.options),
+                (entry["question"], entry["clarifiers"], entry["topic"], entry["answer_json"],
+                 entry["answer_raw"], entry["options"]),
+            )
+            self.assertEqual(turn.created_at, self.session.created_at)
+        self.assertFalse(Turn.objects.filter(session_id=self.empty.id).exists())
+        sparse = Turn.objects.get(session_id=self.sparse.id)
+        self.assertEqual((sparse.question, sparse.answer_json, sparse.options), ("only a question", "", []))
+
+        # the denormalized head (0005) points at the last turn
+        session = Session.objects.get(id=self.session.id)
+        self.assertEqual((session.turn_count, session.head_answer_json, session.head_options),
+                         (3, self.entries[-1]["answer_json"], self.entries[-1]["options"]))
+        self.assertEqual(session.head()["topic"], "tech")
+        self.assertEqual(Session.objects.get(id=self.empty.id).turn_count, 0)
+
+    def test_backward_run_restores_the_history(self):
+        self.migrate([("agent", "0003_history_to_turns")])
+        OldSession = self.migrate(self.before).get_model("agent", "Session")
+        history = OldSession.objects.get(id=self.session.id).history
+        self.assertEqual([h["question"] for h in history], ["question 1", "question 2", "question 3"])
+        self.assertEqual(history[0]["options"], ["option 1"])
+
+        self.migrate(self.latest)
+        self.assertEqual(Turn.objects.filter(session_id=self.session.id).count(), 3)
+
+
+# ---------------------------------------------------------
+# COMPRESSED TEXT
+# ---------------------------------------------------------
+class CompressedTextFieldTests(TestCase):
+    LONG = json.dumps({"summary": "Four rounds of interviews. " * 40})
+
+    def setUp(self):
+        self.session = Session.objects.create()
+
+    def turn(self, **fields):
+        return Turn.objects.create(session=self.session, ordinal=Turn.objects.count() + 1, **fields)
+
+    def stored(self, turn, column="answer_json"):
+        return bytes(Turn.objects.filter(pk=turn.pk).values_list(column, flat=True).get())
+
+    def test_round_trip(self):
+        for codec, prefix in (("zstd", b"s"), ("zlib", b"z"), ("", b"r")):
+            with self.subTest(codec=codec), override_settings(AGENT_COMPRESSION=codec):
+                turn = self.turn(answer_json=self.LONG, answer_raw="short")
+                self.assertEqual(self.stored(turn)[:1], prefix)
+                self.assertEqual(self.stored(turn, "answer_raw"), b"rshort")
+                turn = Turn.objects.get(pk=turn.pk)
+                self.assertEqual((turn.answer_json, turn.answer_raw), (self.LONG, "short"))
+
+    def test_legacy_text_is_prefixed_by_the_migration(self):
+        # text stored before compression, some of it starting like a codec byte
+        legacy = ["zebra facts", "salary in usa", "remote work", ""]
+        turns = [self.turn() for _ in legacy]
+        with connection.cursor() as cursor:
+            for turn, text in zip(turns, legacy):
+                cursor.execute("UPDATE agent_turn SET answer_json = %s WHERE id = %s", [text, turn.pk])
+        migration = importlib.import_module("agent.migrations.0013_prefix_legacy_text")
+        migration.prefix_legacy_text(django_apps, None)
+
+        for turn, text in zip(turns, legacy):
+            self.assertEqual(self.stored(turn), b"r" + text.encode())
+            self.assertEqual(Turn.objects.get(pk=turn.pk).answer_json, text)
+
+    def test_unknown_codec_is_an_error(self):
+        with self.assertRaises(ValueError):
+            decompress_text(b"plain text without a codec byte")
+        self.assertEqual(decompress_text(compress_text("zebra facts")), "zebra facts")
+
+    def test_deferred_load(self):
+        turn = self.turn(answer_json=self.LONG)
+        deferred = Turn.objects.only("id", "session_id").get(pk=turn.pk)
+        self.assertNotIn("answer_json", deferred.__dict__)
+        self.assertEqual(deferred.answer_json, self.LONG)
+
+        # a value never read is saved back as stored, not recompressed
+        stored = self.stored(turn)
+        loaded = Turn.objects.get(pk=turn.pk)
+        with mock.patch("agent.fields.compress_text") as compress:
+            loaded.save(update_fields=["answer_json"])
+        compress.assert_not_called()
+        self.assertEqual(self.stored(turn), stored)
+
+
+# ---------------------------------------------------------
+# PROMPT BUDGETS
+# ---------------------------------------------------------
+@mock.patch.object(prompting, "_encoding", False)   # ~4 characters per token, whatever is installed
+class PromptBudgetTests(SimpleTestCase):
+    SNIPPETS = "\n".join([
+        "- Microsoft interview loop: four rounds of coding and design.",
+        "- Weather in Seattle is rainy most of the year, bring an umbrella.",
+        "- Microsoft salary bands for software engineers by level.",
+    ])
+
+    def test_snippets_at_the_budget_are_untouched(self):
+        budget = prompting.count_tokens(self.SNIPPETS)
+        self.assertEqual(prompting.fit_snippets(self.SNIPPETS, "microsoft interview", budget), self.SNIPPETS)
+
+    def test_snippets_over_the_budget_keep_the_relevant_blocks(self):
+        budget = prompting.count_tokens(self.SNIPPETS) - 1
+        fitted = prompting.fit_snippets(self.SNIPPETS, "microsoft interview salary", budget)
+        self.assertLessEqual(prompting.count_tokens(fitted), budget)
+        self.assertNotIn("Seattle", fitted)
+        self.assertTrue(fitted.startswith("- Microsoft interview loop"))
+
+    def test_previous_answer_at_the_budget_is_untouched(self):
+        answer = json.dumps({"summary": "Four rounds.", "details": "Coding, design and behavioural."})
+        self.assertEqual(prompting.fit_previous_answer(answer, prompting.count_tokens(answer)), answer)
+
+    def test_previous_answer_over_the_budget_keeps_the_summary(self):
+        answer = json.dumps({"trivia": "x " * 200, "summary": "Four rounds of interviews.", "details": "y " * 200})
+        for budget in (60, 100, prompting.count_tokens(answer) - 1):
+            fitted = prompting.fit_previous_answer(answer, budget)
+            self.assertLessEqual(prompting.count_tokens(fitted), budget)
+            self.assertEqual(json.loads(fitted)["summary"], "Four rounds of interviews.")
+
+    def test_history_drops_the_oldest_lines_beyond_the_budget(self):
+        summary = ""
+        for n in range(5):
+            summary = prompting.compact_history(
+                summary, {"question": f"question {n}", "answer_json": json.dumps({"summary": f"Answer {n}."})}, 30
+            )
+        lines = summary.splitlines()
+        self.assertLessEqual(prompting.count_tokens(summary), 30)
+        self.assertEqual(lines[-1], "- Q: question 4 -> Answer 4.")
+        # the latest turn stays, even on its own over the budget
+        self.assertEqual(prompting.compact_history(summary, {"question": "q" * 400}, 30), "- Q: " + "q" * 120 + " -> ")
+
+    def test_history_at_the_budget_keeps_every_line(self):
+        summary = "- Q: first -> One.\n- Q: second -> Two."
+        expected = summary + "\n- Q: third -> Three."
+        turn = {"question": "third", "answer_json": json.dumps({"summary": "Three."})}
+        budget = prompting.count_tokens(expected)
+        self.assertEqual(prompting.compact_history(summary, turn, budget), expected)
+        self.assertEqual(prompting.compact_history(summary, turn, budget - 1).splitlines(), expected.splitlines()[1:])
+
+
+class TokenizerLoadTests(SimpleTestCase):
+    def setUp(self):
+        mock.patch.object(prompting, "_encoding", None).start()
+        self.addCleanup(mock.patch.stopall)
+
+    def test_missing_file_estimates_without_the_network(self):
+        with tempfile.TemporaryDirectory() as empty, override_settings(AGENT_TOKENIZER_DIR=empty), \
+                mock.patch.object(prompting.tiktoken, "get_encoding") as get_encoding, \
+                self.assertLogs("agent.prompting", "WARNING"):
+            self.assertEqual(prompting.count_tokens("abcdefgh"), 2)
+        get_encoding.assert_not_called()
+
+    def test_loaded_once_across_threads(self):
+        start = threading.Barrier(8)
+        with mock.patch.object(prompting, "_load_encoding", return_value=False) as load:
+            def count():
+                start.wait()
+                prompting.count_tokens("abcd")
+            threads = [threading.Thread(target=count) for _ in range(8)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+        load.assert_called_once()
+
+
+# ---------------------------------------------------------
+# SPECULATION
+# ---------------------------------------------------------
+@override_settings(AGENT_SPECULATION={"enabled": True, "ttl": 60})
+class SpeculationExpiryTests(SimpleTestCase):
+    def setUp(self):
+        self.speculator = Speculator()
+        self.now = 1000.0
+        mock.patch("agent.speculation.time.monotonic", side_effect=lambda: self.now).start()
+        mock.patch.object(utils, "call_gemini_rest", return_value="{}").start()
+        self.addCleanup(mock.patch.stopall)
+
+    def speculate(self):
+        session = Session(turn_count=1, head_answer_json="{}")
+        self.speculator.start(session, ["Option one"])
+        return session
+
+    def test_claim_expires_other_sessions_entries(self):
+        self.speculate()
+        self.now += 61
+        self.speculator.claim(uuid.uuid4(), 1, "Option one", "prompt")
+        self.assertEqual(self.speculator._entries, {})
+
+    def test_expired_entry_is_not_served(self):
+        session = self.speculate()
+        prompt = next(iter(self.speculator._entries.values())).prompt
+        self.now += 61
+        self.assertIsNone(self.speculator.claim(session.id, 1, "Option one", prompt))
+
+
+# ---------------------------------------------------------
+# SYNC / ASYNC VIEWS
+# ---------------------------------------------------------
+ANSWER = '{"summary": "Stub answer", "key_points": ["a", "b"]}'
+OPTIONS = ["Option one", "Option two", "Option three"]
+
+
+class StubUpstreamMixin:
+    """Tavily and Gemini (sync and async) answering with fixed text."""
+
+    def setUp(self):
+        # patching a coroutine function makes an AsyncMock
+        self.upstream = {
+            name: mock.patch.object(utils, name, return_value=value).start()
+            for name, value in (
+                ("tavily_search_text", "snippets"), ("atavily_search_text", "snippets"),
+                ("call_gemini_rest", ANSWER), ("acall_gemini_rest", ANSWER),
+                ("dynamic_options_ai", OPTIONS), ("adynamic_options_ai", OPTIONS),
+            )
+        }
+        self.addCleanup(mock.patch.stopall)
+
+@override_settings(AGENT_OPTIONS_MODE="inline", AGENT_ANSWER_CACHE={"enabled": False})
+class SyncAsyncViewTests(StubUpstreamMixin, TestCase):
+    """The async views answer exactly like the sync ones."""
+
+    def post(self, path, body):
+        return self.client.post(path, body, content_type="application/json")
+
+    async def apost(self, path, body):
+        return await self.async_client.post(path, body, content_type="application/json")
+
+    def comparable(self, body):
+        return {k: v for k, v in body.items() if k != "session_id"}
+
+    def turns(self, session_id):
+        return list(Turn.objects.filter(session_id=session_id).order_by("ordinal").values(
+            "question", "clarifiers", "topic", "company", "answer_json", "options"
+        ))
+
+    async def test_query_and_followup_match(self):
+        query = {"question": "python list sorting", "clarifiers": "beginner"}
+        sync_query = await sync_to_async(self.post)("/api/query/", query)
+        async_query = await self.apost("/api/async/query/", query)
+        self.assertEqual((sync_query.status_code, async_query.status_code), (201, 201))
+        self.assertEqual(self.comparable(sync_query.json()), self.comparable(async_query.json()))
+
+        sync_id, async_id = sync_query.json()["session_id"], async_query.json()["session_id"]
+        sync_followup = await sync_to_async(self.post)("/api/followup/", {"session_id": sync_id, "option_index": 2})
+        async_followup = await self.apost("/api/async/followup/", {"session_id": async_id, "option_index": 2})
+        self.assertEqual((sync_followup.status_code, async_followup.status_code), (200, 200))
+        self.assertEqual(self.comparable(sync_followup.json()), self.comparable(async_followup.json()))
+
+        sync_turns = await sync_to_async(self.turns)(sync_id)
+        self.assertEqual(sync_turns, await sync_to_async(self.turns)(async_id))
+        self.assertEqual(sync_turns[1]["question"], OPTIONS[1])
+
+    async def test_errors_match(self):
+        for path, body in (("query/", {}), ("followup/", {"session_id": str(uuid.uuid4())}),
+                           ("followup/", {"option_index": 1})):
+            sync_response = await sync_to_async(self.post)(f"/api/{path}", body)
+            async_response = await self.apost(f"/api/async/{path}", body)
+            self.assertEqual(sync_response.status_code, async_response.status_code)
+            self.assertEqual(sync_response.json(), async_response.json())
+
+
+def sse_frames(content):
+    """[(event, data)] of a text/event-stream body."""
+    frames = []
+    for frame in content.split("\n\n")[:-1]:
+        event, data = frame.split("\n")
+        frames.append((event.removeprefix("event: "), json.loads(data.removeprefix("data: "))))
+    return frames
+
+
+@override_settings(AGENT_OPTIONS_MODE="inline", AGENT_ANSWER_CACHE={"enabled": False})
+class StreamingViewTests(StubUpstreamMixin, TestCase):
+    """The sync and async SSE views send the same frames, in order."""
+    chunks = [ANSWER[:10], ANSWER[10:30], ANSWER[30:]]
+
+    def setUp(self):
+        super().setUp()
+        chunks = self.chunks
+
+        async def astream(prompt, **kwargs):
+            for chunk in chunks:
+                yield chunk
+
+        mock.patch.object(utils, "stream_gemini_rest", return_value=iter(chunks)).start()
+        mock.patch.object(utils, "astream_gemini_rest", astream).start()
+
+    def stream(self, path):
+        response = self.client.post(path, {"question": "python list sorting"}, content_type="application/json")
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        return sse_frames(b"".join(response.streaming_content).decode())
+
+    async def astream(self, path):
+        response = await self.async_client.post(path, {"question": "python list sorting"},
+                                                content_type="application/json")
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        self.assertTrue(response.is_async)   # sent frame by frame under ASGI, not buffered
+        return sse_frames(b"".join([frame async for frame in response.streaming_content]).decode())
+
+    def assert_answer_frames(self, frames):
+        self.assertEqual([event for event, _ in frames],
+                         ["answer"] * 2 + ["field"] + ["answer", "field", "options", "done"])
+        self.assertEqual("".join(data["delta"] for event, data in frames if event == "answer"), ANSWER)
+        self.assertEqual([data["key"] for event, data in frames if event == "field"], ["summary", "key_points"])
+        self.assertEqual(frames[-2][1], {"options": OPTIONS, "options_status": "ready"})
+        self.assertEqual(frames[-1][1]["answer"], json.loads(ANSWER))
+
+    def test_sync_stream(self):
+        self.assert_answer_frames(self.stream("/api/query/stream/"))
+
+    async def test_async_stream(self):
+        self.assert_answer_frames(await self.astream("/api/async/query/stream/"))
+
+    def test_finish_error_is_a_frame(self):
+        from .views import QueryStreamView
+        with mock.patch.object(QueryStreamView, "finish", side_effect=RuntimeError("database is locked")), \
+                self.assertLogs("agent.views", "ERROR"):
+            frames = self.stream("/api/query/stream/")
+        self.assertEqual(frames[-1], ("error", {"error": "could not store the answer",
+                                                "detail": "database is locked"}))
+        self.assertNotIn("done", [event for event, _ in frames])
+
+
+@override_settings(AGENT_OPTIONS_MODE="background", AGENT_ANSWER_CACHE={"enabled": False},
+                   AGENT_OPTIONS_INLINE_AFTER=60)
+class PendingOptionsTests(StubUpstreamMixin, TestCase):
+    """An option picked before background options land is never answered from regenerated ones."""
+
+    def setUp(self):
+        super().setUp()
+        response = self.client.post("/api/query/", {"question": "python list sorting"}, content_type="application/json")
+        self.assertEqual(response.json()["options_status"], "pending")
+        self.session_id = response.json()["session_id"]
+
+    def followup(self, path="/api/followup/"):
+        return self.client.post(path, {"session_id": self.session_id, "option_index": 1},
+                                content_type="application/json")
+
+    def test_pending_options_conflict(self):
+        for path in ("/api/followup/", "/api/async/followup/"):
+            response = self.followup(path)
+            self.assertEqual(response.status_code, 409)
+            self.assertEqual(response.json()["options_status"], "pending")
+        self.upstream["dynamic_options_ai"].assert_not_called()
+        self.upstream["adynamic_options_ai"].assert_not_called()
+
+    def test_stored_options_are_used_once_ready(self):
+        self.upstream["dynamic_options_ai"].return_value = ["Stored option"]
+        turn = Turn.objects.get(session_id=self.session_id, ordinal=1)
+        jobs.run_job(jobs.claim(turn.options_job.pk))
+        self.upstream["dynamic_options_ai"].reset_mock()
+        # as if the job finished after the request read the session head
+        Session.objects.filter(pk=self.session_id).update(head_options=[])
+
+        response = self.followup()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Turn.objects.get(session_id=self.session_id, ordinal=2).question, "Stored option")
+        self.upstream["dynamic_options_ai"].assert_not_called()
+
+    @override_settings(AGENT_OPTIONS_INLINE_AFTER=0)
+    def test_stalled_job_runs_in_the_request(self):
+        response = self.followup()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Turn.objects.get(session_id=self.session_id, ordinal=2).question, OPTIONS[0])
+        self.assertEqual(OptionsJob.objects.get(turn__session_id=self.session_id, turn__ordinal=1).status,
+                         OptionsJob.DONE)
+
+    def test_turn_without_options_or_job_regenerates(self):
+        OptionsJob.objects.all().delete()   # as stored before options were kept
+        response = self.followup()
+        self.assertEqual(response.status_code, 200)
+        self.upstream["dynamic_options_ai"].assert_called_once()
+
+
+@override_settings(AGENT_OPTIONS_MODE="background", AGENT_ANSWER_CACHE={"enabled": False},
+                   AGENT_OPTIONS_INLINE_AFTER=60, AGENT_OPTIONS_SYNC_POLL_MAX=0.3)
+class OptionsLongPollTests(StubUpstreamMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        response = self.client.post("/api/query/", {"question": "python list sorting"}, content_type="application/json")
+        self.session_id = response.json()["session_id"]
+
+    def test_sync_wait_is_capped(self):
+        started = time.monotonic()
+        response = self.client.get(f"/api/session/{self.session_id}/options/", {"wait": 20})
+        self.assertLess(time.monotonic() - started, 2)
+        self.assertEqual(response.json()["options_status"], "pending")
+
+    async def test_async_wait_sleeps_on_the_event_loop(self):
+        states = iter([("pending", []), ("pending", []), ("ready", OPTIONS)])
+        with mock.patch("agent.views._poll_options", side_effect=lambda turn: next(states)), \
+                mock.patch("agent.views.time.sleep", side_effect=AssertionError("blocking sleep")):
+            response = await self.async_client.get(f"/api/async/session/{self.session_id}/options/", {"wait": 20})
+        self.assertEqual(response.json(), {"session_id": self.session_id, "turn": 1,
+                                           "options_status": "ready", "options": OPTIONS})
+
+
+class OptionsWorkerTests(SimpleTestCase):
+    def test_a_slow_job_does_not_hold_back_the_others(self):
+        queue = [0.6, 0.05, 0.05, 0.05]   # job durations, claimed in this order
+        started = {}
+        t0 = time.monotonic()
+
+        def claim_batch(limit):
+            claimed, queue[:] = queue[:limit], queue[limit:]
+            return [(len(started) + i, seconds) for i, seconds in enumerate(claimed)]
+
+        def run_job(job):
+            started[job] = time.monotonic() - t0
+            time.sleep(job[1])
+
+        with mock.patch.object(jobs, "claim_batch", side_effect=claim_batch), \
+                mock.patch.object(jobs, "run_job", side_effect=run_job):
+            call_command("run_options_worker", once=True, concurrency=2, poll_interval=0.01, stdout=io.StringIO())
+        self.assertEqual(len(started), 4)
+        # the short jobs ran next to the slow one, not after it
+        self.assertLess(max(started.values()), 0.4)
+
+
+@override_settings(AGENT_OPTIONS_MODE="background", AGENT_ANSWER_CACHE={"enabled": False},
+                   AGENT_OPTIONS_INLINE_AFTER=60)
+class SessionETagTests(StubUpstreamMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        response = self.client.post("/api/query/", {"question": "python list sorting"}, content_type="application/json")
+        self.session_id = response.json()["session_id"]
+        self.client.post("/api/followup/", {"session_id": self.session_id, "custom": "and tuples?"},
+                         content_type="application/json")
+
+    def get(self, path, etag):
+        return self.client.get(path, HTTP_IF_NONE_MATCH=etag)
+
+    def test_options_for_an_older_turn_change_the_etag(self):
+        for path in (f"/api/session/{self.session_id}/", f"/api/async/session/{self.session_id}/"):
+            etag = self.client.get(path)["ETag"]
+            self.assertEqual(self.get(path, etag).status_code, 304)
+
+            # turn 1's background options land after turn 2 was appended
+            jobs.run_job(jobs.claim(OptionsJob.objects.get(turn__session_id=self.session_id, turn__ordinal=1,
+                                                           status=OptionsJob.PENDING).pk))
+            response = self.get(path, etag)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotEqual(response["ETag"], etag)
+            self.assertEqual(response.json()["history"][0]["options"], OPTIONS)
+            OptionsJob.objects.filter(turn__ordinal=1).update(status=OptionsJob.PENDING)
+
+
+@override_settings(AGENT_OPTIONS_MODE="inline", AGENT_OPTIONS_COMBINED=False)
+class CachedAnswerProfileTests(StubUpstreamMixin, TestCase):
+    """A cached company answer is served with the profile as it is now."""
+    question = {"question": "microsoft interview tips"}
+
+    def setUp(self):
+        super().setUp()
+        self.profile = {"company_name": "Microsoft", "ceo": "Old CEO"}
+        mock.patch.object(profiles, "get_profile", side_effect=lambda company: dict(self.profile)).start()
+        mock.patch.object(utils, "detect_topic", return_value=("company", "microsoft")).start()
+
+    def ask(self):
+        return self.client.post("/api/query/", self.question, content_type="application/json").json()["answer"]
+
+    def test_cached_without_the_profile(self):
+        self.assertEqual(self.ask()["ceo"], "Old CEO")
+        cached = json.loads(answercache.lookup("company", "microsoft", self.question["question"]))
+        self.assertNotIn("ceo", cached)
+
+        self.profile["ceo"] = "New CEO"
+        self.assertEqual(self.ask()["ceo"], "New CEO")
+        self.upstream["call_gemini_rest"].assert_called_once()
+
+    def test_stale_profile_fields_of_older_entries_are_replaced(self):
+        answercache.store("company", "microsoft", self.question["question"], "",
+                          json.dumps({"summary": "Cached", "ceo": "Old CEO"}))
+        self.profile["ceo"] = "New CEO"
+        answer = self.ask()
+        self.assertEqual((answer["summary"], answer["ceo"]), ("Cached", "New CEO"))
+        self.upstream["call_gemini_rest"].assert_not_called()
+
+
+@override_settings(AGENT_OPTIONS_MODE="inline", AGENT_ANSWER_CACHE={"enabled": False})
+class RefreshOptionsTests(StubUpstreamMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        response = self.client.post("/api/query/", {"question": "python list sorting"}, content_type="application/json")
+        self.session_id = response.json()["session_id"]
+        self.upstream["dynamic_options_ai"].return_value = ["Fresh one", "Fresh two"]
+        self.upstream["adynamic_options_ai"].return_value = ["Fresh one", "Fresh two"]
+
+    def post(self, path, body):
+        return self.client.post(path, {"session_id": self.session_id, **body}, content_type="application/json")
+
+    def test_refresh_returns_and_stores_new_options(self):
+        for path in ("/api/followup/", "/api/async/followup/"):
+            with self.subTest(path=path):
+                response = self.post(path, {"refresh": True, "option_index": 1})
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.json(), {"session_id": self.session_id, "turn": 1,
+                                                   "options_status": "ready", "options": ["Fresh one", "Fresh two"]})
+                session = Session.objects.get(pk=self.session_id)
+                self.assertEqual(session.turn_count, 1)   # nothing was answered
+                self.assertEqual(session.head_options, ["Fresh one", "Fresh two"])
+                self.assertEqual(session.turns.get(ordinal=1).options, ["Fresh one", "Fresh two"])
+
+    def test_option_index_picks_from_the_refreshed_options(self):
+        self.post("/api/followup/", {"refresh": True})
+        response = self.post("/api/followup/", {"option_index": 2})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Turn.objects.get(session_id=self.session_id, ordinal=2).question, "Fresh two")
+
+
+# ---------------------------------------------------------
+# COMBINED OPTIONS
+# ---------------------------------------------------------
+COMBINED = json.dumps({"summary": "Stub answer", utils.OPTIONS_KEY: [f"Own {n}" for n in range(1, 7)]})
+
+
+@override_settings(AGENT_OPTIONS_MODE="combined", AGENT_ANSWER_CACHE={"enabled": False})
+class CombinedOptionsTests(StubUpstreamMixin, TestCase):
+    """One Gemini call answers and suggests the follow-up options."""
+    own = [f"Own {n}" for n in range(1, 7)]
+
+    def setUp(self):
+        super().setUp()
+        for name in ("call_gemini_rest", "acall_gemini_rest"):
+            self.upstream[name].return_value = COMBINED
+
+    def post(self, path, body):
+        return self.client.post(path, body, content_type="application/json")
+
+    def test_query_uses_the_answers_options(self):
+        response = self.post("/api/query/", {"question": "python list sorting"})
+        self.assertEqual(response.status_code, 201)
+        body = response.json()
+        self.assertEqual((body["options"], body["options_status"]), (self.own, "ready"))
+        self.assertNotIn(utils.OPTIONS_KEY, body["answer"])
+        self.assertIn(utils.OPTIONS_KEY, self.upstream["call_gemini_rest"].call_args.args[0])
+        # no options call, and no search for its context
+        self.upstream["dynamic_options_ai"].assert_not_called()
+        self.upstream["tavily_search_text"].assert_called_once()
+        turn = Turn.objects.get(session_id=body["session_id"])
+        self.assertEqual(turn.options, self.own)
+        self.assertNotIn(utils.OPTIONS_KEY, turn.answer_json)
+
+    def test_followup_uses_the_answers_options(self):
+        session_id = self.post("/api/query/", {"question": "python list sorting"}).json()["session_id"]
+        response = self.post("/api/followup/", {"session_id": session_id, "option_index": 2})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Turn.objects.get(session_id=session_id, ordinal=2).question, "Own 2")
+        self.assertEqual(response.json()["options"], self.own)
+        self.assertIn(utils.OPTIONS_KEY, self.upstream["call_gemini_rest"].call_args.args[0])
+        self.upstream["dynamic_options_ai"].assert_not_called()
+
+    def test_missing_or_malformed_options_fall_back_to_a_call(self):
+        for answer in (ANSWER, json.dumps({"summary": "x", utils.OPTIONS_KEY: ["only", "two"]}),
+                       json.dumps({"summary": "x", utils.OPTIONS_KEY: "not a list"})):
+            self.upstream["call_gemini_rest"].return_value = answer
+            self.upstream["dynamic_options_ai"].reset_mock()
+            body = self.post("/api/query/", {"question": "python list sorting"}).json()
+            self.assertEqual(body["options"], OPTIONS, answer)
+            self.assertNotIn(utils.OPTIONS_KEY, body["answer"])
+            self.upstream["dynamic_options_ai"].assert_called_once()
+
+    async def test_async_query_matches(self):
+        sync_body = (await sync_to_async(self.post)("/api/query/", {"question": "python list sorting"})).json()
+        async_body = (await self.async_client.post("/api/async/query/", {"question": "python list sorting"},
+                                                   content_type="application/json")).json()
+        self.assertEqual(async_body["options"], self.own)
+        self.assertEqual(async_body["answer"], sync_body["answer"])
+        self.upstream["adynamic_options_ai"].assert_not_called()
+
+    def test_stream_sends_the_options_once(self):
+        with mock.patch.object(utils, "stream_gemini_rest", return_value=iter([COMBINED[:25], COMBINED[25:]])):
+            response = self.post("/api/query/stream/", {"question": "python list sorting"})
+            frames = sse_frames(b"".join(response.streaming_content).decode())
+        self.assertEqual([data["key"] for event, data in frames if event == "field"], ["summary"])
+        self.assertEqual(frames[-2], ("options", {"options": self.own, "options_status": "ready"}))
+
+    @override_settings(AGENT_ANSWER_CACHE={"enabled": True})
+    def test_cached_answer_keeps_its_options(self):
+        for _ in range(2):
+            body = self.post("/api/query/", {"question": "python list sorting"}).json()
+            self.assertEqual(body["options"], self.own)
+        self.upstream["call_gemini_rest"].assert_called_once()
+        self.upstream["dynamic_options_ai"].assert_not_called()
+
+
+# ---------------------------------------------------------
+# SESSION HEAD
+# ---------------------------------------------------------
+def entry(n, **extra):
+    return {"question": f"question {n}", "topic": "tech", "answer_json": json.dumps({"summary": f"answer {n}"}),
+            "options": [f"option {n}"], **extra}
+
+
+class SessionHeadTests(TestCase):
+    """Session's copy of its latest turn."""
+
+    def assertHeadIsLastTurn(self, session):
+        session = Session.objects.get(pk=session.pk)
+        last = session.turns.order_by("-ordinal").first()
+        self.assertEqual(session.turn_count, last.ordinal)
+        self.assertEqual(session.head(), {"topic": last.topic, "company": session.company,
+                                          "answer_json": last.answer_json, "options": last.options})
+
+    def test_follows_appends(self):
+        session = Session.objects.create()
+        self.assertEqual(session.head(), {})
+        for n in range(1, 4):
+            session.append_history(entry(n))
+            self.assertHeadIsLastTurn(session)
+
+    def test_stale_copy_appends_after_the_latest_turn(self):
+        session = Session.objects.create()
+        stale = Session.objects.get(pk=session.pk)
+        session.append_history(entry(1))
+        turn = stale.append_history(entry(2))
+        self.assertEqual((turn.ordinal, stale.turn_count), (2, 2))
+        self.assertHeadIsLastTurn(session)
+
+    def test_options_reach_the_head_of_the_latest_turn_only(self):
+        session = Session.objects.create()
+        first = session.append_history(entry(1))
+        second = session.append_history(entry(2))
+        jobs.store_options(second, ["new two"])
+        jobs.store_options(first, ["new one"])
+        self.assertEqual(Session.objects.get(pk=session.pk).head_options, ["new two"])
+        self.assertHeadIsLastTurn(session)
+
+
+@override_settings(AGENT_OPTIONS_MODE="inline", AGENT_ANSWER_CACHE={"enabled": False})
+class FollowupHeadTests(StubUpstreamMixin, TestCase):
+    """A follow-up reads the session head, never the turn history."""
+
+    def test_followup_does_not_read_turns(self):
+        session = Session.objects.create()
+        for n in range(1, 6):
+            session.append_history(entry(n))
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post("/api/followup/", {"session_id": str(session.id), "option_index": 1},
+                                        content_type="application/json")
+        self.assertEqual(response.status_code, 200)
+        turn_reads = [q["sql"] for q in queries if q["sql"].startswith("SELECT") and '"agent_turn"' in q["sql"]]
+        self.assertEqual(turn_reads, [])
+        self.assertIn('"summary": "answer 5"', self.upstream["call_gemini_rest"].call_args.args[0])
+        self.assertEqual(Turn.objects.get(session=session, ordinal=6).question, "option 5")
+
+
+# ---------------------------------------------------------
+# METRICS
+# ---------------------------------------------------------
+class MetricsExpositionTests(SimpleTestCase):
+
+    def setUp(self):
+        registry = list(metrics._registry)
+        self.addCleanup(setattr, metrics, "_registry", registry)
+
+    def test_histogram_buckets_are_cumulative(self):
+        hist = metrics.Histogram("test_seconds", "Test.", ("stage",), buckets=(0.1, 1))
+        for value in (0.05, 0.1, 0.5, 3):
+            hist.observe(value, stage="x")
+        self.assertEqual(hist.expose(), [
+            "# HELP test_seconds Test.",
+            "# TYPE test_seconds histogram",
+            'test_seconds_bucket{stage="x",le="0.1"} 2',
+            'test_seconds_bucket{stage="x",le="1"} 3',
+            'test_seconds_bucket{stage="x",le="+Inf"} 4',
+            'test_seconds_sum{stage="x"} 3.65',
+            'test_seconds_count{stage="x"} 4',
+        ])
+
+    def test_counter_escapes_label_values(self):
+        counter = metrics.Counter("test_total", "Test.", ("reason",))
+        counter.inc(reason='say "hi"\n')
+        counter.inc(2, reason='say "hi"\n')
+        self.assertEqual(counter.expose()[-1], r'test_total{reason="say \"hi\"\n"} 3')
+        self.assertIn(r'test_total{reason="say \"hi\"\n"} 3', metrics.render())
+
+
+def server_timing(response):
+    """{stage: milliseconds} of a Server-Timing header."""
+    stages = {}
+    for part in response["Server-Timing"].split(", "):
+        name, dur = part.split(";dur=")
+        stages[name] = float(dur)
+    return stages
+
+
+@override_settings(AGENT_OPTIONS_MODE="inline", AGENT_ANSWER_CACHE={"enabled": False})
+class ServerTimingTests(StubUpstreamMixin, TestCase):
+    """Stage timings, including those of stage worker threads, reach the response."""
+
+    def setUp(self):
+        super().setUp()
+
+        def search(query, *args, **kwargs):
+            with metrics.timed("tavily"):
+                time.sleep(0.01)
+            return "snippets"
+        self.upstream["tavily_search_text"].side_effect = search
+
+    def test_sync_view(self):
+        response = self.client.post("/api/query/", {"question": "python list sorting"},
+                                    content_type="application/json")
+        stages = server_timing(response)
+        self.assertTrue({"tavily", "topic", "prompt", "parse", "total"} <= set(stages), stages)
+        # the question's search and the options' search, both on stage threads
+        self.assertGreaterEqual(stages["tavily"], 20)
+
+    async def test_async_view(self):
+        response = await self.async_client.post("/api/async/query/", {"question": "python list sorting"},
+                                                content_type="application/json")
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue({"topic", "prompt", "total"} <= set(server_timing(response)))
+
+    def test_metrics_endpoint(self):
+        self.client.post("/api/query/", {"question": "python list sorting"}, content_type="application/json")
+        response = self.client.get("/api/metrics")
+        self.assertTrue(response["Content-Type"].startswith("text/plain; version=0.0.4"))
+        body = response.content.decode()
+        self.assertIn('agent_request_duration_seconds_count{view="api-query",status="201"}', body)
+        self.assertIn('agent_stage_duration_seconds_count{stage="tavily"}', body)
+
+
+# ---------------------------------------------------------
+# CONCURRENT STAGES
+# ---------------------------------------------------------
+@override_settings(AGENT_OPTIONS_MODE="inline", AGENT_ANSWER_CACHE={"enabled": False},
+                   AGENT_STAGE_TIMEOUTS={"search": 0.05, "answer": 0.05, "options": 0.05})
+class StageTimeoutTests(StubUpstreamMixin, TestCase):
+    """A stage that outlives its timeout is given up on, not waited for."""
+
+    def setUp(self):
+        super().setUp()
+        self.release = threading.Event()
+        self.addCleanup(self.release.set)
+
+    def stall(self, name, value):
+        def slow(*args, **kwargs):
+            self.release.wait(5)
+            return value
+        self.upstream[name].side_effect = slow
+
+    def post(self):
+        return self.client.post("/api/query/", {"question": "python list sorting"},
+                                content_type="application/json")
+
+    def test_slow_search_answers_without_snippets(self):
+        self.stall("tavily_search_text", "snippets")
+        response = self.post()
+        self.assertEqual(response.status_code, 201)
+        self.assertNotIn("snippets", self.upstream["call_gemini_rest"].call_args.args[0])
+
+    def test_slow_answer_is_a_gateway_timeout(self):
+        self.stall("call_gemini_rest", ANSWER)
+        response = self.post()
+        self.assertEqual((response.status_code, response.json()), (504, {"error": "AI API timed out"}))
+        self.assertFalse(Session.objects.exists())
+
+    def test_slow_options_fall_back_to_the_defaults(self):
+        self.stall("dynamic_options_ai", OPTIONS)
+        response = self.post()
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()["options"], utils.DEFAULT_OPTIONS)
+
+    def test_stages_overlap(self):
+        # the options search is prefetched while Gemini answers
+        started = []
+        def search(query, *args, **kwargs):
+            started.append(query)
+            return "snippets"
+        def answer(prompt, *args, **kwargs):
+            time.sleep(0.02)
+            self.assertEqual(len(started), 2)
+            return ANSWER
+        self.upstream["tavily_search_text"].side_effect = search
+        self.upstream["call_gemini_rest"].side_effect = answer
+        with override_settings(AGENT_STAGE_TIMEOUTS={}):
+            self.assertEqual(self.post().status_code, 201)
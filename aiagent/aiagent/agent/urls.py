@@ -1,8 +1,24 @@
 from django.urls import path
-from .views import QueryView, FollowupView, SessionDetailView
+from .views import (
+    QueryView, FollowupView, SessionDetailView, SessionOptionsView, QueryStreamView, FollowupStreamView, QueryBatchView,
+    AsyncQueryView, AsyncFollowupView, AsyncQueryStreamView, AsyncFollowupStreamView, AsyncSessionDetailView,
+    AsyncSessionOptionsView, MetricsView,
+)
 
 urlpatterns = [
     path("query/", QueryView.as_view(), name="api-query"),
     path("followup/", FollowupView.as_view(), name="api-followup"),
+    path("query/stream/", QueryStreamView.as_view(), name="api-query-stream"),
+    path("query/batch/", QueryBatchView.as_view(), name="api-query-batch"),
+    path("followup/stream/", FollowupStreamView.as_view(), name="api-followup-stream"),
     path("session/<uuid:session_id>/", SessionDetailView.as_view(), name="api-session"),
+    path("session/<uuid:session_id>/options/", SessionOptionsView.as_view(), name="api-session-options"),
+    path("async/query/", AsyncQueryView.as_view(), name="api-async-query"),
+    path("async/followup/", AsyncFollowupView.as_view(), name="api-async-followup"),
+    path("async/query/stream/", AsyncQueryStreamView.as_view(), name="api-async-query-stream"),
+    path("async/followup/stream/", AsyncFollowupStreamView.as_view(), name="api-async-followup-stream"),
+    path("async/session/<uuid:session_id>/", AsyncSessionDetailView.as_view(), name="api-async-session"),
+    path("async/session/<uuid:session_id>/options/", AsyncSessionOptionsView.as_view(),
+         name="api-async-session-options"),
+    path("metrics", MetricsView.as_view(), name="api-metrics"),
 ]
@@ -1,22 +1,57 @@
+import asyncio
+import contextvars
+import hashlib
 import os
 import json
+import logging
 import re
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as StageTimeout
+
 import requests
+from requests.adapters import HTTPAdapter
+from django.conf import settings
 from dotenv import load_dotenv
 
+from .cache import build_cache, normalize_query
+from .classifier import TopicClassifier
+from .jsonstream import parse_json_object
+from .matcher import CompanyMatcher
+from . import metrics
+from .metrics import timed
+from .prompting import count_tokens, fit_previous_answer, fit_snippets
+from .ratelimit import Overloaded, build_limiter  # noqa: F401  (Overloaded used by views)
+from .resilience import CircuitOpen, build_upstream  # noqa: F401  (CircuitOpen used by views)
+from .singleflight import build_flight
+
 load_dotenv()
 
+llm_log = logging.getLogger("agent.llm")
+
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 TAVILY_API_KEY = os.getenv("TAVILY_API_KEY")
 
 
 
-GEMINI_URL = "https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash:generateContent"
+# base URLs can be pointed at local stand-ins (see benchmarks/)
+GEMINI_API_BASE = os.getenv("GEMINI_API_BASE", "https://generativelanguage.googleapis.com")
+TAVILY_API_BASE = os.getenv("TAVILY_API_BASE", "https://api.tavily.com")
+
+GEMINI_URL = f"{GEMINI_API_BASE}/v1beta/models/gemini-2.0-flash:generateContent"
+GEMINI_STREAM_URL = f"{GEMINI_API_BASE}/v1beta/models/gemini-2.0-flash:streamGenerateContent?alt=sse"
 HEADERS = {
     "Content-Type": "application/json",
     "X-goog-api-key": GEMINI_API_KEY
 }
 
+TAVILY_URL = f"{TAVILY_API_BASE}/search"
+TAVILY_HEADERS = {
+    "Content-Type": "application/json",
+    "Authorization": f"Bearer {TAVILY_API_KEY}"
+}
+
 KNOWN_COMPANIES = [
     # Big Tech
     "microsoft", "google", "alphabet", "apple", "amazon", "meta", "facebook",
@@ -67,36 +102,178 @@ KNOWN_COMPANIES = [
 ]
 
 
+DEFAULT_OPTIONS = [
+    "Give more details",
+    "Explain step-by-step",
+    "Provide real examples",
+    "Show latest related updates",
+    "Compare alternatives",
+    "Suggest next recommended actions"
+]
+
+
+# ---------------------------------------------------------
+# CONCURRENT STAGES
+# ---------------------------------------------------------
+DEFAULT_STAGE_TIMEOUTS = {"search": 10, "answer": 35, "options": 25}
+
+_stage_executor = ThreadPoolExecutor(
+    max_workers=getattr(settings, "AGENT_STAGE_WORKERS", 16),
+    thread_name_prefix="agent-stage",
+)
+
+
+def stage_timeout(stage):
+    """Configured upper bound (seconds) for one pipeline stage."""
+    timeouts = getattr(settings, "AGENT_STAGE_TIMEOUTS", {})
+    return timeouts.get(stage, DEFAULT_STAGE_TIMEOUTS[stage])
+
+
+def submit_stage(fn, *args, **kwargs):
+    """Start an upstream call on the shared stage pool and return its future."""
+    # carry the request's context (stage timings) into the worker thread
+    return _stage_executor.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+
+def stage_result(future, stage, default=None):
+    """
+    Wait for a stage future for at most its configured timeout.
+    Returns `default` if the stage times out; other errors propagate.
+    """
+    try:
+        return future.result(timeout=stage_timeout(stage))
+    except StageTimeout:
+        future.cancel()
+        return default
+
+
+# ---------------------------------------------------------
+# POOLED HTTP CLIENT
+# ---------------------------------------------------------
+_http_client = None
+_http_client_lock = threading.Lock()
+
+
+def _build_http_client():
+    pool_size = getattr(settings, "AGENT_HTTP_POOL_SIZE", 32)
+
+    if getattr(settings, "AGENT_HTTP2", False):
+        try:
+            import h2  # noqa: F401  (httpx needs it for http2=True)
+            import httpx
+            return httpx.Client(
+                http2=True,
+                limits=httpx.Limits(
+                    max_connections=pool_size,
+                    max_keepalive_connections=pool_size,
+                    keepalive_expiry=getattr(settings, "AGENT_HTTP_KEEPALIVE", 60),
+                ),
+            )
+        except ImportError:
+            pass  # fall back to HTTP/1.1 keep-alive
+
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, pool_block=False)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def http_client():
+    """
+    Process-wide keep-alive client shared by Gemini and Tavily calls.
+    Built lazily on first use; safe to share between worker threads.
+    """
+    global _http_client
+    if _http_client is None:
+        with _http_client_lock:
+            if _http_client is None:
+                _http_client = _build_http_client()
+    return _http_client
+
+
+def _reset_http_client():
+    # a forked worker must not reuse sockets opened by its parent
+    global _http_client, _http_client_lock
+    _http_client = None
+    _http_client_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_http_client)
+
+
 # ---------------------------------------------------------
 # TAVILY SEARCH
 # ---------------------------------------------------------
+search_cache = build_cache("search", {"max_entries": 512, "ttl": 900})
+search_flight = build_flight("search")
+tavily_limiter = build_limiter("tavily")
+
+
 def tavily_search_text(query, max_hits=6):
-    """Fetch short web snippets."""
-    try:
-        from tavily import TavilyClient
-        client = TavilyClient(api_key=TAVILY_API_KEY)
-        res = client.search(query=query)
-        hits = res.get("results", [])[:max_hits]
+    """Fetch short web snippets (cached per normalized query)."""
+    key = f"{max_hits}:{normalize_query(query)}"
+    cached = search_cache.get(key)
+    if cached is not None:
+        return cached
 
-        out = []
-        for h in hits:
-            title = h.get("title", "No title")
-            url = h.get("url", "")
-            snippet = (h.get("snippet") or "")[:200]
-            out.append(f"- {title}\n  URL: {url}\n  Snippet: {snippet}")
+    # identical concurrent searches share one upstream request
+    try:
+        text = search_flight.do(key, _tavily_fetch, query, max_hits, timeout=stage_timeout("search"))
+    except TimeoutError:
+        return ""   # another worker's search did not finish in time
+    if text:
+        # empty text means the search failed; let the next caller retry
+        search_cache.set(key, text)
+    return text
 
-        return "\n".join(out)
 
-    except Exception:
+@timed("tavily")
+def _tavily_fetch(query, max_hits):
+    try:
+        with tavily_limiter.slot(timeout=stage_timeout("search")):
+            resp = http_client().post(
+                TAVILY_URL, headers=TAVILY_HEADERS, json={"query": query},
+                timeout=stage_timeout("search")
+            )
+        resp.raise_for_status()
+        return _format_hits(resp.json(), max_hits)
+
+    except Exception as e:
+        count_upstream_error("tavily", e)
         return ""
 
 
+def count_upstream_error(upstream, exc):
+    """Count a failed upstream call by HTTP status or exception type."""
+    if isinstance(exc, Overloaded):
+        reason = "overloaded"
+    elif isinstance(exc, CircuitOpen):
+        reason = "circuit_open"
+    else:
+        reason = getattr(getattr(exc, "response", None), "status_code", None) or type(exc).__name__
+    metrics.UPSTREAM_ERRORS.inc(upstream=upstream, reason=reason)
+
+
+def _format_hits(res, max_hits):
+    hits = res.get("results", [])[:max_hits]
+
+    out = []
+    for h in hits:
+        title = h.get("title", "No title")
+        url = h.get("url", "")
+        snippet = (h.get("snippet") or "")[:200]
+        out.append(f"- {title}\n  URL: {url}\n  Snippet: {snippet}")
+
+    return "\n".join(out)
+
+
 # ---------------------------------------------------------
 # GEMINI CALL
 # ---------------------------------------------------------
-def call_gemini_rest(prompt, temperature=0.25, timeout=30):
-    """Call Gemini with strict JSON expectation."""
-    payload = {
+def _gemini_payload(prompt, temperature):
+    return {
         "contents": [{"parts": [{"text": prompt}]}],
         "generationConfig": {
             "temperature": temperature,
@@ -105,37 +282,117 @@ def call_gemini_rest(prompt, temperature=0.25, timeout=30):
         }
     }
 
-    resp = requests.post(GEMINI_URL, headers=HEADERS, json=payload, timeout=timeout)
-    resp.raise_for_status()
-    data = resp.json()
 
-    text = (
+def _candidate_text(data):
+    return (
         data.get("candidates", [{}])[0]
             .get("content", {})
             .get("parts", [{}])[0]
             .get("text", "")
     )
 
-    # Remove markdown fences
+
+def clean_model_text(text):
+    """Remove markdown fences around a model answer."""
     if text.startswith("```"):
         text = text.replace("```json", "").replace("```", "").strip()
-
     return text.strip()
 
 
+gemini_flight = build_flight("gemini")
+gemini_upstream = build_upstream("gemini")   # retries, hedging, circuit breaker
+gemini_limiter = build_limiter("gemini")     # rate and concurrency admission
+
+
+def call_gemini_rest(prompt, temperature=0.25, timeout=30):
+    """
+    Call Gemini with strict JSON expectation. Concurrent calls with the
+    same prompt and temperature share a single upstream request.
+    """
+    key = hashlib.sha1(f"{temperature}:{prompt}".encode("utf-8")).hexdigest()
+    return gemini_flight.do(key, _gemini_generate, prompt, temperature, timeout, timeout=timeout)
+
+
+@timed("gemini")
+def _gemini_generate(prompt, temperature, timeout):
+    payload = _gemini_payload(prompt, temperature)
+
+    def attempt(remaining):
+        with gemini_limiter.slot(timeout=remaining):
+            resp = http_client().post(GEMINI_URL, headers=HEADERS, json=payload, timeout=remaining)
+        resp.raise_for_status()
+        return resp.json()
+
+    try:
+        data = gemini_upstream.call(attempt, timeout)
+    except Exception as e:
+        count_upstream_error("gemini", e)
+        raise
+
+    text = _candidate_text(data)
+    log_llm_call("generateContent", prompt, text, data.get("usageMetadata"))
+    return clean_model_text(text)
+
+
+def log_llm_call(kind, prompt, response_text, usage=None):
+    """Log local and (when reported) API token counts for one Gemini call."""
+    usage = usage or {}
+    prompt_tokens, response_tokens = count_tokens(prompt), count_tokens(response_text)
+    metrics.PROMPT_TOKENS.observe(prompt_tokens, kind=kind)
+    metrics.RESPONSE_TOKENS.observe(response_tokens, kind=kind)
+    llm_log.info(
+        "gemini %s prompt_tokens=%d response_tokens=%d api_prompt_tokens=%s api_response_tokens=%s",
+        kind, prompt_tokens, response_tokens,
+        usage.get("promptTokenCount"), usage.get("candidatesTokenCount"),
+    )
+
+
+def _sse_lines(url, payload, timeout):
+    """POST `payload` and yield response lines as they arrive."""
+    client = http_client()
+    if isinstance(client, requests.Session):
+        with client.post(url, headers=HEADERS, json=payload, timeout=timeout, stream=True) as resp:
+            resp.raise_for_status()
+            yield from resp.iter_lines(decode_unicode=True)
+    else:  # httpx
+        with client.stream("POST", url, headers=HEADERS, json=payload, timeout=timeout) as resp:
+            resp.raise_for_status()
+            yield from resp.iter_lines()
+
+
+def stream_gemini_rest(prompt, temperature=0.25, timeout=30):
+    """
+    Call Gemini's streamGenerateContent and yield answer text chunks as
+    they are generated. `timeout` bounds each read, not the whole stream.
+    Not retried (chunks may already be out), but it feeds Gemini's breaker.
+    """
+    payload = _gemini_payload(prompt, temperature)
+    parts, usage = [], None
+    try:
+        with timed("gemini_stream"), gemini_upstream.guard(), gemini_limiter.slot(timeout=timeout):
+            for line in _sse_lines(GEMINI_STREAM_URL, payload, timeout):
+                if not line or not line.startswith("data:"):
+                    continue
+                data = json.loads(line[5:])
+                usage = data.get("usageMetadata") or usage
+                chunk = _candidate_text(data)
+                if chunk:
+                    parts.append(chunk)
+                    yield chunk
+    except Exception as e:
+        count_upstream_error("gemini", e)
+        raise
+    log_llm_call("streamGenerateContent", prompt, "".join(parts), usage)
+
+
 # ---------------------------------------------------------
 # JSON EXTRACTOR
 # ---------------------------------------------------------
 def extract_json(raw):
-    # Try direct extraction first
-    try:
-        s = raw.index("{")
-        e = raw.rindex("}") + 1
-        candidate = raw[s:e]
-        json.loads(candidate)
-        return candidate
-    except Exception:
-        pass
+    """JSON object text found in `raw` (best effort when it is not valid JSON)."""
+    parsed, text = parse_json_object(raw)
+    if parsed is not None:
+        return text
 
     # Fallback regex
     cleaned = raw.replace("```", "")
@@ -143,55 +400,94 @@ def extract_json(raw):
     return m.group(1) if m else raw
 
 
+@timed("parse")
+def parse_answer(raw, parser=None):
+    """
+    Decode a model answer exactly once. Returns (answer, answer_json): the
+    parsed object (or the best-effort text if it is not valid JSON) and
+    the JSON text to store. Pass the IncrementalJSONParser that already
+    consumed a stream to reuse its result.
+    """
+    if parser is not None and parser.close() is not None:
+        return parser.close(), parser.text
+    parsed, text = parse_json_object(raw)
+    if parsed is not None:
+        return parsed, text
+    answer_json = extract_json(raw)
+    return answer_json, answer_json
+
+
 # ---------------------------------------------------------
 # TOPIC DETECTION
 # ---------------------------------------------------------
+_company_matcher = None
+_company_matcher_lock = threading.Lock()
+
+
+def company_matcher():
+    """
+    Compiled matcher over settings.AGENT_COMPANY_GAZETTEER if set,
+    otherwise over KNOWN_COMPANIES. Built once per process.
+    """
+    global _company_matcher
+    if _company_matcher is None:
+        with _company_matcher_lock:
+            if _company_matcher is None:
+                path = getattr(settings, "AGENT_COMPANY_GAZETTEER", None)
+                if path:
+                    _company_matcher = CompanyMatcher.from_file(path)
+                else:
+                    _company_matcher = CompanyMatcher.from_names(KNOWN_COMPANIES)
+    return _company_matcher
+
+
 def detect_company_from_text(text):
     if not text:
         return None
+    return company_matcher().find(text)
 
-    t = text.lower()
 
-    # Full exact match first
-    for c in KNOWN_COMPANIES:
-        if c == t.strip():
-            return c.title()
 
-    # Partial match detection
-    for c in KNOWN_COMPANIES:
-        if c in t:
-            return c.title()
+_topic_classifier = None
+_topic_classifier_lock = threading.Lock()
 
-    # Token smart match: (e.g., "I want microsoft job" → "Microsoft")
-    words = t.split()
-    for w in words:
-        for c in KNOWN_COMPANIES:
-            if w == c:
-                return c.title()
 
-    return None
+def topic_classifier():
+    """
+    TopicClassifier over settings.AGENT_TOPIC_KEYWORDS, which may be a
+    {topic: {keyword: weight}} dict or a path to a JSON file with one.
+    Built once per process.
+    """
+    global _topic_classifier
+    if _topic_classifier is None:
+        with _topic_classifier_lock:
+            if _topic_classifier is None:
+                keywords = getattr(settings, "AGENT_TOPIC_KEYWORDS", None)
+                weight = getattr(settings, "AGENT_TOPIC_QUESTION_WEIGHT", 3.0)
+                if isinstance(keywords, (str, os.PathLike)):
+                    _topic_classifier = TopicClassifier.from_file(keywords, question_weight=weight)
+                else:
+                    _topic_classifier = TopicClassifier(keywords, question_weight=weight)
+    return _topic_classifier
+
 
+def rank_topics(user_text, tavily_snippets=""):
+    """All matching topics with confidence scores, best first."""
+    return topic_classifier().rank(user_text, tavily_snippets)
 
 
+@timed("topic")
 def detect_topic(user_text, tavily_snippets=""):
     """Detect main domain for structured AI response."""
-    text = (user_text or "").lower() + " " + (tavily_snippets or "").lower()
+    text = (user_text or "") + " " + (tavily_snippets or "")
 
     comp = detect_company_from_text(text)
     if comp:
         return "company", comp
 
-    if any(k in text for k in ["job", "hiring", "resume", "interview", "salary", "careers"]):
-        return "job", None
-
-    if any(k in text for k in ["stock", "invest", "investment", "portfolio", "sip", "nifty", "crypto", "mutual fund"]):
-        return "finance", None
-
-    if any(k in text for k in ["game", "gaming", "unity", "unreal", "developer", "gamedev"]):
-        return "gaming", None
-
-    if any(k in text for k in ["python", "java", "c++", "leetcode", "algorithm", "debug"]):
-        return "coding", None
+    ranked = rank_topics(user_text, tavily_snippets)
+    if ranked:
+        return ranked[0][0], None
 
     return "general", None
 
@@ -200,10 +496,12 @@ def detect_topic(user_text, tavily_snippets=""):
 # PROMPT: MAIN ANSWER GENERATOR
 # ---------------------------------------------------------
 
-def build_answer_prompt(topic, user_q, clarifiers, tavily_text, company=None):
+def build_answer_prompt(topic, user_q, clarifiers, tavily_text, company=None, profile=None):
     """
     FIXED VERSION — Removes the rule that forces unknown.
     Ensures full JSON with high-quality factual/estimated info.
+    With a stored company `profile`, only the question-specific company
+    fields are asked for (see merge_company_profile).
     """
 
     base_context = f"""
@@ -225,6 +523,35 @@ RULES:
 - If web data is incomplete, use **industry-standard estimates**, widely known facts, and typical values.
 - Fill ALL arrays with at least 2 relevant items.
 - JSON must be fully factual, complete, polished.
+"""
+
+    # ----- COMPANY (PROFILE ALREADY KNOWN) -----
+    if topic == "company" and profile:
+        return base_context + f"""
+
+Company Detected: {company}
+
+Known Company Profile (already shown to the user; use it, do NOT repeat it):
+{json.dumps(profile, ensure_ascii=False)}
+
+Return STRICT JSON ONLY with this schema:
+
+{{
+  "summary": "",
+  "hiring_info": "",
+  "roles_open": ["", ""],
+  "skills_required": ["", ""],
+  "salaries": "",
+  "interview_process": "",
+  "latest_news": "",
+  "actionable_steps": ["", ""]
+}}
+
+RULES:
+- NO field must ever be left blank.
+- NO field must ever be "unknown".
+- Answer the user's question in "summary".
+- Return ONLY JSON with no wrapper text.
 """
 
     # ----- COMPANY -----
@@ -342,12 +669,81 @@ Return ONLY this JSON structure:
 
 
 # ---------------------------------------------------------
-# AI-GENERATED DYNAMIC FOLLOW-UP OPTIONS
+# COMPANY PROFILES (SLOW-CHANGING PART OF COMPANY ANSWERS)
 # ---------------------------------------------------------
-def dynamic_options_ai(topic, company, previous_json, tavily_text):
-    """Generate 6 high-quality relevant follow-up options."""
+# key order of a full company answer
+COMPANY_FIELDS = (
+    "company_name", "summary", "industry", "founding_year", "headquarters", "ceo",
+    "employee_count", "global_presence", "hiring_info", "roles_open", "skills_required",
+    "salaries", "interview_process", "work_culture", "tech_stack", "products_services",
+    "competitors", "latest_news", "actionable_steps",
+)
+# the ones kept in CompanyProfile and not regenerated per question
+PROFILE_FIELDS = (
+    "company_name", "industry", "founding_year", "headquarters", "ceo", "employee_count",
+    "global_presence", "work_culture", "tech_stack", "products_services", "competitors",
+)
+# stored profiles read by requests (agent/profiles.py); {} marks "none stored"
+profile_cache = build_cache("profiles", {"max_entries": 1024, "ttl": 300})
+
+
+def build_company_profile_prompt(company, tavily_text):
+    return f"""
+You are an AI that MUST respond in STRICT JSON ONLY.
+Never include commentary, markdown, explanations, or backticks.
+
+Build a reference profile of the company "{company}".
+
+Web Data:
+{tavily_text}
+
+Return STRICT JSON ONLY with this schema:
+
+{{
+  "company_name": "{company}",
+  "industry": "",
+  "founding_year": "",
+  "headquarters": "",
+  "ceo": "",
+  "employee_count": "",
+  "global_presence": "",
+  "work_culture": "",
+  "tech_stack": ["", ""],
+  "products_services": ["", ""],
+  "competitors": ["", ""]
+}}
+
+RULES:
+- NO field must ever be left blank.
+- NO field must ever be "unknown".
+- Use best-known information + reasonable estimates.
+"""
+
 
-    prompt = f"""
+def generate_company_profile(company):
+    """Ask Gemini for the profile fields of one company."""
+    tavily_text = tavily_search_text(f"{company} company overview headquarters ceo")
+    prompt = build_company_profile_prompt(company, fit_snippets(tavily_text, company, prompt_budget("answer")))
+    parsed, _ = parse_json_object(call_gemini_rest(prompt, timeout=stage_timeout("answer")))
+    profile = {k: parsed[k] for k in PROFILE_FIELDS if parsed.get(k)} if parsed else {}
+    if not profile:
+        raise ValueError(f"profile response for {company} has no profile fields")
+    return profile
+
+
+def merge_company_profile(profile, answer):
+    """A full company answer from a stored profile and the question-specific fields."""
+    merged = {**profile, **{k: v for k, v in answer.items() if v}}
+    ordered = {k: merged[k] for k in COMPANY_FIELDS if k in merged}
+    ordered.update((k, v) for k, v in merged.items() if k not in ordered)
+    return ordered
+
+
+# ---------------------------------------------------------
+# AI-GENERATED DYNAMIC FOLLOW-UP OPTIONS
+# ---------------------------------------------------------
+def build_options_prompt(topic, company, previous_json, tavily_text):
+    return f"""
 You are an AI assistant generating SMART follow-up options for the user.
 
 You MUST return STRICT JSON only.
@@ -374,20 +770,80 @@ Return EXACTLY:
 }}
 """
 
+
+def parse_options(raw):
+    parsed, _ = parse_json_object(raw)
+    if parsed is None:
+        raise ValueError("options response is not a JSON object")
+    return parsed.get("options", [])
+
+
+def assemble_options_prompt(topic, company, previous_json, tavily_text):
+    """build_options_prompt fitted to the "options" token budget."""
+    fixed = count_tokens(build_options_prompt(topic, company, "", ""))
+    room = max(prompt_budget("options") - fixed, 0)
+    previous = fit_previous_answer(previous_json, room * 2 // 3)
+    snippets = fit_snippets(tavily_text, f"{company or ''} {topic}", room - count_tokens(previous))
+    return build_options_prompt(topic, company, previous, snippets)
+
+
+@timed("options")
+def dynamic_options_ai(topic, company, previous_json, tavily_text):
+    """Generate 6 high-quality relevant follow-up options."""
+    prompt = assemble_options_prompt(topic, company, previous_json, tavily_text)
     try:
-        raw = call_gemini_rest(prompt)
-        data = extract_json(raw)
-        parsed = json.loads(data)
-        return parsed.get("options", [])
+        raw = call_gemini_rest(prompt, timeout=stage_timeout("options"))
+        return parse_options(raw)
     except Exception:
-        return [
-            "Give more details",
-            "Explain step-by-step",
-            "Provide real examples",
-            "Show latest related updates",
-            "Compare alternatives",
-            "Suggest next recommended actions"
-        ]
+        return list(DEFAULT_OPTIONS)
+
+
+# ---------------------------------------------------------
+# OPTIONS GENERATED WITH THE ANSWER (AGENT_OPTIONS_MODE = "combined")
+# ---------------------------------------------------------
+# "options" is already an answer field of the finance schema
+OPTIONS_KEY = "follow_up_options"
+
+COMBINED_OPTIONS_RULES = """
+ALSO include this key in the same JSON object:
+
+  "follow_up_options": ["...", "...", "...", "...", "...", "..."]
+
+- EXACTLY 6 follow-up questions the user may want to explore next
+- short, relevant, actionable, tied to the topic; avoid generic questions
+"""
+
+COMBINED_OPTIONS = metrics.Counter(
+    "agent_combined_options_total",
+    "Answers asked to carry their follow-up options, by result "
+    "(used, fallback: missing or malformed, so a separate options call was made).",
+    ("result",),
+)
+
+
+def combined_options():
+    """True when answers carry their own follow-up options (one Gemini call)."""
+    return getattr(settings, "AGENT_OPTIONS_MODE", "background") == "combined"
+
+
+def split_options(answer, answer_json):
+    """
+    Take the follow-up options out of an answer. Returns (answer,
+    answer_json, options); options is None when missing or malformed.
+    """
+    if not isinstance(answer, dict) or OPTIONS_KEY not in answer:
+        options = None
+    else:
+        answer = dict(answer)
+        options = answer.pop(OPTIONS_KEY)
+        answer_json = json.dumps(answer, ensure_ascii=False)
+        if isinstance(options, list):
+            options = [o.strip() for o in options if isinstance(o, str) and o.strip()][:6]
+        if not isinstance(options, list) or len(options) < 3:
+            options = None
+    if combined_options():
+        COMBINED_OPTIONS.inc(result="fallback" if options is None else "used")
+    return answer, answer_json, options
 
 
 # ---------------------------------------------------------
@@ -518,3 +974,196 @@ FINAL INSTRUCTION — PRODUCE JSON ONLY
 ====================================================
 NOW produce ONLY the final JSON object. No explanation.
 """
+
+
+# ---------------------------------------------------------
+# TOKEN-BUDGETED PROMPT ASSEMBLY
+# ---------------------------------------------------------
+DEFAULT_PROMPT_BUDGETS = {"answer": 3000, "followup": 3500, "options": 1500}
+
+
+def prompt_budget(endpoint):
+    """Max prompt tokens for one kind of Gemini call."""
+    budgets = getattr(settings, "AGENT_PROMPT_BUDGETS", {})
+    return budgets.get(endpoint, DEFAULT_PROMPT_BUDGETS[endpoint])
+
+
+@timed("prompt")
+def assemble_answer_prompt(topic, user_q, clarifiers, tavily_text, company=None, profile=None):
+    """build_answer_prompt with the web snippets ranked and cut to the "answer" budget."""
+    extra = COMBINED_OPTIONS_RULES if combined_options() else ""
+    fixed = count_tokens(build_answer_prompt(topic, user_q, clarifiers, "", company=company, profile=profile) + extra)
+    snippets = fit_snippets(tavily_text, user_q, prompt_budget("answer") - fixed)
+    return build_answer_prompt(topic, user_q, clarifiers, snippets, company=company, profile=profile) + extra
+
+
+@timed("prompt")
+def assemble_followup_prompt(option_text, previous_answer_json, session_context):
+    """build_followup_prompt with the previous answer shrunk to the "followup" budget."""
+    extra = COMBINED_OPTIONS_RULES if combined_options() else ""
+    fixed = count_tokens(build_followup_prompt(option_text, "", session_context) + extra)
+    previous = fit_previous_answer(previous_answer_json, prompt_budget("followup") - fixed)
+    return build_followup_prompt(option_text, previous, session_context) + extra
+
+
+# ---------------------------------------------------------
+# ASYNC UPSTREAM CALLS (ASGI views)
+# ---------------------------------------------------------
+_async_clients = weakref.WeakKeyDictionary()   # event loop -> httpx.AsyncClient
+
+
+def async_http_client():
+    """Pooled httpx.AsyncClient for the running event loop."""
+    import httpx
+
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        pool_size = getattr(settings, "AGENT_ASYNC_POOL_SIZE", 200)
+        http2 = getattr(settings, "AGENT_HTTP2", False)
+        if http2:
+            try:
+                import h2  # noqa: F401
+            except ImportError:
+                http2 = False
+        client = httpx.AsyncClient(
+            http2=http2,
+            limits=httpx.Limits(
+                max_connections=pool_size,
+                max_keepalive_connections=pool_size,
+                keepalive_expiry=getattr(settings, "AGENT_HTTP_KEEPALIVE", 60),
+            ),
+        )
+        _async_clients[loop] = client
+    return client
+
+
+async def atavily_search_text(query, max_hits=6):
+    """Async tavily_search_text, sharing its cache and single-flight."""
+    key = f"{max_hits}:{normalize_query(query)}"
+    cached = await search_cache.aget(key)
+    if cached is not None:
+        return cached
+
+    try:
+        text = await search_flight.ado(key, _atavily_fetch, query, max_hits, timeout=stage_timeout("search"))
+    except TimeoutError:
+        return ""
+    if text:
+        await search_cache.aset(key, text)
+    return text
+
+
+async def _atavily_fetch(query, max_hits):
+    try:
+        with timed("tavily"):
+            async with tavily_limiter.aslot(timeout=stage_timeout("search")):
+                resp = await async_http_client().post(
+                    TAVILY_URL, headers=TAVILY_HEADERS, json={"query": query},
+                    timeout=stage_timeout("search")
+                )
+        resp.raise_for_status()
+        return _format_hits(resp.json(), max_hits)
+    except Exception as e:
+        count_upstream_error("tavily", e)
+        return ""
+
+
+async def acall_gemini_rest(prompt, temperature=0.25, timeout=30):
+    """Async call_gemini_rest, coalesced with identical in-flight calls."""
+    key = hashlib.sha1(f"{temperature}:{prompt}".encode("utf-8")).hexdigest()
+    return await gemini_flight.ado(key, _agemini_generate, prompt, temperature, timeout, timeout=timeout)
+
+
+async def _agemini_generate(prompt, temperature, timeout):
+    payload = _gemini_payload(prompt, temperature)
+
+    async def attempt(remaining):
+        async with gemini_limiter.aslot(timeout=remaining):
+            resp = await async_http_client().post(GEMINI_URL, headers=HEADERS, json=payload, timeout=remaining)
+        resp.raise_for_status()
+        return resp.json()
+
+    try:
+        with timed("gemini"):
+            data = await gemini_upstream.acall(attempt, timeout)
+    except Exception as e:
+        count_upstream_error("gemini", e)
+        raise
+    text = _candidate_text(data)
+    log_llm_call("generateContent", prompt, text, data.get("usageMetadata"))
+    return clean_model_text(text)
+
+
+async def astream_gemini_rest(prompt, temperature=0.25, timeout=30):
+    """Async stream_gemini_rest: yields answer text chunks as they are generated."""
+    payload = _gemini_payload(prompt, temperature)
+    parts, usage = [], None
+    try:
+        with timed("gemini_stream"), gemini_upstream.guard():
+            async with gemini_limiter.aslot(timeout=timeout):
+                async with async_http_client().stream(
+                    "POST", GEMINI_STREAM_URL, headers=HEADERS, json=payload, timeout=timeout
+                ) as resp:
+                    resp.raise_for_status()
+                    async for line in resp.aiter_lines():
+                        if not line or not line.startswith("data:"):
+                            continue
+                        data = json.loads(line[5:])
+                        usage = data.get("usageMetadata") or usage
+                        chunk = _candidate_text(data)
+                        if chunk:
+                            parts.append(chunk)
+                            yield chunk
+    except Exception as e:
+        count_upstream_error("gemini", e)
+        raise
+    log_llm_call("streamGenerateContent", prompt, "".join(parts), usage)
+
+
+async def adynamic_options_ai(topic, company, previous_json, tavily_text):
+    """Async dynamic_options_ai."""
+    prompt = assemble_options_prompt(topic, company, previous_json, tavily_text)
+    with timed("options"):
+        try:
+            raw = await acall_gemini_rest(prompt, timeout=stage_timeout("options"))
+            return parse_options(raw)
+        except Exception:
+            return list(DEFAULT_OPTIONS)
+
+
+async def astage(coro, stage, default=None):
+    """Await `coro` for at most the stage timeout; `default` on timeout."""
+    try:
+        return await asyncio.wait_for(coro, stage_timeout(stage))
+    except asyncio.TimeoutError:
+        return default
+
+
+# ---------------------------------------------------------
+# METRICS COLLECTED AT SCRAPE TIME
+# ---------------------------------------------------------
+@metrics.register_collector
+def _collect_upstream_stats():
+    caches = {"search": search_cache.stats(), "profiles": profile_cache.stats()}
+    flights = {"search": search_flight.stats(), "gemini": gemini_flight.stats()}
+    limiters = {"tavily": tavily_limiter.stats(), "gemini": gemini_limiter.stats()}
+    upstream = gemini_upstream.stats()
+    return [
+        ("agent_cache_hit_ratio", "gauge", "Hit ratio of a response cache since start.", ("cache",),
+         [((name, ), st["hit_ratio"]) for name, st in caches.items()]),
+        ("agent_cache_lookups_total", "counter", "Cache lookups by result.", ("cache", "result"),
+         [((name, result), st[result]) for name, st in caches.items() for result in ("hits", "shared_hits", "misses")]),
+        ("agent_cache_entries", "gauge", "Entries in the in-process cache.", ("cache",),
+         [((name, ), st["size"]) for name, st in caches.items()]),
+        ("agent_singleflight_calls_total", "counter", "Upstream calls made vs. coalesced.", ("upstream", "role"),
+         [((name, role), st[role]) for name, st in flights.items() for role in ("leaders", "coalesced")]),
+        ("agent_limiter_total", "counter", "Upstream admission outcomes.", ("upstream", "outcome"),
+         [((name, outcome), st[outcome]) for name, st in limiters.items() for outcome in ("admitted", "queued", "rejected")]),
+        ("agent_limiter_waiting", "gauge", "Callers waiting for an upstream slot.", ("upstream",),
+         [((name, ), st["waiting"]) for name, st in limiters.items()]),
+        ("agent_gemini_calls_total", "counter", "Gemini call outcomes (retries, hedges, breaker).", ("outcome",),
+         [((outcome, ), upstream[outcome]) for outcome in gemini_upstream.COUNTERS]),
+        ("agent_gemini_circuit_open", "gauge", "1 while the Gemini circuit breaker is not closed.", (),
+         [((), int(upstream["state"] != "closed"))]),
+    ]
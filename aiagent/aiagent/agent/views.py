@@ -1,130 +1,952 @@
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
-from .models import Session
+from .models import Session, Turn
 from .serializers import SessionSerializer
-from . import utils
+from .jsonstream import IncrementalJSONParser
+from . import answercache, jobs, metrics, profiles, utils
+from .speculation import speculator
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import connections
+from django.http import Http404, HttpResponse, HttpResponseNotModified, JsonResponse, StreamingHttpResponse
+from django.views import View
 from django.shortcuts import get_object_or_404
+from django.utils.http import parse_etags, quote_etag
+import asyncio
+import hashlib
 import json
+import logging
+import math
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from django.views.decorators.csrf import csrf_exempt
 from django.utils.decorators import method_decorator
 
+log = logging.getLogger("agent.views")
+
+
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def _prefetch_options_context():
+    # only inline options need the search context while Gemini answers; combined
+    # answers bring their own options and fetch it only to fall back
+    return not jobs.options_in_background() and not utils.combined_options()
+
+
+def _upstream_refused(e, response_class):
+    """429 when we are over our own upstream limits, 503 while the circuit is open."""
+    if isinstance(e, utils.Overloaded):
+        body, status_code = {"error":"Too many requests","detail":str(e)}, 429
+    else:
+        body, status_code = {"error":"AI unavailable","detail":str(e)}, 503
+    return response_class(body, status=status_code, headers={"Retry-After": str(math.ceil(e.retry_after))})
+
+
+# ---------------------------------------------------------
+# QUERY / FOLLOW-UP STEPS
+# ---------------------------------------------------------
+# Shared by the sync views and the async ones (see ASYNC VIEWS below),
+# which only differ in how they wait for Tavily and Gemini. The steps
+# that touch the database are plain functions the async views run
+# through sync_to_async. A request's state travels in one `ctx` dict.
+def _question_input(body):
+    """(question, clarifiers, error) of a /api/query/ body."""
+    question = body.get("question") or ""
+    if not question:
+        return None, None, {"error":"question required"}
+    return question, body.get("clarifiers",""), None
+
+
+def _answer_context(question, clarifiers, tavily_text):
+    """The ctx of a new question: its topic and company, from the question and its search snippets."""
+    topic, company = utils.detect_topic(question, tavily_text)
+    if topic == "company" and not company:
+        company = utils.detect_company_from_text(tavily_text)
+    return {
+        "question": question,
+        "clarifiers": clarifiers,
+        "topic": topic,
+        "company": company,
+        "search_text": tavily_text,
+        "background": jobs.options_in_background(),
+        "context_future": None,   # the options context, when prefetched
+    }
+
+
+def _plan_answer(ctx):
+    """Add the stored profile, the cached answer and, on a cache miss, the prompt (database reads)."""
+    topic, company = ctx["topic"], ctx["company"]
+    # a stored company profile leaves only the question-specific fields to generate
+    ctx["profile"] = profiles.get_profile(company) if topic == "company" else None
+    # the same (or a near-duplicate) question answered before needs no prompt at all
+    ctx["cached_raw"] = answercache.lookup(topic, company, ctx["question"], ctx["clarifiers"])
+    ctx["prompt"] = None
+    if ctx["cached_raw"] is None:
+        ctx["prompt"] = utils.assemble_answer_prompt(
+            topic, ctx["question"], ctx["clarifiers"], ctx["search_text"], company=company, profile=ctx["profile"]
+        )
+    return ctx
+
+
+def _followup_input(body):
+    """Error of a /api/followup/ body that names no session or no follow-up, else None."""
+    if not body.get("session_id"):
+        return {"error":"session_id required"}
+    if "custom" not in body and not body.get("refresh") and body.get("option_index") is None:
+        return {"error":"option_index or custom required"}
+    return None
+
+
+def _followup_context(session):
+    """The ctx of a follow-up: what it needs from the session head (the turn history is not read)."""
+    last = session.head()
+    return {
+        "session": session,
+        "previous_json": last.get("answer_json",""),
+        "topic": session.last_topic or last.get("topic","general"),
+        "company": session.company or last.get("company", ""),
+        "options": last.get("options"),
+        "background": jobs.options_in_background(),
+        "context_future": None,
+    }
+
+
+def _needs_options(body, ctx):
+    """True when an option_index follow-up arrived before the head had its options."""
+    return "custom" not in body and not body.get("refresh") and not ctx["options"]
+
+
+def _options_pending(session, response_class):
+    """409 for an option picked while the turn's options are still generated in the background."""
+    return response_class({
+        "error":"options pending",
+        "detail":f"poll /api/session/{session.id}/options/ until they are ready",
+        "options_status":"pending",
+    }, status=409, headers={"Retry-After": "1"})
+
+
+def _regenerate_options(body, ctx):
+    # explicit refresh, or a turn stored before options were kept
+    return "custom" not in body and (body.get("refresh") or ctx["options"] is None)
+
+
+def _store_options(body, ctx, options):
+    """
+    Keep regenerated options on the latest turn and the session head, so an
+    option_index always means what the client was shown. A refresh returns
+    them (the response body) instead of picking one; otherwise None.
+    """
+    session = ctx["session"]
+    with utils.timed("db"):
+        jobs.replace_options(session, options)
+    ctx["options"] = options
+    if not body.get("refresh"):
+        return None
+    speculator.start(session, options)
+    return {"session_id": str(session.id), "turn": session.turn_count, "options_status": "ready", "options": options}
+
+
+def _plan_followup(body, ctx):
+    """Add the follow-up text, its prompt and any speculative answer; returns (ctx, error)."""
+    if "custom" in body:
+        follow_text = body.get("custom")
+    else:
+        try:
+            follow_text = ctx["options"][int(body["option_index"])-1]
+        except Exception:
+            return None, {"error":"invalid option index"}
+    session = ctx["session"]
+    prompt = utils.assemble_followup_prompt(follow_text, ctx["previous_json"], session.prompt_context())
+    ctx["question"], ctx["prompt"] = follow_text, prompt
+    # a speculative answer for this option (see agent/speculation.py) stands in for the call
+    ctx["speculative"] = speculator.claim(session.id, session.turn_count, follow_text, prompt)
+    return ctx, None
+
+
+def _answer_failed(e, response_class, failed, timed_out):
+    """The response for an answer call that raised `e`, or timed out when `e` is None."""
+    if e is None:
+        return response_class({"error":timed_out}, status=504)
+    if isinstance(e, (utils.CircuitOpen, utils.Overloaded)):
+        return _upstream_refused(e, response_class)
+    return response_class({"error":failed,"detail":str(e)}, status=500)
+
+
+def _profile_keys(ctx):
+    """
+    Keys of a cached answer that the stored profile replaces: they date
+    from when the answer was generated.
+    """
+    return utils.PROFILE_FIELDS if ctx.get("profile") and ctx.get("cached_raw") is not None else ()
+
+
+def _digest_answer(ctx, raw, parser=None):
+    """
+    Parse a model answer and merge the stored company profile into it.
+    "options" are the answer's own, [] while they are generated in the
+    background, or None when the request still has to generate them;
+    "generated" is the answer without the profile, as cached.
+    """
+    answer, answer_json = utils.parse_answer(raw, parser)
+    answer, answer_json, options = utils.split_options(answer, answer_json)
+    generated = answer
+    background = ctx["background"] and options is None
+    if ctx.get("profile") and isinstance(answer, dict):
+        stale = _profile_keys(ctx)
+        answer = utils.merge_company_profile(ctx["profile"], {k: v for k, v in answer.items() if k not in stale})
+        answer_json = json.dumps(answer, ensure_ascii=False)
+    if background:
+        options = []
+    return {"answer": answer, "answer_json": answer_json, "options": options, "background": background,
+            "generated": generated}
+
+
+def _cache_answer(ctx, digest):
+    """
+    Store a freshly generated answer (and its own options) in the answer
+    cache, without the profile: the profile current when it is served is merged then.
+    """
+    answer, options = digest["generated"], digest["options"]
+    if ctx["cached_raw"] is None and isinstance(answer, dict):
+        cached = {**answer, utils.OPTIONS_KEY: options} if options else answer
+        answercache.store(
+            ctx["topic"], ctx["company"], ctx["question"], ctx["clarifiers"], json.dumps(cached, ensure_ascii=False)
+        )
+
+
+def _new_session(ctx):
+    with utils.timed("db"):
+        return Session.objects.create(company=ctx["company"] or "", last_topic=ctx["topic"])
+
+
+def _store_turn(ctx, session, raw, digest, options, speculate=True):
+    """Append the turn (queueing its options job if deferred) and build the response body."""
+    entry = {
+        "question": ctx["question"],
+        "clarifiers": ctx.get("clarifiers", ""),
+        "topic": ctx["topic"],
+        "company": ctx["company"],
+        "answer_json": digest["answer_json"],
+        "answer_raw": raw,
+        "options": options,
+        "ts": str(session.created_at)
+    }
+    with utils.timed("db"):
+        session.append_history(entry, defer_options=digest["background"])
+    if speculate:
+        speculator.start(session, options)
+
+    body = {"session_id": str(session.id)}
+    if "clarifiers" in ctx:   # a new question also reports what it was about
+        body.update(topic=ctx["topic"], company=ctx["company"])
+    body.update(
+        answer=digest["answer"],
+        options=options,
+        options_status="pending" if digest["background"] else "ready",
+    )
+    return body
+
+
 class QueryView(APIView):
     """
     POST /api/query/
     { "question": "...", "clarifiers": "" }
     """
+    speculate = True   # answer the top options ahead of the click (AGENT_SPECULATION)
+    answer_errors = ("AI API failed", "AI API timed out")
+
     def post(self, request):
-        body = request.data
-        question = body.get("question") or ""
-        clarifiers = body.get("clarifiers","")
-        if not question:
-            return Response({"error":"question required"}, status=status.HTTP_400_BAD_REQUEST)
+        ctx, error = self.prepare(request.data)
+        if error:
+            return error
+
+        raw = ctx["cached_raw"]
+        if raw is None:
+            answer_future = utils.submit_stage(utils.call_gemini_rest, ctx["prompt"], timeout=utils.stage_timeout("answer"))
+            try:
+                raw = utils.stage_result(answer_future, "answer")
+            except Exception as e:
+                return _answer_failed(e, Response, *self.answer_errors)
+            if raw is None:
+                return _answer_failed(None, Response, *self.answer_errors)
+
+        return Response(self.finish(ctx, raw), status=201)
+
+    def prepare(self, body):
+        """Search, detect the topic and build the prompt. Returns (ctx, error_response)."""
+        question, clarifiers, error = _question_input(body)
+        if error:
+            return None, Response(error, status=status.HTTP_400_BAD_REQUEST)
 
         # tavily search snippets
-        tavily_text = utils.tavily_search_text(question)
+        search_future = utils.submit_stage(utils.tavily_search_text, question)
+        tavily_text = utils.stage_result(search_future, "search", default="")
+        ctx = _answer_context(question, clarifiers, tavily_text)
 
-        topic, detected_company = utils.detect_topic(question, tavily_text)
-        if topic == "company" and not detected_company:
-            detected_company = utils.detect_company_from_text(tavily_text)
+        # the options context only needs the topic, so fetch it while Gemini answers
+        if _prefetch_options_context():
+            ctx["context_future"] = utils.submit_stage(utils.tavily_search_text, ctx["company"] or ctx["topic"])
+        return _plan_answer(ctx), None
 
-        prompt = utils.build_answer_prompt(topic, question, clarifiers, tavily_text, company=detected_company)
-        try:
-            raw = utils.call_gemini_rest(prompt)
-        except Exception as e:
-            return Response({"error":"AI API failed","detail":str(e)}, status=500)
-
-        answer_json = utils.extract_json(raw)
-        # store session
-        s = Session.objects.create(company=detected_company or "", last_topic=topic, history=[])
-        entry = {
-            "question": question,
-            "clarifiers": clarifiers,
-            "topic": topic,
-            "company": detected_company,
-            "answer_json": answer_json,
-            "answer_raw": raw,
-            "ts": str(s.created_at)
-        }
-        s.append_history(entry)
-
-        # generate dynamic options (AI)
-        tavily_context = utils.tavily_search_text(detected_company or topic)
-        options = utils.dynamic_options_ai(topic, detected_company, answer_json, tavily_context)
-
-        resp = {
-            "session_id": str(s.id),
-            "topic": topic,
-            "company": detected_company,
-            "answer": json.loads(answer_json) if answer_json and answer_json.startswith("{") else answer_json,
-            "options": options
-        }
-        return Response(resp, status=201)
+    def finish(self, ctx, raw, parser=None):
+        """Generate (or queue) options, store the session and build the response body."""
+        digest = _digest_answer(ctx, raw, parser)
+        _cache_answer(ctx, digest)
+
+        # generate dynamic options (AI) while the session row is created
+        options = digest["options"]
+        if options is None:
+            context_future = ctx["context_future"] or utils.submit_stage(utils.tavily_search_text, ctx["company"] or ctx["topic"])
+            tavily_context = utils.stage_result(context_future, "search", default="")
+            options_future = utils.submit_stage(
+                utils.dynamic_options_ai, ctx["topic"], ctx["company"], digest["answer_json"], tavily_context
+            )
+        session = _new_session(ctx)
+        if options is None:
+            options = utils.stage_result(options_future, "options", default=list(utils.DEFAULT_OPTIONS))
+        return _store_turn(ctx, session, raw, digest, options, speculate=self.speculate)
 
 @method_decorator(csrf_exempt, name='dispatch')
 class FollowupView(APIView):
     """
     POST /api/followup/
     { "session_id": "...", "option_index": 1 } OR { "session_id":"...", "custom":"..." }
+
+    option_index refers to the options stored with the latest turn (the ones
+    the client was shown). { "session_id": "...", "refresh": true } instead
+    regenerates and stores them, and returns them without answering:
+    {"session_id", "turn", "options_status": "ready", "options": [...]}.
+    While they are still generated in the background, option_index gets
+    409 "options pending" (poll /api/session/<id>/options/).
     """
+    answer_errors = ("AI error", "AI timed out")
+
     def post(self, request):
-        body = request.data
-        sid = body.get("session_id")
-        if not sid:
-            return Response({"error":"session_id required"}, status=400)
-        session = get_object_or_404(Session, id=sid)
-
-        # get last answer from session history
-        last = session.history[-1] if session.history else {}
-        previous_json = last.get("answer_json","")
-        topic = session.last_topic or last.get("topic","general")
-        company = session.company or last.get("company", "")
-
-        if "custom" in body:
-            follow_text = body.get("custom")
-        else:
-            opt_index = body.get("option_index")
-            if opt_index is None:
-                return Response({"error":"option_index or custom required"}, status=400)
-            # regenerate options just in case
-            tavily_context = utils.tavily_search_text(company or topic)
-            options = utils.dynamic_options_ai(topic, company, previous_json, tavily_context)
-            try:
-                follow_text = options[int(opt_index)-1]
-            except Exception:
-                return Response({"error":"invalid option index"}, status=400)
+        ctx, error = self.prepare(request.data)
+        if error:
+            return error
 
-        # build followup prompt and call AI
-        prompt = utils.build_followup_prompt(follow_text, previous_json, {"company": company, "topic": topic})
+        answer_future = ctx["speculative"] or utils.submit_stage(
+            utils.call_gemini_rest, ctx["prompt"], timeout=utils.stage_timeout("answer")
+        )
         try:
-            raw = utils.call_gemini_rest(prompt)
+            raw = utils.stage_result(answer_future, "answer")
         except Exception as e:
-            return Response({"error":"AI error","detail":str(e)}, status=500)
-
-        answer_json = utils.extract_json(raw)
-        entry = {
-            "question": follow_text,
-            "topic": topic,
-            "company": company,
-            "answer_json": answer_json,
-            "answer_raw": raw,
-            "ts": str(session.created_at)
-        }
-        session.append_history(entry)
-
-        # new dynamic options
-        tavily_context = utils.tavily_search_text(company or topic)
-        options = utils.dynamic_options_ai(topic, company, answer_json, tavily_context)
-
-        resp = {
-            "session_id": str(session.id),
-            "answer": json.loads(answer_json) if answer_json and answer_json.startswith("{") else answer_json,
-            "options": options
-        }
-        return Response(resp, status=200)
+            return _answer_failed(e, Response, *self.answer_errors)
+        if raw is None:
+            return _answer_failed(None, Response, *self.answer_errors)
+
+        return Response(self.finish(ctx, raw), status=200)
+
+    def prepare(self, body):
+        """
+        Resolve the follow-up text and build the prompt. Returns (ctx, response),
+        the response ending the request early: an error, or refreshed options.
+        """
+        error = _followup_input(body)
+        if error:
+            return None, Response(error, status=400)
+        ctx = _followup_context(get_object_or_404(Session, id=body["session_id"]))
+
+        if _needs_options(body, ctx):
+            # a deferred job may still be writing them: never regenerate over it
+            options_status, options = jobs.latest_options(ctx["session"])
+            if options_status == "pending":
+                return None, _options_pending(ctx["session"], Response)
+            ctx["options"] = options if options_status != "missing" else None
+        if _regenerate_options(body, ctx):
+            tavily_context = utils.tavily_search_text(ctx["company"] or ctx["topic"])
+            options = utils.dynamic_options_ai(ctx["topic"], ctx["company"], ctx["previous_json"], tavily_context)
+            refreshed = _store_options(body, ctx, options)
+            if refreshed:
+                return None, Response(refreshed, status=200)
+
+        # the options context is fetched while the AI answers
+        if _prefetch_options_context():
+            ctx["context_future"] = utils.submit_stage(utils.tavily_search_text, ctx["company"] or ctx["topic"])
+        ctx, error = _plan_followup(body, ctx)
+        if error:
+            return None, Response(error, status=400)
+        return ctx, None
+
+    def finish(self, ctx, raw, parser=None):
+        """Generate (or queue) options, store the turn and build the response body."""
+        digest = _digest_answer(ctx, raw, parser)
+
+        # new dynamic options, stored with the turn
+        options = digest["options"]
+        if options is None:
+            context_future = ctx["context_future"] or utils.submit_stage(utils.tavily_search_text, ctx["company"] or ctx["topic"])
+            tavily_context = utils.stage_result(context_future, "search", default="")
+            options = utils.stage_result(
+                utils.submit_stage(utils.dynamic_options_ai, ctx["topic"], ctx["company"], digest["answer_json"], tavily_context),
+                "options", default=list(utils.DEFAULT_OPTIONS)
+            )
+        return _store_turn(ctx, ctx["session"], raw, digest, options)
+
+
+def _event_stream(events):
+    response = StreamingHttpResponse(events, content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"  # don't let nginx buffer the stream
+    return response
+
+
+def _profile_events(ctx):
+    # stored company profile fields are known before the model says anything
+    for key, value in (ctx.get("profile") or {}).items():
+        yield _sse("field", {"key": key, "value": value})
+
+
+def _chunk_events(chunk, parser, skip=()):
+    yield _sse("answer", {"delta": chunk})
+    for key, value in parser.feed(chunk):
+        if key != utils.OPTIONS_KEY and key not in skip:   # options are sent with the options event
+            yield _sse("field", {"key": key, "value": value})
+
+
+def _result_events(result):
+    yield _sse("options", {"options": result.pop("options"), "options_status": result.pop("options_status")})
+    yield _sse("done", result)
+
+
+def _finish_failed(e):
+    log.exception("could not finish a streamed answer")
+    return _sse("error", {"error": "could not store the answer", "detail": str(e)})
+
+
+class StreamingMixin:
+    """
+    Same request body as the parent view, answered as Server-Sent Events:
+
+      event: answer   {"delta": "..."}            (repeated, answer text as generated)
+      event: field    {"key": "summary", "value": ...}  (each top-level answer key, once complete)
+      event: options  {"options": [...], "options_status": "ready" | "pending"}
+      event: done     {"session_id": "...", "answer": {...}, ...}
+      event: error    {"error": "...", "detail": "..."}
+
+    Under ASGI use the /api/async/.../stream/ views: Django buffers a sync
+    iterator there and would send the whole stream at once.
+    """
+    def post(self, request):
+        ctx, error = self.prepare(request.data)
+        if error:
+            return error
+        return _event_stream(self.events(ctx))
+
+    def answer_chunks(self, ctx):
+        if ctx.get("cached_raw") is not None:
+            return [ctx["cached_raw"]]
+        if ctx.get("speculative") is None:
+            return utils.stream_gemini_rest(ctx["prompt"], timeout=utils.stage_timeout("answer"))
+        # already answered speculatively: send it as one delta
+        raw = utils.stage_result(ctx["speculative"], "answer")
+        if raw is None:
+            raise TimeoutError("AI timed out")
+        return [raw]
+
+    def events(self, ctx):
+        chunks = []
+        parser = IncrementalJSONParser()
+        skip = _profile_keys(ctx)
+        yield from _profile_events(ctx)
+        try:
+            for chunk in self.answer_chunks(ctx):
+                chunks.append(chunk)
+                yield from _chunk_events(chunk, parser, skip)
+        except Exception as e:
+            yield _sse("error", {"error": "AI error", "detail": str(e)})
+            return
+
+        try:
+            result = self.finish(ctx, utils.clean_model_text("".join(chunks)), parser)
+        except Exception as e:
+            yield _finish_failed(e)
+            return
+        yield from _result_events(result)
+
+
+class QueryStreamView(StreamingMixin, QueryView):
+    """POST /api/query/stream/ — QueryView as an SSE stream."""
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class FollowupStreamView(StreamingMixin, FollowupView):
+    """POST /api/followup/stream/ — FollowupView as an SSE stream."""
+
+
+class QueryBatchView(QueryView):
+    """
+    POST /api/query/batch/
+    { "items": [{"question": "...", "clarifiers": ""}, "plain question", ...],
+      "parallelism": 4 }
+
+    Answers each item like /api/query/ (one Session per item) and streams
+    NDJSON lines in completion order:
+      {"index": 0, "status": 201, "session_id": "...", "answer": {...}, ...}
+      {"index": 1, "status": 429, "error": "..."}
+    Identical Tavily searches across the batch are made once (search cache
+    + single-flight); at most `parallelism` items are in flight at a time.
+    Nobody clicks options of batch answers, so they are not speculated on.
+    """
+    speculate = False
+
+    def post(self, request):
+        items = request.data.get("items") if isinstance(request.data, dict) else None
+        if not isinstance(items, list) or not items:
+            return Response({"error":"items required"}, status=400)
+        max_items = getattr(settings, "AGENT_BATCH_MAX_ITEMS", 100)
+        if len(items) > max_items:
+            return Response({"error":f"at most {max_items} items per batch"}, status=400)
+
+        limit = getattr(settings, "AGENT_BATCH_PARALLELISM", 4)
+        try:
+            parallelism = max(1, min(int(request.data.get("parallelism", limit)), limit))
+        except (TypeError, ValueError):
+            return Response({"error":"parallelism must be an integer"}, status=400)
+
+        items = [{"question": item} if isinstance(item, str) else item for item in items]
+        response = StreamingHttpResponse(self.results(items, parallelism), content_type="application/x-ndjson")
+        response["X-Accel-Buffering"] = "no"
+        return response
+
+    def results(self, items, parallelism):
+        pool = ThreadPoolExecutor(max_workers=parallelism, thread_name_prefix="agent-batch")
+        try:
+            futures = {pool.submit(self.answer_item, item): i for i, item in enumerate(items)}
+            for future in as_completed(futures):
+                try:
+                    result = future.result()
+                except Exception as e:   # one item never ends the stream
+                    result = {"status": 500, "error": "Item failed", "detail": str(e)}
+                yield json.dumps({"index": futures[future], **result}) + "\n"
+        finally:
+            # the client went away: drop items that have not started
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    def answer_item(self, item):
+        try:
+            if not isinstance(item, dict):
+                return {"status": 400, "error": "item must be an object or a string"}
+            try:
+                ctx, error = self.prepare(item)
+            except Exception as e:
+                return {"status": 500, "error": "Could not prepare the question", "detail": str(e)}
+            if error:
+                return {"status": error.status_code, **error.data}
+            try:
+                raw = ctx["cached_raw"] or utils.call_gemini_rest(ctx["prompt"], timeout=utils.stage_timeout("answer"))
+            except (utils.CircuitOpen, utils.Overloaded) as e:
+                return {"status": _upstream_refused(e, Response).status_code, "error": str(e),
+                        "retry_after": math.ceil(e.retry_after)}
+            except Exception as e:
+                return {"status": 500, "error": "AI API failed", "detail": str(e)}
+            try:
+                return {"status": 201, **self.finish(ctx, raw)}
+            except Exception as e:
+                return {"status": 500, "error": "Could not save the answer", "detail": str(e)}
+        finally:
+            connections.close_all()  # this thread's DB connections end with it
+
+
+SESSION_PAGE_MAX = 100
+
+
+ETAG_VERSION = 3   # bumped when options_version replaced head_options
+
+
+def _session_etag(session, query):
+    # a new turn moves turn_count and every options write, for any turn,
+    # bumps options_version: together they version the response
+    return quote_etag(hashlib.md5(
+        f"v{ETAG_VERSION}:{session.id}:{session.turn_count}:{session.options_version}:{query.urlencode()}".encode()
+    ).hexdigest())
+
+
+def _turn_page_query(session, query):
+    """
+    Parse after/limit/fields. Returns (turns_queryset, keys, after, limit, error)
+    where the queryset already has the limit+1 look-ahead applied.
+    """
+    try:
+        after = int(query.get("after", 0))
+        limit = query.get("limit")
+        limit = max(1, min(int(limit), SESSION_PAGE_MAX)) if limit else None
+    except ValueError:
+        return None, None, None, None, {"error":"after and limit must be integers"}
+
+    keys = None
+    turns = session.turns.filter(ordinal__gt=after).order_by("ordinal")
+    if query.get("fields"):
+        keys = [k.strip() for k in query["fields"].split(",") if k.strip()]
+        unknown = [k for k in keys if k not in Turn.ENTRY_FIELDS]
+        if unknown:
+            return None, None, None, None, {"error":"unknown fields","detail":unknown}
+        # never load columns (e.g. answer_raw) the client did not ask for
+        columns = {Turn.ENTRY_FIELDS[k] for k in keys}
+        if "answer_raw" in columns:
+            columns.add("answer_json")  # raw is deduplicated against it
+        turns = turns.only(*columns)
+
+    if limit is not None:
+        turns = turns[:limit + 1]
+    return turns, keys, after, limit, None
+
+
+def _session_page_data(session, turns, keys, after, limit):
+    """Serialize one page; `turns` is the evaluated look-ahead list."""
+    next_after = None
+    if limit is not None and len(turns) > limit:
+        turns = turns[:limit]
+        next_after = turns[-1].ordinal if turns else after
+
+    data = SessionSerializer(session, context={"turns": turns, "turn_fields": keys}).data
+    if limit is not None:
+        data["next_after"] = next_after
+    return data
+
 
 class SessionDetailView(APIView):
+    """
+    GET /api/session/<id>/
+    Optional query params:
+      after=<turn>   only turns with a higher ordinal
+      limit=<n>      at most n turns (capped at SESSION_PAGE_MAX); adds "next_after"
+      fields=a,b     history-entry keys to return, e.g. fields=turn,question,answer_json
+    Responds 304 when If-None-Match matches the current ETag.
+    """
     def get(self, request, session_id):
         session = get_object_or_404(Session, id=session_id)
-        ser = SessionSerializer(session)
-        return Response(ser.data)
+
+        etag = _session_etag(session, request.GET)
+        if etag in parse_etags(request.headers.get("If-None-Match", "")):
+            return Response(status=304, headers={"ETag": etag})
+
+        turns, keys, after, limit, error = _turn_page_query(session, request.GET)
+        if error:
+            return Response(error, status=400)
+
+        data = _session_page_data(session, list(turns), keys, after, limit)
+        return Response(data, headers={"ETag": etag})
+
+
+OPTIONS_POLL_INTERVAL = 0.25
+
+
+def _options_query(session, query, max_wait):
+    """(turn ordinal, seconds to wait, error) of an options poll."""
+    try:
+        ordinal = int(query.get("turn") or session.turn_count)
+        wait = float(query.get("wait", 0))
+    except ValueError:
+        return None, None, {"error":"turn and wait must be numbers"}
+    return ordinal, max(0.0, min(wait, max_wait)), None
+
+
+def _poll_options(turn):
+    """options_state() of `turn`, generating its options here if no worker picked the job up."""
+    options_status, options = jobs.options_state(turn)
+    if options_status == "pending":
+        jobs.run_if_stalled(turn)
+    return options_status, options
+
+
+def _options_body(session, ordinal, options_status, options):
+    if options_status == "ready" and ordinal == session.turn_count:
+        speculator.start(session, options)
+    return {"session_id": str(session.id), "turn": ordinal, "options_status": options_status, "options": options}
+
+
+class SessionOptionsView(APIView):
+    """
+    GET /api/session/<id>/options/
+    Follow-up options of a turn, which may still be generated in the background.
+    Optional query params:
+      turn=<n>   the turn to ask about (default: the latest)
+      wait=<s>   long-poll: hold the request up to s seconds until the options
+                 are ready. A waiting request holds a worker thread, so this
+                 view caps it at AGENT_OPTIONS_SYNC_POLL_MAX; the async view
+                 (/api/async/session/<id>/options/) at AGENT_OPTIONS_POLL_MAX.
+    Returns {"session_id", "turn", "options_status": "pending"|"ready"|"failed", "options"}.
+    """
+    def get(self, request, session_id):
+        session = get_object_or_404(Session, id=session_id)
+        ordinal, wait, error = _options_query(
+            session, request.GET, getattr(settings, "AGENT_OPTIONS_SYNC_POLL_MAX", 5)
+        )
+        if error:
+            return Response(error, status=400)
+        turn = get_object_or_404(Turn.objects.only("id", "session_id", "ordinal"), session=session, ordinal=ordinal)
+
+        deadline = time.monotonic() + wait
+        options_status, options = _poll_options(turn)
+        while options_status == "pending" and time.monotonic() < deadline:
+            time.sleep(OPTIONS_POLL_INTERVAL)
+            options_status, options = _poll_options(turn)
+        return Response(_options_body(session, ordinal, options_status, options), headers={"Cache-Control": "no-store"})
+
+
+# ---------------------------------------------------------
+# ASYNC VIEWS (served by aiagent/asgi.py)
+# ---------------------------------------------------------
+def _cancel(task):
+    if task is not None:
+        task.cancel()
+
+
+def _acontext(ctx):
+    """Search context for the options of `ctx`'s answer, as a coroutine."""
+    return utils.astage(utils.atavily_search_text(ctx["company"] or ctx["topic"]), "search", default="")
+
+
+def _aoptions(ctx, digest):
+    """
+    Task generating the answer's options, or None when they need no
+    generating here (the answer brought its own, or they are deferred).
+    """
+    if digest["options"] is not None:
+        _cancel(ctx["context_future"])
+        return None
+
+    async def generate():
+        tavily_context = await (ctx["context_future"] or _acontext(ctx))
+        return await utils.astage(
+            utils.adynamic_options_ai(ctx["topic"], ctx["company"], digest["answer_json"], tavily_context),
+            "options", default=list(utils.DEFAULT_OPTIONS)
+        )
+    return asyncio.ensure_future(generate())
+
+
+def _json_body(request):
+    try:
+        body = json.loads(request.body or b"{}")
+    except ValueError:
+        return None
+    return body if isinstance(body, dict) else None
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncQueryView(View):
+    """
+    POST /api/async/query/ — QueryView on the event loop.
+    Upstream calls use httpx.AsyncClient, so a pending LLM call holds no thread.
+    """
+    async def post(self, request):
+        ctx, error = await self.prepare(request)
+        if error:
+            return error
+
+        raw = ctx["cached_raw"]
+        if raw is None:
+            try:
+                raw = await utils.astage(
+                    utils.acall_gemini_rest(ctx["prompt"], timeout=utils.stage_timeout("answer")), "answer"
+                )
+            except Exception as e:
+                _cancel(ctx["context_future"])
+                return _answer_failed(e, JsonResponse, *QueryView.answer_errors)
+            if raw is None:
+                _cancel(ctx["context_future"])
+                return _answer_failed(None, JsonResponse, *QueryView.answer_errors)
+
+        return JsonResponse(await self.finish(ctx, raw), status=201)
+
+    async def prepare(self, request):
+        """QueryView.prepare: (ctx, error_response)."""
+        body = _json_body(request)
+        if body is None:
+            return None, JsonResponse({"error":"JSON body required"}, status=400)
+        question, clarifiers, error = _question_input(body)
+        if error:
+            return None, JsonResponse(error, status=400)
+
+        tavily_text = await utils.astage(utils.atavily_search_text(question), "search", default="")
+        ctx = _answer_context(question, clarifiers, tavily_text)
+        if _prefetch_options_context():
+            ctx["context_future"] = asyncio.ensure_future(_acontext(ctx))
+        return await sync_to_async(_plan_answer)(ctx), None
+
+    async def finish(self, ctx, raw, parser=None):
+        """QueryView.finish: options and the session row in parallel."""
+        digest = _digest_answer(ctx, raw, parser)
+        await sync_to_async(_cache_answer)(ctx, digest)
+
+        options_task = _aoptions(ctx, digest)
+        session = await sync_to_async(_new_session)(ctx)
+        options = digest["options"] if options_task is None else await options_task
+        return await sync_to_async(_store_turn)(ctx, session, raw, digest, options)
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncFollowupView(View):
+    """POST /api/async/followup/ — FollowupView on the event loop."""
+    async def post(self, request):
+        ctx, error = await self.prepare(request)
+        if error:
+            return error
+
+        try:
+            raw = await utils.astage(
+                asyncio.wrap_future(ctx["speculative"]) if ctx["speculative"]
+                else utils.acall_gemini_rest(ctx["prompt"], timeout=utils.stage_timeout("answer")),
+                "answer",
+            )
+        except Exception as e:
+            _cancel(ctx["context_future"])
+            return _answer_failed(e, JsonResponse, *FollowupView.answer_errors)
+        if raw is None:
+            _cancel(ctx["context_future"])
+            return _answer_failed(None, JsonResponse, *FollowupView.answer_errors)
+
+        return JsonResponse(await self.finish(ctx, raw))
+
+    async def prepare(self, request):
+        """FollowupView.prepare: (ctx, response), the response ending the request early."""
+        body = _json_body(request)
+        if body is None:
+            return None, JsonResponse({"error":"JSON body required"}, status=400)
+        error = _followup_input(body)
+        if error:
+            return None, JsonResponse(error, status=400)
+        try:
+            session = await Session.objects.aget(id=body["session_id"])
+        except (Session.DoesNotExist, ValidationError):
+            raise Http404
+        ctx = _followup_context(session)
+
+        if _needs_options(body, ctx):
+            options_status, options = await sync_to_async(jobs.latest_options)(session)
+            if options_status == "pending":
+                return None, _options_pending(session, JsonResponse)
+            ctx["options"] = options if options_status != "missing" else None
+        if _regenerate_options(body, ctx):
+            tavily_context = await utils.atavily_search_text(ctx["company"] or ctx["topic"])
+            options = await utils.adynamic_options_ai(ctx["topic"], ctx["company"], ctx["previous_json"], tavily_context)
+            refreshed = await sync_to_async(_store_options)(body, ctx, options)
+            if refreshed:
+                return None, JsonResponse(refreshed)
+
+        ctx, error = _plan_followup(body, ctx)
+        if error:
+            return None, JsonResponse(error, status=400)
+        if _prefetch_options_context():
+            ctx["context_future"] = asyncio.ensure_future(_acontext(ctx))
+        return ctx, None
+
+    async def finish(self, ctx, raw, parser=None):
+        """FollowupView.finish."""
+        digest = _digest_answer(ctx, raw, parser)
+        options_task = _aoptions(ctx, digest)
+        options = digest["options"] if options_task is None else await options_task
+        return await sync_to_async(_store_turn)(ctx, ctx["session"], raw, digest, options)
+
+
+class AsyncStreamingMixin:
+    """StreamingMixin for the async views: an async generator, streamed frame by frame under ASGI."""
+    async def post(self, request):
+        ctx, error = await self.prepare(request)
+        if error:
+            return error
+        return _event_stream(self.events(ctx))
+
+    async def answer_chunks(self, ctx):
+        if ctx.get("cached_raw") is not None:
+            yield ctx["cached_raw"]
+        elif ctx.get("speculative") is None:
+            async for chunk in utils.astream_gemini_rest(ctx["prompt"], timeout=utils.stage_timeout("answer")):
+                yield chunk
+        else:
+            raw = await utils.astage(asyncio.wrap_future(ctx["speculative"]), "answer")
+            if raw is None:
+                raise TimeoutError("AI timed out")
+            yield raw
+
+    async def events(self, ctx):
+        chunks = []
+        parser = IncrementalJSONParser()
+        skip = _profile_keys(ctx)
+        for frame in _profile_events(ctx):
+            yield frame
+        try:
+            async for chunk in self.answer_chunks(ctx):
+                chunks.append(chunk)
+                for frame in _chunk_events(chunk, parser, skip):
+                    yield frame
+        except Exception as e:
+            _cancel(ctx["context_future"])
+            yield _sse("error", {"error": "AI error", "detail": str(e)})
+            return
+
+        try:
+            result = await self.finish(ctx, utils.clean_model_text("".join(chunks)), parser)
+        except Exception as e:
+            yield _finish_failed(e)
+            return
+        for frame in _result_events(result):
+            yield frame
+
+
+class AsyncQueryStreamView(AsyncStreamingMixin, AsyncQueryView):
+    """POST /api/async/query/stream/ — QueryStreamView on the event loop."""
+
+
+class AsyncFollowupStreamView(AsyncStreamingMixin, AsyncFollowupView):
+    """POST /api/async/followup/stream/ — FollowupStreamView on the event loop."""
+
+
+class AsyncSessionDetailView(View):
+    """GET /api/async/session/<id>/ — SessionDetailView with the async ORM."""
+    async def get(self, request, session_id):
+        try:
+            session = await Session.objects.aget(id=session_id)
+        except Session.DoesNotExist:
+            raise Http404
+
+        etag = _session_etag(session, request.GET)
+        if etag in parse_etags(request.headers.get("If-None-Match", "")):
+            response = HttpResponseNotModified()
+            response["ETag"] = etag
+            return response
+
+        turns, keys, after, limit, error = _turn_page_query(session, request.GET)
+        if error:
+            return JsonResponse(error, status=400)
+
+        turns = [t async for t in turns]
+        response = JsonResponse(_session_page_data(session, turns, keys, after, limit))
+        response["ETag"] = etag
+        return response
+
+
+class AsyncSessionOptionsView(View):
+    """GET /api/async/session/<id>/options/ — SessionOptionsView, waiting on the event loop."""
+    async def get(self, request, session_id):
+        try:
+            session = await Session.objects.aget(id=session_id)
+        except Session.DoesNotExist:
+            raise Http404
+        ordinal, wait, error = _options_query(session, request.GET, getattr(settings, "AGENT_OPTIONS_POLL_MAX", 25))
+        if error:
+            return JsonResponse(error, status=400)
+        try:
+            turn = await Turn.objects.only("id", "session_id", "ordinal").aget(session=session, ordinal=ordinal)
+        except Turn.DoesNotExist:
+            raise Http404
+
+        deadline = time.monotonic() + wait
+        options_status, options = await sync_to_async(_poll_options)(turn)
+        while options_status == "pending" and time.monotonic() < deadline:
+            await asyncio.sleep(OPTIONS_POLL_INTERVAL)
+            options_status, options = await sync_to_async(_poll_options)(turn)
+        body = await sync_to_async(_options_body)(session, ordinal, options_status, options)
+        return JsonResponse(body, headers={"Cache-Control": "no-store"})
+
+
+class MetricsView(View):
+    """GET /api/metrics — this process's metrics in Prometheus text format."""
+    def get(self, request):
+        return HttpResponse(metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
@@ -10,6 +10,9 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
+import sys
+import tempfile
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -49,6 +52,8 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    # Server-Timing header, per-request log line and latency metrics for /api/
+    'agent.middleware.StageTimingMiddleware',
 ]
 
 ROOT_URLCONF = 'aiagent.urls'
@@ -78,7 +83,10 @@ WSGI_APPLICATION = 'aiagent.wsgi.application'
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        # DJANGO_DB_PATH lets benchmarks run against a throwaway database
+        'NAME': os.getenv('DJANGO_DB_PATH', BASE_DIR / 'db.sqlite3'),
+        # a file, not shared-cache memory, so tests see SQLite's real locking
+        'TEST': {'NAME': os.path.join(tempfile.gettempdir(), 'aiagent-test.sqlite3')},
     }
 }
 
@@ -123,3 +131,172 @@ STATIC_URL = 'static/'
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+
+# ---------------------------------------------------------
+# AGENT PIPELINE
+# ---------------------------------------------------------
+# Upper bound (seconds) for each upstream stage of a request.
+AGENT_STAGE_TIMEOUTS = {
+    "search": 10,   # Tavily snippets
+    "answer": 35,   # main Gemini answer
+    "options": 25,  # follow-up option generation
+}
+
+# Threads shared by all requests for running upstream stages concurrently.
+AGENT_STAGE_WORKERS = 16
+
+# Keep-alive connection pool shared by the Gemini and Tavily clients.
+AGENT_HTTP_POOL_SIZE = 32       # max pooled connections per upstream host
+AGENT_HTTP_KEEPALIVE = 60       # idle seconds before a pooled connection is dropped (HTTP/2 only)
+AGENT_HTTP2 = False             # needs `httpx[http2]`; falls back to HTTP/1.1 if missing
+
+# Result caches: an in-process LRU tier plus an optional shared tier on a
+# Django cache alias so all workers share hits. For a SQLite-backed tier add
+#   CACHES = {"default": {...}, "shared": {
+#       "BACKEND": "django.core.cache.backends.db.DatabaseCache",
+#       "LOCATION": "agent_cache"}}
+# run `manage.py createcachetable` and set "shared_alias": "shared".
+AGENT_CACHES = {
+    "search": {"max_entries": 512, "ttl": 900, "shared_alias": None},
+}
+
+# Optional company gazetteer ("Canonical | alias | alias" per line, most
+# important first). When unset, agent.utils.KNOWN_COMPANIES is used.
+AGENT_COMPANY_GAZETTEER = None
+
+# Topic keyword weights: None for the built-in table, a dict
+# {topic: {keyword: weight}}, or a path to a JSON file with the same shape.
+AGENT_TOPIC_KEYWORDS = None
+AGENT_TOPIC_QUESTION_WEIGHT = 3.0   # question tokens vs. snippet tokens
+
+# Stored answers are compressed ("zstd", "zlib" or None to store plain bytes);
+# values shorter than AGENT_COMPRESS_MIN_BYTES are kept uncompressed.
+# `manage.py recompress_history` rewrites existing rows.
+AGENT_COMPRESSION = "zstd"
+AGENT_COMPRESS_MIN_BYTES = 256
+
+# Connection pool of the httpx.AsyncClient used by the /api/async/ views.
+AGENT_ASYNC_POOL_SIZE = 200
+
+# Prompt size caps in (locally counted) tokens. Web snippets and previous
+# answers are ranked and cut to fit; older turns are folded into a running
+# summary of at most AGENT_SUMMARY_BUDGET tokens.
+AGENT_PROMPT_BUDGETS = {
+    "answer": 3000,
+    "followup": 3500,
+    "options": 1500,
+}
+AGENT_SUMMARY_BUDGET = 300
+
+# `manage.py test` keeps the agent's logs out of the test output (assertLogs still sees them)
+TESTING = sys.argv[1:2] == ["test"]
+
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "handlers": {
+        "console": {"class": "logging.StreamHandler"},
+        "null": {"class": "logging.NullHandler"},
+    },
+    "loggers": {
+        # per-call prompt/response token counts, one JSON line per API request
+        "agent": {"handlers": ["null" if TESTING else "console"], "level": "INFO", "propagate": not TESTING},
+    },
+}
+
+# Coalescing of identical in-flight Tavily/Gemini calls. Threads of one
+# process always share; set "shared_alias" to a Django cache alias to also
+# coalesce across workers (lock + published result in that cache).
+AGENT_SINGLEFLIGHT = {
+    "shared_alias": None,
+    "lock_ttl": 60,       # seconds a leader may hold the cross-worker lock
+    "result_ttl": 30,     # how long followers can pick up the published result
+    "poll_interval": 0.05,
+}
+
+# Resilience for upstream calls (see agent/resilience.py). Retries back off
+# exponentially with full jitter on 429/5xx/timeouts; hedging sends a second
+# request once the first has run past the recent p95 (never below
+# hedge_min_ms); the breaker opens after breaker_failures consecutive
+# failures and fails fast for breaker_reset seconds.
+AGENT_RESILIENCE = {
+    "gemini": {
+        "retries": 2,
+        "backoff_base": 0.25,
+        "backoff_max": 4.0,
+        "hedge": False,
+        "hedge_quantile": 95,
+        "hedge_min_ms": 500,
+        "breaker_failures": 5,
+        "breaker_reset": 30,
+    },
+}
+
+# Client-side admission for upstream APIs (see agent/ratelimit.py): `rate`
+# requests/second with bursts up to `burst`, at most `concurrency` requests
+# in flight per process, and at most `max_queue` callers waiting up to
+# `max_wait` seconds. Callers that cannot be admitted get a 429 with
+# Retry-After. Set AGENT_RATE_LIMIT_DB to a file path to share the rate
+# budget between all worker processes on the host.
+AGENT_RATE_LIMITS = {
+    "gemini": {"rate": 10, "burst": 20, "concurrency": 16, "max_queue": 64, "max_wait": 5},
+    "tavily": {"rate": 5, "burst": 10, "concurrency": 8, "max_queue": 32, "max_wait": 3},
+}
+AGENT_RATE_LIMIT_DB = os.getenv("AGENT_RATE_LIMIT_DB")  # e.g. BASE_DIR / "ratelimit.sqlite3"
+
+# POST /api/query/batch/: items per request, and the most items answered at
+# once (a request may ask for less with "parallelism").
+AGENT_BATCH_MAX_ITEMS = 100
+AGENT_BATCH_PARALLELISM = 4
+
+# Follow-up options: "background" returns answers with options_status
+# "pending" and queues an OptionsJob, processed by
+# `manage.py run_options_worker` and fetched from /api/session/<id>/options/;
+# "inline" generates them before responding, as before; "combined" asks for
+# them inside the answer JSON (one Gemini call per turn) and makes the
+# separate options call only when they are missing or malformed.
+AGENT_OPTIONS_MODE = "background"
+AGENT_OPTIONS_POLL_MAX = 25        # longest ?wait= a client may long-poll the async options view for
+AGENT_OPTIONS_SYNC_POLL_MAX = 5    # the same for the sync view, whose wait holds a worker thread
+AGENT_OPTIONS_INLINE_AFTER = 5     # poll requests run jobs no worker claimed by then
+AGENT_OPTIONS_JOB_LEASE = 120      # running jobs older than this are reclaimed
+AGENT_OPTIONS_JOB_ATTEMPTS = 3
+
+# Persistent answer cache (agent/answercache.py, tables CachedAnswer and
+# CachedAnswerBand): /api/query/ answers a question about the same topic and
+# company from an earlier answer when the normalized question matches, or a
+# near-duplicate reaches `threshold` similarity and differs only by word
+# forms or misspellings (not by a number or an extra word). Answers expire
+# after `ttl` seconds per topic ("default" for the rest).
+AGENT_ANSWER_CACHE = {
+    "enabled": True,
+    "threshold": 0.75,
+    "ttl": {"default": 86400, "finance": 3600, "job": 21600, "company": 86400, "coding": 604800},
+}
+
+# Company profiles (agent/profiles.py): the slow-changing part of company
+# answers (CEO, headquarters, tech stack, competitors, ...) is generated
+# ahead of time by `manage.py warm_company_profiles [--loop]` and merged
+# into answers, so Gemini only writes the question-specific fields. The
+# command regenerates profiles older than `refresh_after` seconds; requests
+# ignore profiles older than `max_age` and fall back to the full schema.
+AGENT_COMPANY_PROFILES = {
+    "enabled": True,
+    "refresh_after": 86400,
+    "max_age": 7 * 86400,
+}
+
+# Speculative follow-ups (agent/speculation.py): once a turn's options are
+# known, answer the first `top_n` of them in the background and keep the
+# answers `ttl` seconds, so clicking one is served without a Gemini round
+# trip. Speculation is per process and capped at `max_in_flight` calls at
+# once and `max_per_hour` calls started; tune top_n with the hit and wasted
+# counts of agent_speculation_total on /api/metrics.
+AGENT_SPECULATION = {
+    "enabled": False,
+    "top_n": 2,
+    "ttl": 300,
+    "max_in_flight": 4,
+    "max_per_hour": 600,
+}
@@ -0,0 +1,100 @@
+"""
+Load-test /api/query/ under a threaded WSGI server against /api/async/query/
+under uvicorn, both talking to the local stub upstream.
+
+    pip install -r requirements.txt   # gunicorn and uvicorn
+    python benchmarks/bench_async_vs_sync.py --concurrency 50 200 --requests 400
+"""
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+PROJECT = os.path.dirname(HERE)
+sys.path.insert(0, HERE)
+
+from loadtest import free_port, percentile, wait_for_port  # noqa: E402
+from stub_upstream import start_stub  # noqa: E402
+
+
+async def drive(url, concurrency, total):
+    latencies, errors = [], 0
+    sem = asyncio.Semaphore(concurrency)
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(timeout=120, limits=limits) as client:
+        async def one(i):
+            nonlocal errors
+            async with sem:
+                start = time.perf_counter()
+                try:
+                    r = await client.post(url, json={"question": f"microsoft jobs {i}"})
+                    ok = r.status_code < 400
+                except httpx.HTTPError:
+                    ok = False
+                if ok:
+                    latencies.append(time.perf_counter() - start)
+                else:
+                    errors += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(total)))
+        elapsed = time.perf_counter() - start
+
+    return {
+        "throughput_rps": round(len(latencies) / elapsed, 2),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+        "errors": errors,
+    }
+
+
+def server_cmd(kind, port, threads):
+    if kind == "sync":
+        return [sys.executable, "-m", "gunicorn", "aiagent.wsgi:application",
+                "-b", f"127.0.0.1:{port}", "-w", "1", "-k", "gthread", "--threads", str(threads)]
+    return [sys.executable, "-m", "uvicorn", "aiagent.asgi:application",
+            "--host", "127.0.0.1", "--port", str(port), "--workers", "1", "--log-level", "warning"]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[50, 200])
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--threads", type=int, default=8, help="gunicorn gthread threads (sync)")
+    parser.add_argument("--gemini-ms", type=float, default=800)
+    parser.add_argument("--tavily-ms", type=float, default=300)
+    args = parser.parse_args()
+
+    stub, _ = start_stub(gemini_ms=args.gemini_ms, tavily_ms=args.tavily_ms)
+    stub_url = f"http://127.0.0.1:{stub.server_address[1]}"
+    db_path = os.path.join(tempfile.mkdtemp(), "bench.sqlite3")
+    env = dict(os.environ, DJANGO_DB_PATH=db_path, GEMINI_API_BASE=stub_url, TAVILY_API_BASE=stub_url,
+               GEMINI_API_KEY="stub", TAVILY_API_KEY="stub")
+    subprocess.run([sys.executable, "manage.py", "migrate", "-v", "0"], cwd=PROJECT, env=env, check=True)
+
+    print(f"{'server':<8} {'conc':>5} {'rps':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>7}")
+    for kind, path in (("sync", "/api/query/"), ("async", "/api/async/query/")):
+        port = free_port()
+        proc = subprocess.Popen(server_cmd(kind, port, args.threads), cwd=PROJECT, env=env,
+                                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            wait_for_port(port)
+            for conc in args.concurrency:
+                r = asyncio.run(drive(f"http://127.0.0.1:{port}{path}", conc, args.requests))
+                print(f"{kind:<8} {conc:>5} {r['throughput_rps']:>8} {r['p50_ms']:>8} "
+                      f"{r['p95_ms']:>8} {r['p99_ms']:>8} {r['errors']:>7}")
+        finally:
+            proc.terminate()
+            proc.wait()
+
+
+if __name__ == "__main__":
+    main()
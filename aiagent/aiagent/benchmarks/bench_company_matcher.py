@@ -0,0 +1,85 @@
+"""
+Compare the compiled CompanyMatcher with the original three-loop
+detect_company_from_text at 100, 10k and 100k gazetteer entries.
+
+    python benchmarks/bench_company_matcher.py
+"""
+import os
+import random
+import string
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agent.matcher import CompanyMatcher  # noqa: E402
+
+
+def legacy_detect(text, companies):
+    """The pre-matcher implementation, parametrized by the company list."""
+    if not text:
+        return None
+    t = text.lower()
+    for c in companies:
+        if c == t.strip():
+            return c.title()
+    for c in companies:
+        if c in t:
+            return c.title()
+    words = t.split()
+    for w in words:
+        for c in companies:
+            if w == c:
+                return c.title()
+    return None
+
+
+def make_companies(n, rng):
+    names = set()
+    while len(names) < n:
+        words = rng.randint(1, 3)
+        names.add(" ".join(
+            "".join(rng.choices(string.ascii_lowercase, k=rng.randint(5, 10)))
+            for _ in range(words)
+        ))
+    return sorted(names)
+
+
+def make_text(companies, rng, size=2000, mention=True):
+    filler = "the company is hiring engineers for cloud and data roles in india "
+    text = (filler * (size // len(filler) + 1))[:size]
+    if mention:
+        # mention a late entry so the legacy loops do the most work
+        return text + " " + companies[-1]
+    return text
+
+
+def timeit(fn, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat
+
+
+def main():
+    rng = random.Random(42)
+    print(f"{'entries':>8} {'build s':>8} {'legacy ms':>10} {'matcher ms':>11} {'speedup':>8}")
+    for n in (100, 10_000, 100_000):
+        companies = make_companies(n, rng)
+        t0 = time.perf_counter()
+        matcher = CompanyMatcher.from_names(companies)
+        build = time.perf_counter() - t0
+
+        for mention in (True, False):
+            text = make_text(companies, rng, mention=mention)
+            assert matcher.find(text) == legacy_detect(text, companies)
+            repeat = 20 if n <= 10_000 else 3
+            legacy = timeit(lambda: legacy_detect(text, companies), repeat)
+            compiled = timeit(lambda: matcher.find(text), 50)
+            label = f"{n}{'' if mention else '*'}"
+            print(f"{label:>8} {build:8.2f} {legacy * 1000:10.2f} {compiled * 1000:11.3f} {legacy / compiled:7.1f}x")
+    print("* = text with no company mention")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+call_gemini_rest against the local stub with injected errors and tail
+latency: no resilience vs. retries vs. retries + hedging, then a fully
+failing upstream to show the breaker failing fast into DEFAULT_OPTIONS.
+
+    python benchmarks/bench_resilience.py --calls 200 --concurrency 16 \
+        --error-rate 0.05 --slow-rate 0.03 --slow-ms 4000
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+sys.path.insert(0, os.path.dirname(HERE))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "aiagent.settings")
+
+from stub_upstream import start_stub  # noqa: E402
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+
+def run(utils, calls, concurrency):
+    latencies, errors = [], 0
+
+    def one(i):
+        start = time.perf_counter()
+        try:
+            # distinct prompts so single-flight does not merge them
+            utils.call_gemini_rest(f"benchmark prompt {i} {time.time()}", timeout=20)
+            return time.perf_counter() - start
+        except Exception:
+            return None
+
+    with ThreadPoolExecutor(concurrency) as pool:
+        for result in pool.map(one, range(calls)):
+            if result is None:
+                errors += 1
+            else:
+                latencies.append(result)
+    return latencies, errors
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--calls", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--gemini-ms", type=float, default=200)
+    parser.add_argument("--error-rate", type=float, default=0.05)
+    parser.add_argument("--slow-rate", type=float, default=0.03)
+    parser.add_argument("--slow-ms", type=float, default=4000)
+    args = parser.parse_args()
+
+    stub, config = start_stub(gemini_ms=args.gemini_ms, tavily_ms=0, error_rate=args.error_rate,
+                              slow_rate=args.slow_rate, slow_ms=args.slow_ms)
+    os.environ["GEMINI_API_BASE"] = f"http://127.0.0.1:{stub.server_address[1]}"
+    os.environ["GEMINI_API_KEY"] = "stub"
+
+    import django
+    django.setup()
+    from agent import utils
+    from agent.resilience import ResilientUpstream
+
+    scenarios = [
+        ("none", dict(retries=0)),
+        ("retry", dict(retries=2, backoff_base=0.05)),
+        ("retry+hedge", dict(retries=2, backoff_base=0.05, hedge=True, hedge_min_ms=args.gemini_ms * 1.5)),
+    ]
+    print(f"{'scenario':<12} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>7}  counters")
+    for name, conf in scenarios:
+        utils.gemini_upstream = ResilientUpstream("gemini", breaker_failures=10 ** 6, **conf)
+        latencies, errors = run(utils, args.calls, args.concurrency)
+        print(f"{name:<12} {percentile(latencies, 50) * 1000:>8.0f} {percentile(latencies, 95) * 1000:>8.0f} "
+              f"{percentile(latencies, 99) * 1000:>8.0f} {errors:>7}  {utils.gemini_upstream.stats()}")
+
+    # upstream hard down: the breaker opens and options fall back instantly
+    config.error_rate = 1.0
+    utils.gemini_upstream = ResilientUpstream("gemini", retries=1, backoff_base=0.05, breaker_failures=3)
+    for i in range(6):
+        start = time.perf_counter()
+        options = utils.dynamic_options_ai("company", f"Company {i}", "", "")
+        print(f"options call {i}: {(time.perf_counter() - start) * 1000:6.0f} ms  "
+              f"fallback={options == utils.DEFAULT_OPTIONS}  state={utils.gemini_upstream.breaker.state}")
+    print("upstream calls:", config.calls)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+Cost of continuing a session of 10, 100 and 1000 turns: reading the
+follow-up context through the full history vs. the denormalized session
+head, and appending one more turn. Uses a throwaway SQLite file.
+
+    python benchmarks/bench_session_head.py
+"""
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "aiagent.settings")
+
+import django  # noqa: E402
+from django.conf import settings  # noqa: E402
+
+DB_PATH = os.path.join(tempfile.mkdtemp(), "bench.sqlite3")
+settings.DATABASES["default"]["NAME"] = DB_PATH
+django.setup()
+
+from django.core.management import call_command  # noqa: E402
+from agent.models import Session, Turn  # noqa: E402
+
+ANSWER = '{"summary": "%s", "steps": ["a", "b", "c"]}' % ("x" * 3000)
+
+
+def make_session(turns):
+    s = Session.objects.create(company="Microsoft", last_topic="company")
+    Turn.objects.bulk_create([
+        Turn(session=s, ordinal=i, question=f"q{i}", topic="company", company="Microsoft",
+             answer_json=ANSWER, answer_raw=ANSWER, options=["a", "b", "c", "d", "e", "f"])
+        for i in range(1, turns + 1)
+    ])
+    s.turn_count = turns
+    s.head_answer_json = ANSWER
+    s.head_options = ["a", "b", "c", "d", "e", "f"]
+    s.save()
+    return s.id
+
+
+def bench(fn, repeat=30):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def main():
+    call_command("migrate", verbosity=0)
+    print(f"{'turns':>6} {'full history ms':>16} {'head ms':>8} {'append ms':>10}")
+    for turns in (10, 100, 1000):
+        sid = make_session(turns)
+
+        def via_history():
+            Session.objects.get(id=sid).history[-1]
+
+        def via_head():
+            Session.objects.get(id=sid).head()
+
+        def append():
+            Session.objects.get(id=sid).append_history(
+                {"question": "more", "topic": "company", "answer_json": ANSWER, "answer_raw": ANSWER}
+            )
+
+        print(f"{turns:>6} {bench(via_history):16.2f} {bench(via_head):8.2f} {bench(append, 10):10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+Micro-benchmark for TopicClassifier.rank against the original sequential
+substring scans of detect_topic and against its previous two-pass scoring
+(a TOKEN_RE scan plus a phrase regex), on a short question plus ~10 KB of
+snippets.
+
+    python benchmarks/bench_topic_classifier.py
+"""
+import os
+import re
+import sys
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agent.classifier import TOKEN_RE, TopicClassifier  # noqa: E402
+
+
+def legacy_topic(user_text, tavily_snippets=""):
+    """The pre-classifier keyword scans (company detection left out)."""
+    text = (user_text or "").lower() + " " + (tavily_snippets or "").lower()
+    if any(k in text for k in ["job", "hiring", "resume", "interview", "salary", "careers"]):
+        return "job"
+    if any(k in text for k in ["stock", "invest", "investment", "portfolio", "sip", "nifty", "crypto", "mutual fund"]):
+        return "finance"
+    if any(k in text for k in ["game", "gaming", "unity", "unreal", "developer", "gamedev"]):
+        return "gaming"
+    if any(k in text for k in ["python", "java", "c++", "leetcode", "algorithm", "debug"]):
+        return "coding"
+    return "general"
+
+
+class TwoPassClassifier(TopicClassifier):
+    """The previous scoring: a regex match per token, then a phrase regex pass."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        phrases = [w.lower() for words in self.keywords.values() for w in words if " " in w]
+        self._phrase_hits = {
+            p: [(t, ws[p]) for t, ws in self.keywords.items() if p in ws] for p in phrases
+        }
+        self._phrase_re = re.compile(
+            r"\b(" + "|".join(re.escape(p) for p in sorted(phrases, key=len, reverse=True)) + r")\b"
+        )
+
+    def _score(self, text, factor, scores):
+        if not text:
+            return
+        text = text.lower()
+        for token, count in Counter(TOKEN_RE.findall(text)).items():
+            for topic, weight in self._table.get(token, ()):
+                scores[topic] += weight * count * factor
+        for phrase, count in Counter(self._phrase_re.findall(text)).items():
+            for topic, weight in self._phrase_hits[phrase]:
+                scores[topic] += weight * count * factor
+
+
+SNIPPET = (
+    "- Learn Python the right way\n  URL: https://example.com/python\n"
+    "  Snippet: A practical guide to algorithms, debugging and leetcode "
+    "practice for engineers preparing for technical rounds in 2025.\n"
+)
+
+
+def bench(fn, repeat=2000):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat * 1e6
+
+
+def main():
+    question = "how should I prepare for a python coding round?"
+    snippets = (SNIPPET * (10_240 // len(SNIPPET) + 1))[:10_240]
+    clf = TopicClassifier()
+    two_pass = TwoPassClassifier()
+
+    print(f"input: {len(question) + len(snippets)} bytes")
+    print(f"legacy       {bench(lambda: legacy_topic(question, snippets)):8.1f} us  -> {legacy_topic(question, snippets)}")
+    print(f"two-pass     {bench(lambda: two_pass.rank(question, snippets)):8.1f} us  -> {two_pass.rank(question, snippets)}")
+    print(f"classifier   {bench(lambda: clf.rank(question, snippets)):8.1f} us  -> {clf.rank(question, snippets)}")
+
+
+if __name__ == "__main__":
+    main()
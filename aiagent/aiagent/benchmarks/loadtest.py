@@ -0,0 +1,335 @@
+"""
+Offline load test: runs the app under a real server against the local
+Gemini/Tavily stub and drives /api/query/, /api/followup/ and
+/api/session/ at each requested concurrency. Prints a table and writes
+throughput and p50/p95/p99 per scenario to JSON, so runs on different
+commits can be compared.
+
+    pip install -r requirements.txt   # gunicorn and uvicorn
+    python benchmarks/loadtest.py --concurrency 1 10 50 --requests 200 \
+        --gemini-ms 800 --dist lognormal --error-rate 0.02 --output before.json
+    ... change something ...
+    python benchmarks/loadtest.py ... --output after.json --compare before.json
+
+Upstream rate limits are lifted for the run (--keep-rate-limits to keep
+them); any other setting can be overridden with --setting NAME=<json>,
+e.g. compare LLM calls per request and latency of the options modes:
+
+    python benchmarks/loadtest.py --setting AGENT_OPTIONS_MODE='"inline"' --output inline.json
+    python benchmarks/loadtest.py --setting AGENT_OPTIONS_MODE='"combined"' --compare inline.json
+
+Follow-ups pick an option the way the app does: once the session's options
+are ready (long-polling /api/session/<id>/options/, untimed), one at a time
+per session. The run exits non-zero when more than --max-error-rate of any
+scenario's responses are errors, since its latencies would then describe
+error responses.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from datetime import datetime, timezone
+
+import httpx
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+PROJECT = os.path.dirname(HERE)
+sys.path.insert(0, HERE)
+
+from stub_upstream import add_stub_arguments, start_stub, stub_kwargs  # noqa: E402
+
+SCENARIOS = ("query", "query_stream", "followup", "session")
+LLM_CALLS = ("generateContent", "streamGenerateContent")
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_for_port(port, timeout=20):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        with socket.socket() as s:
+            if s.connect_ex(("127.0.0.1", port)) == 0:
+                return
+        time.sleep(0.1)
+    raise RuntimeError(f"server on port {port} did not start")
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+
+def server_cmd(kind, port, threads, workers=1):
+    if kind == "gthread":
+        return [sys.executable, "-m", "gunicorn", "aiagent.wsgi:application", "-b", f"127.0.0.1:{port}",
+                "-w", str(workers), "-k", "gthread", "--threads", str(threads)]
+    return [sys.executable, "-m", "uvicorn", "aiagent.asgi:application", "--host", "127.0.0.1",
+            "--port", str(port), "--workers", str(workers), "--log-level", "warning"]
+
+
+def write_settings(overrides, keep_rate_limits):
+    """A settings module layered over aiagent.settings; returns its directory."""
+    lines = ["from aiagent.settings import *  # noqa: F401,F403"]
+    if not keep_rate_limits:
+        lines.append("AGENT_RATE_LIMITS = {}")
+    for name, value in overrides.items():
+        lines.append(f"{name} = {value!r}")
+    path = tempfile.mkdtemp()
+    with open(os.path.join(path, "loadtest_settings.py"), "w") as f:
+        f.write("\n".join(lines) + "\n")
+    return path
+
+
+def parse_setting(text):
+    name, _, value = text.partition("=")
+    try:
+        return name, json.loads(value)
+    except ValueError:
+        return name, value
+
+
+# ---------------------------------------------------------
+# REQUEST DRIVER
+# ---------------------------------------------------------
+OPTIONS_WAIT = 20      # seconds per options long-poll (the sync view holds it for at most 5)
+OPTIONS_POLLS = 12
+# Django buffers a sync stream under ASGI: uvicorn gets the async stream view
+STREAM_PATHS = {"gthread": "/api/query/stream/", "uvicorn": "/api/async/query/stream/"}
+
+
+def make_request(scenario, i, sessions, questions, server="gthread"):
+    question = f"{random.choice(('microsoft', 'google', 'amazon'))} interview process {i % questions if questions else i}"
+    if scenario == "query":
+        return "POST", "/api/query/", {"question": question}
+    if scenario == "query_stream":
+        return "POST", STREAM_PATHS[server], {"question": question}
+    if scenario == "followup":
+        return "POST", "/api/followup/", {"session_id": sessions[i % len(sessions)], "option_index": i % 6 + 1}
+    return "GET", f"/api/session/{random.choice(sessions)}/?limit=20", None
+
+
+async def wait_for_options(client, session_id):
+    """Long-poll until the session's latest turn has options; False if it never did."""
+    for _ in range(OPTIONS_POLLS):
+        r = await client.get(f"/api/session/{session_id}/options/", params={"wait": OPTIONS_WAIT},
+                             timeout=OPTIONS_WAIT + 30)
+        if r.status_code != 200:
+            return False
+        if r.json()["options_status"] != "pending":
+            return True
+    return False
+
+
+async def drive(base_url, scenario, concurrency, total, sessions, questions, server="gthread"):
+    latencies, statuses = [], Counter()
+    sem = asyncio.Semaphore(concurrency)
+    limits = httpx.Limits(max_connections=concurrency + len(sessions), max_keepalive_connections=concurrency)
+    # one follow-up at a time per session, like its user clicking an option
+    session_locks = {sid: asyncio.Lock() for sid in sessions}
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=120, limits=limits) as client:
+        async def one(i):
+            method, path, body = make_request(scenario, i, sessions, questions, server)
+            if scenario == "followup":
+                async with session_locks[body["session_id"]]:
+                    await wait_for_options(client, body["session_id"])
+                    await timed(method, path, body)
+            else:
+                await timed(method, path, body)
+
+        async def timed(method, path, body):
+            async with sem:
+                start = time.perf_counter()
+                try:
+                    async with client.stream(method, path, json=body) as r:
+                        async for _ in r.aiter_raw():
+                            pass  # streamed answers count once fully received
+                    status = r.status_code
+                except httpx.HTTPError as e:
+                    status = type(e).__name__
+                statuses[str(status)] += 1
+                if isinstance(status, int) and status < 400:
+                    latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(total)))
+        elapsed = time.perf_counter() - start
+
+    return {
+        "scenario": scenario,
+        "concurrency": concurrency,
+        "requests": total,
+        "ok": len(latencies),
+        "errors": total - len(latencies),
+        "error_rate": round((total - len(latencies)) / total, 3),
+        "statuses": dict(statuses),
+        "duration_s": round(elapsed, 3),
+        "throughput_rps": round(len(latencies) / elapsed, 2),
+        "mean_ms": round(sum(latencies) / len(latencies) * 1000, 1) if latencies else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+    }
+
+
+async def create_sessions(base_url, count):
+    async with httpx.AsyncClient(base_url=base_url, timeout=120) as client:
+        responses = await asyncio.gather(*(
+            client.post("/api/query/", json={"question": f"microsoft careers seed {i}"}) for i in range(count)
+        ))
+        sessions = [r.json()["session_id"] for r in responses if r.status_code == 201]
+        if not sessions:
+            raise RuntimeError("could not create seed sessions: %s" % [r.status_code for r in responses])
+        # background options must land before follow-ups can pick one
+        ready = await asyncio.gather(*(wait_for_options(client, sid) for sid in sessions))
+    if not all(ready):
+        raise RuntimeError(f"{ready.count(False)} of {len(sessions)} seed sessions never got options")
+    return sessions
+
+
+# ---------------------------------------------------------
+# REPORTING
+# ---------------------------------------------------------
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=PROJECT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_table(results, baseline=None):
+    previous = {(r["scenario"], r["concurrency"]): r for r in (baseline or {}).get("results", [])}
+    print(f"{'scenario':<13} {'conc':>5} {'rps':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>7} {'llm/req':>8}")
+    for r in results:
+        line = (f"{r['scenario']:<13} {r['concurrency']:>5} {r['throughput_rps']:>8} {r['p50_ms']:>8} "
+                f"{r['p95_ms']:>8} {r['p99_ms']:>8} {r['errors']:>7} {r.get('llm_calls_per_request', '-'):>8}")
+        old = previous.get((r["scenario"], r["concurrency"]))
+        if old:
+            deltas = []
+            for key in ("throughput_rps", "p50_ms", "p95_ms", "p99_ms", "llm_calls_per_request"):
+                if old.get(key):
+                    deltas.append(f"{key.split('_')[0]} {(r[key] - old[key]) / old[key] * 100:+.0f}%")
+            line += "   vs baseline: " + ", ".join(deltas)
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=["query", "followup", "session"])
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 10, 50])
+    parser.add_argument("--requests", type=int, default=200, help="requests per scenario and concurrency")
+    parser.add_argument("--questions", type=int, default=0,
+                        help="distinct questions to cycle through (0: all distinct, i.e. no cache hits)")
+    parser.add_argument("--sessions", type=int, default=20,
+                        help="seed sessions for followup/session (at least the highest concurrency for followup)")
+    parser.add_argument("--server", choices=("gthread", "uvicorn"), default="gthread")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--threads", type=int, default=16, help="gunicorn gthread threads per worker")
+    parser.add_argument("--setting", action="append", default=[], metavar="NAME=JSON",
+                        help="override a Django setting for the run, e.g. AGENT_BATCH_PARALLELISM=8")
+    parser.add_argument("--keep-rate-limits", action="store_true")
+    parser.add_argument("--options-worker", action="store_true",
+                        help="also run manage.py run_options_worker (background options mode)")
+    parser.add_argument("--max-error-rate", type=float, default=0.5,
+                        help="fail the run when a scenario has a larger share of error responses")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", default="loadtest.json")
+    parser.add_argument("--compare", help="earlier --output file to diff against")
+    add_stub_arguments(parser)
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    stub, stub_config = start_stub(**stub_kwargs(args))
+    stub_url = f"http://127.0.0.1:{stub.server_address[1]}"
+    overrides = dict(parse_setting(s) for s in args.setting)
+    if not args.questions:
+        # all-distinct questions would still hit near-duplicate cached answers
+        overrides.setdefault("AGENT_ANSWER_CACHE", {"enabled": False})
+    if not args.options_worker:
+        # no worker: options polls generate pending options straight away
+        overrides.setdefault("AGENT_OPTIONS_INLINE_AFTER", 0)
+    settings_dir = write_settings(overrides, args.keep_rate_limits)
+    env = dict(
+        os.environ, DJANGO_SETTINGS_MODULE="loadtest_settings",
+        PYTHONPATH=os.pathsep.join(filter(None, [settings_dir, PROJECT, os.environ.get("PYTHONPATH")])),
+        DJANGO_DB_PATH=os.path.join(settings_dir, "loadtest.sqlite3"),
+        GEMINI_API_BASE=stub_url, TAVILY_API_BASE=stub_url, GEMINI_API_KEY="stub", TAVILY_API_KEY="stub",
+    )
+    subprocess.run([sys.executable, "manage.py", "migrate", "-v", "0"], cwd=PROJECT, env=env, check=True)
+
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    proc = subprocess.Popen(server_cmd(args.server, port, args.threads, args.workers), cwd=PROJECT, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    worker = None
+    if args.options_worker:
+        worker = subprocess.Popen([sys.executable, "manage.py", "run_options_worker"], cwd=PROJECT, env=env,
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    results = []
+    try:
+        wait_for_port(port)
+        sessions = []
+        if {"followup", "session"} & set(args.scenarios):
+            count = args.sessions
+            if "followup" in args.scenarios:
+                count = max(count, *args.concurrency)   # else follow-ups queue on session locks
+            sessions = asyncio.run(create_sessions(base_url, count))
+        for scenario in args.scenarios:
+            for conc in args.concurrency:
+                before = sum(stub_config.calls[name] for name in LLM_CALLS)
+                result = asyncio.run(drive(base_url, scenario, conc, args.requests, sessions, args.questions, args.server))
+                # Gemini calls made while serving this run (options jobs finishing
+                # after it are counted with the next one)
+                llm_calls = sum(stub_config.calls[name] for name in LLM_CALLS) - before
+                result["llm_calls"] = llm_calls
+                result["llm_calls_per_request"] = round(llm_calls / result["requests"], 2)
+                results.append(result)
+    finally:
+        for p in filter(None, (proc, worker)):
+            p.terminate()
+            p.wait()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_table(results, baseline)
+
+    report = {
+        "commit": git_commit(),
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "cpus": os.cpu_count(),
+        "config": {k: v for k, v in vars(args).items() if k not in ("output", "compare")},
+        "upstream_calls": stub_config.calls,
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"wrote {args.output}")
+
+    failed = [r for r in results if r["error_rate"] > args.max_error_rate]
+    for r in failed:
+        print(f"FAILED: {r['scenario']} at concurrency {r['concurrency']}: "
+              f"{r['errors']} of {r['requests']} responses were errors {r['statuses']}", file=sys.stderr)
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,220 @@
+"""
+Local stand-in for the Gemini and Tavily HTTP APIs, so the app can be
+benchmarked without calling paid services. Point the app at it with
+
+    GEMINI_API_BASE=http://127.0.0.1:8900 TAVILY_API_BASE=http://127.0.0.1:8900
+
+Run standalone:  python benchmarks/stub_upstream.py --port 8900 --gemini-ms 800
+
+Serves :generateContent, :streamGenerateContent (SSE, the answer split into
+chunks spread over the call's latency) and Tavily /search.
+
+Latency is --gemini-ms / --tavily-ms, either fixed or drawn from a
+distribution with that median (--dist uniform|lognormal, --jitter). Calls
+can be made to fail (--error-rate, --tavily-error-rate, --error-status) or
+to be slow now and then (--slow-rate, --slow-ms) to exercise retries and
+hedging.
+"""
+import argparse
+import json
+import math
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ANSWER = {
+    "summary": "Stub answer generated locally for benchmarking.",
+    "steps": ["Step one", "Step two", "Step three"],
+    "details": "x" * 2000,
+    "example": "Example",
+}
+OPTIONS = {"options": [f"Stub follow-up {i}" for i in range(1, 7)]}
+PROFILE = {
+    "company_name": "Stub Corp", "industry": "Software", "founding_year": "1999",
+    "headquarters": "Stub City", "ceo": "A. Stub", "employee_count": "10,000",
+    "global_presence": "Worldwide", "work_culture": "Collaborative",
+    "tech_stack": ["Python", "Go"], "products_services": ["Stubs", "Mocks"],
+    "competitors": ["Fake Inc", "Dummy Ltd"],
+}
+RESULTS = {"results": [
+    {"title": f"Result {i}", "url": f"https://example.com/{i}", "snippet": "Stub snippet " * 10}
+    for i in range(6)
+]}
+STREAM_CHUNKS = 8
+
+
+class StubConfig:
+    def __init__(self, gemini_ms=800, tavily_ms=300, error_rate=0.0, error_status=503,
+                 slow_rate=0.0, slow_ms=5000, dist="fixed", jitter=0.3, tavily_error_rate=0.0):
+        self.gemini_ms = gemini_ms
+        self.tavily_ms = tavily_ms
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.slow_rate = slow_rate
+        self.slow_ms = slow_ms
+        self.dist = dist
+        self.jitter = jitter
+        self.tavily_error_rate = tavily_error_rate
+        self.calls = {"generateContent": 0, "streamGenerateContent": 0, "search": 0, "errors": 0, "slow": 0}
+        self.lock = threading.Lock()
+
+    def sample(self, median_ms):
+        """One latency (seconds) with the given median."""
+        if self.dist == "uniform":
+            ms = random.uniform(median_ms * (1 - self.jitter), median_ms * (1 + self.jitter))
+        elif self.dist == "lognormal":
+            ms = median_ms * math.exp(random.gauss(0, self.jitter))
+        else:
+            ms = median_ms
+        return max(ms, 0) / 1000
+
+    def gemini_delay(self):
+        """Latency for one Gemini call: usually around gemini_ms, sometimes slow_ms."""
+        if random.random() < self.slow_rate:
+            self.count("slow")
+            return self.slow_ms / 1000
+        return self.sample(self.gemini_ms)
+
+    def tavily_delay(self):
+        return self.sample(self.tavily_ms)
+
+    def error(self, rate):
+        """HTTP status to fail this call with, or None."""
+        if random.random() < rate:
+            self.count("errors")
+            return self.error_status
+        return None
+
+    def gemini_error(self):
+        return self.error(self.error_rate)
+
+    def count(self, name):
+        with self.lock:
+            self.calls[name] += 1
+
+
+def _answer_text(body):
+    prompt = body["contents"][0]["parts"][0]["text"]
+    if "follow-up options" in prompt:
+        return json.dumps(OPTIONS)
+    if "reference profile" in prompt:
+        return json.dumps(PROFILE)
+    if "follow_up_options" in prompt:   # AGENT_OPTIONS_MODE = "combined"
+        return json.dumps({**ANSWER, "follow_up_options": OPTIONS["options"]})
+    return json.dumps(ANSWER)
+
+
+def make_handler(config):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            if ":generateContent" in self.path:
+                config.count("generateContent")
+                if not self._maybe_fail(config.gemini_error()):
+                    time.sleep(config.gemini_delay())
+                    self._json({"candidates": [{"content": {"parts": [{"text": _answer_text(body)}]}}]})
+            elif ":streamGenerateContent" in self.path:
+                config.count("streamGenerateContent")
+                if not self._maybe_fail(config.gemini_error()):
+                    self._stream(_answer_text(body), config.gemini_delay())
+            elif self.path.startswith("/search"):
+                config.count("search")
+                if not self._maybe_fail(config.error(config.tavily_error_rate)):
+                    time.sleep(config.tavily_delay())
+                    self._json(RESULTS)
+            else:
+                self._json({"error": "not found"}, status=404)
+
+        def _maybe_fail(self, status):
+            if status:
+                self._json({"error": {"code": status}}, status=status, headers={"Retry-After": "0"})
+            return bool(status)
+
+        def _json(self, data, status=200, headers=None):
+            raw = json.dumps(data).encode()
+            self.send_response(status)
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(raw)))
+            self.end_headers()
+            self._write(raw)
+
+        def _stream(self, text, delay):
+            """The answer as SSE events over `delay` seconds, chunked encoding."""
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            size = math.ceil(len(text) / STREAM_CHUNKS)
+            for i in range(0, len(text), size):
+                time.sleep(delay / STREAM_CHUNKS)
+                event = {"candidates": [{"content": {"parts": [{"text": text[i:i + size]}]}}]}
+                data = f"data: {json.dumps(event)}\r\n\r\n".encode()
+                if not self._write(b"%x\r\n%s\r\n" % (len(data), data)):
+                    return
+            self._write(b"0\r\n\r\n")
+
+        def _write(self, raw):
+            try:
+                self.wfile.write(raw)
+                self.wfile.flush()
+                return True
+            except (BrokenPipeError, ConnectionResetError):
+                return False  # client gave up, e.g. the losing half of a hedged request
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+
+def start_stub(port=0, **kwargs):
+    """Start the stub in a daemon thread; returns (server, config)."""
+    config = StubConfig(**kwargs)
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(config))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, config
+
+
+def add_stub_arguments(parser):
+    """Upstream behaviour flags shared by the benchmarks that use the stub."""
+    parser.add_argument("--gemini-ms", type=float, default=800, help="median Gemini latency")
+    parser.add_argument("--tavily-ms", type=float, default=300, help="median Tavily latency")
+    parser.add_argument("--dist", choices=("fixed", "uniform", "lognormal"), default="fixed")
+    parser.add_argument("--jitter", type=float, default=0.3,
+                        help="uniform: +/- fraction of the median; lognormal: sigma")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of Gemini calls that fail")
+    parser.add_argument("--tavily-error-rate", type=float, default=0.0)
+    parser.add_argument("--error-status", type=int, default=503)
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="fraction of Gemini calls that are slow")
+    parser.add_argument("--slow-ms", type=float, default=5000)
+
+
+def stub_kwargs(args):
+    return {
+        "gemini_ms": args.gemini_ms, "tavily_ms": args.tavily_ms, "dist": args.dist, "jitter": args.jitter,
+        "error_rate": args.error_rate, "tavily_error_rate": args.tavily_error_rate,
+        "error_status": args.error_status, "slow_rate": args.slow_rate, "slow_ms": args.slow_ms,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8900)
+    add_stub_arguments(parser)
+    args = parser.parse_args()
+    server, _ = start_stub(args.port, **stub_kwargs(args))
+    print(f"stub upstream on http://127.0.0.1:{server.server_address[1]}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()